@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+ROI areas and perimeters of the cohort
+
+Areas (pixel counts) and perimeters of all labels are computed from the
+annotation maps only (thermal_utlis.label_geometry) and cached in the
+dataset index, so cohort statistics never touch temperatures. ROI areas
+are normalised by the silhouette (sum of ROI areas) to compare animals
+photographed at different distances, compactness 4*pi*area/perimeter^2
+(lower for irregular or fragmented ROIs) is used for annotation checks.
+
+usage:
+    python thermal_areas.py   (prints species differences and QA issues)
+"""
+import unittest
+import numpy as np
+import thermal_utlis
+from thermal_utlis import get_name,SCHEMA,ATYPES,INDICES,ANOMALOUS_DONKEY_INDICES
+from thermal_index import pixel_counts,perimeters
+
+#robust z-score above which an annotation is reported
+QA_Z = 3.5
+
+
+def roi_geometry(names):
+    """
+    returns geometry of ROIs of animals (arrays animals x ROIs, in the
+    order of SCHEMA.roi_ids, silhouette: animals)
+
+    returns:
+        dictionary with area, perimeter, silhouette, fraction (area
+        normalised by the silhouette) and compactness
+    """
+    area = pixel_counts(names)[:,SCHEMA.roi_ids].astype(np.int64)
+    perimeter = perimeters(names)[:,SCHEMA.roi_ids].astype(np.int64)
+    silhouette = area.sum(axis=1)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        fraction = area/silhouette[:,np.newaxis].astype(np.float64)
+        compactness = 4*np.pi*area/perimeter.astype(np.float64)**2
+    return {'area':area,'perimeter':perimeter,'silhouette':silhouette,'fraction':fraction,'compactness':compactness}
+
+
+def cohort_geometry(atypes=ATYPES,a_indices=INDICES,anomalous=False):
+    """
+    returns roi_geometry() of the cohort with names and species of rows
+
+    parameters:
+        atypes: animal types
+        a_indices: animal indices
+        anomalous: True/False: include anomalous donkeys
+    """
+    names,species = [],[]
+    for atype in atypes:
+        for i in list(a_indices)+(ANOMALOUS_DONKEY_INDICES if anomalous and atype=='D' else []):
+            names.append(get_name(atype,i))
+            species.append(atype)
+    res = roi_geometry(names)
+    res.update({'names':names,'species':np.array(species)})
+    return res
+
+
+def species_area_differences(a_indices=INDICES):
+    """
+    relative differences between numbers of pixels of ROIs of horses
+    and donkeys (summed over animals)
+
+    returns:
+        dictionary with h, d (pixels of ROIs) and the median, mean and std
+        of relative differences (%)
+
+    raises ValueError if a ROI has no pixels in all animals of a species
+    """
+    h = pixel_counts([get_name('H',i) for i in a_indices])[:,SCHEMA.roi_ids].sum(axis=0)
+    d = pixel_counts([get_name('D',i) for i in a_indices])[:,SCHEMA.roi_ids].sum(axis=0)
+    for atype,counts in [('H',h),('D',d)]:
+        if np.any(counts==0):
+            raise ValueError("ROI {} has no pixels in {} animals {}".format(SCHEMA.roi_ids[np.argmax(counts==0)],atype,list(a_indices)))
+    diff = np.abs(h-d)
+    return {'h':h,'d':d,'median':100*np.mean([np.median(diff/h),np.median(diff/d)])
+            ,'mean':100*np.mean([np.mean(diff/h),np.mean(diff/d)]),'std':100*np.mean([np.std(diff/h),np.std(diff/d)])}
+
+
+def robust_z(x,axis=0):
+    """
+    robust z-scores (median/MAD) along an axis, with a zero MAD values
+    different from the median get +-inf
+    """
+    med = np.median(x,axis=axis,keepdims=True)
+    mad = np.median(np.abs(x-med),axis=axis,keepdims=True)/0.6745
+    with np.errstate(invalid='ignore',divide='ignore'):
+        return np.where(x==med,0.0,(x-med)/mad)
+
+
+def annotation_qa(atypes=ATYPES,a_indices=INDICES,anomalous=True,z=QA_Z):
+    """
+    checks annotations of the cohort, ROIs are compared with the same ROI
+    of other animals of the species
+
+    issues:
+        missing: the ROI has no pixels
+        area: the area fraction of the ROI is atypical (|robust z|>z)
+        shape: the ROI is much less compact than usual (robust z<-z)
+
+    returns:
+        list of issues {animal, roi, issue, value, z}
+    """
+    geo = cohort_geometry(atypes,a_indices,anomalous)
+    issues = []
+    for atype in atypes:
+        rows = np.flatnonzero(geo['species']==atype)
+        checks = [('area',geo['fraction'][rows],lambda v: np.abs(v)>z)
+                  ,('shape',geo['compactness'][rows],lambda v: v<-z)]
+        for issue,values,test in checks:
+            zz = robust_z(np.where(np.isfinite(values),values,0))
+            for i,k in zip(*np.nonzero(test(zz))):
+                if geo['area'][rows[i],k]>0:
+                    issues.append({'animal':geo['names'][rows[i]],'roi':int(SCHEMA.roi_ids[k]),'issue':issue
+                                   ,'value':float(values[i,k]),'z':float(zz[i,k])})
+        for i,k in zip(*np.nonzero(geo['area'][rows]==0)):
+            issues.append({'animal':geo['names'][rows[i]],'roi':int(SCHEMA.roi_ids[k]),'issue':'missing','value':0.0,'z':np.nan})
+    return sorted(issues,key=lambda v: (v['animal'],v['roi'],v['issue']))
+
+
+def print_qa(issues):
+    for v in issues:
+        print ("{} ROI {}: {} ({:0.4f}, z {:0.1f})".format(v['animal'],v['roi'],v['issue'],v['value'],v['z']))
+    print ("{} issue(s)".format(len(issues)))
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from thermal_testing import synthetic_fixture
+        self.tmp = synthetic_fixture(self,indices=[1,2,3,4,5],shape=(30,40))
+
+    def test_geometry(self):
+        data,anno = thermal_utlis.get_animal('D.2')
+        area,perimeter = thermal_utlis.label_geometry(anno)
+        for c in [1,9]:
+            rr,cc = np.nonzero(anno==c)
+            h,w = rr.max()-rr.min()+1,cc.max()-cc.min()+1
+            self.assertEqual(area[c],h*w)
+            self.assertEqual(perimeter[c],2*(h+w))
+        self.assertEqual(area[0]+np.sum(area[1:]),anno.size)
+        geo = roi_geometry(['D.2','H.4'])
+        self.assertSequenceEqual(geo['area'][0].tolist(),[len(v) for v in thermal_utlis.get_animal_rois('D.2')])
+        self.assertTrue(np.allclose(geo['fraction'].sum(axis=1),1))
+        diffs = species_area_differences([1,2,3])
+        self.assertEqual(diffs['mean'],0)
+        from thermal_index import _index
+        for i in [1,2]:
+            fname = self.tmp+'data/da_D.{}.npz'.format(i)
+            arr = dict(np.load(fname))
+            arr['gt'][arr['gt']==4] = 0
+            np.savez_compressed(fname,**arr)
+        _index['file'] = None
+        self.assertEqual(species_area_differences([3])['mean'],0)
+        with self.assertRaisesRegex(ValueError,'ROI 4 has no pixels in D'):
+            species_area_differences([1,2])
+
+    def test_qa(self):
+        from thermal_index import _index
+        self.assertSequenceEqual(annotation_qa(a_indices=[1,2,3,4,5],anomalous=False),[])
+        fname = self.tmp+'data/da_H.2.npz'
+        arr = dict(np.load(fname))
+        anno = arr['gt']
+        anno[anno==4] = 0
+        rr,cc = np.nonzero(anno==7)
+        anno[rr.min()+1:rr.max(),cc.min()+1:cc.max()][::2,::2] = 8
+        np.savez_compressed(fname,**arr)
+        _index['file'] = None
+        issues = annotation_qa(a_indices=[1,2,3,4,5],anomalous=False)
+        found = set((v['animal'],v['roi'],v['issue']) for v in issues)
+        self.assertTrue({('H.2',4,'missing'),('H.2',7,'shape'),('H.2',8,'area')}<=found)
+        self.assertTrue(all(v['animal']=='H.2' for v in issues))
+
+
+if __name__ == '__main__':
+    res = species_area_differences()
+    print ("ROI pixels, H/D median difference: {:0.2f}%, average: {:0.2f}({:0.2f})%".format(res['median'],res['mean'],res['std']))
+    print_qa(annotation_qa())
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Per-pixel species thermal atlas
+
+Every animal is registered to the annotation of a template animal with a
+piecewise-affine mapping: each ROI of the template is mapped onto the same
+ROI of the animal by the affine transform matching their centroids and
+second moments. The warp (a source pixel index for every template pixel)
+is cached per animal (keyed by digests of both archives), per-pixel mean/variance of a species is accumulated
+in a streaming way.
+"""
+import os
+import unittest
+import numpy as np
+from thermal_utlis import get_animal,get_name,SCHEMA,ATYPES,INDICES
+from thermal_validate import get_digest
+
+TEMPLATE_ANIMAL = 'D.3'
+ATLAS_DIR = 'atlas'
+
+
+def _sqrtm(c,inverse=False):
+    """
+    square root (or inverse square root) of a 2x2 covariance matrix
+    """
+    w,v = np.linalg.eigh(c)
+    w = np.maximum(w,1e-6)
+    w = 1/np.sqrt(w) if inverse else np.sqrt(w)
+    return (v*w)@v.T
+
+
+def _moments(anno,c):
+    """
+    returns pixel coordinates of ROI c, their centroid and covariance
+    """
+    yx = np.argwhere(anno==c).astype(np.float64)
+    mu = np.mean(yx,axis=0)
+    cov = np.cov(yx.T) if len(yx)>1 else np.eye(2)
+    return yx,mu,cov
+
+
+def compute_warp(anno,template):
+    """
+    returns the warp of an animal onto the template
+
+    parameters:
+        anno: annotation of the animal
+        template: annotation of the template
+
+    returns:
+        array of flat indices into the animal frame for every template
+        pixel (-1 for the background or pixels mapped outside the ROI)
+    """
+    warp = np.full(template.size,-1,dtype=np.int64)
+    for c in SCHEMA.roi_ids:
+        if not np.any(anno==c) or not np.any(template==c):
+            continue
+        yx_t,mu_t,cov_t = _moments(template,c)
+        _,mu_a,cov_a = _moments(anno,c)
+        A = _sqrtm(cov_a)@_sqrtm(cov_t,inverse=True)
+        src = np.rint((yx_t-mu_t)@A.T+mu_a).astype(np.int64)
+        src[:,0] = np.clip(src[:,0],0,anno.shape[0]-1)
+        src[:,1] = np.clip(src[:,1],0,anno.shape[1]-1)
+        flat = src[:,0]*anno.shape[1]+src[:,1]
+        dst = (yx_t[:,0]*template.shape[1]+yx_t[:,1]).astype(np.int64)
+        valid = anno.ravel()[flat]==c
+        warp[dst[valid]] = flat[valid]
+    return warp
+
+
+def get_warp(name,template_name=TEMPLATE_ANIMAL,cache_dir=ATLAS_DIR):
+    """
+    returns the warp of an animal onto the template animal, cached by
+    digests of both archives
+    """
+    fname = None
+    if cache_dir is not None:
+        fname = os.path.join(cache_dir,'warp_{}_{}_{}_{}.npy'.format(template_name,name,get_digest(template_name)[:16]
+                                                                     ,get_digest(name)[:16]))
+        if os.path.exists(fname):
+            return np.load(fname)
+    _,template = get_animal(template_name)
+    _,anno = get_animal(name)
+    warp = compute_warp(anno,template)
+    if fname is not None:
+        os.makedirs(cache_dir,exist_ok=True)
+        np.save(fname,warp)
+    return warp
+
+
+class Atlas(object):
+    """
+    streaming per-pixel mean/variance of warped frames (Welford)
+    """
+    def __init__(self,shape):
+        self.shape = tuple(shape)
+        self.count = np.zeros(self.shape[0]*self.shape[1],dtype=np.int32)
+        self.mean = np.zeros(self.shape[0]*self.shape[1])
+        self.m2 = np.zeros(self.shape[0]*self.shape[1])
+
+    def add(self,data,warp):
+        """
+        adds a frame warped onto the template
+        """
+        valid = warp>=0
+        x = data.ravel()[warp[valid]]
+        self.count[valid] += 1
+        delta = x-self.mean[valid]
+        self.mean[valid] += delta/self.count[valid]
+        self.m2[valid] += delta*(x-self.mean[valid])
+
+    def get_mean(self):
+        """
+        returns the mean map (nan where no animal contributes)
+        """
+        res = np.where(self.count>0,self.mean,np.nan)
+        return res.reshape(self.shape)
+
+    def get_var(self):
+        """
+        returns the (unbiased) variance map
+        """
+        res = np.where(self.count>1,self.m2/np.maximum(self.count-1,1),np.nan)
+        return res.reshape(self.shape)
+
+    def save(self,fname):
+        np.savez(fname,shape=np.array(self.shape),count=self.count,mean=self.mean,m2=self.m2)
+
+    @staticmethod
+    def load(fname):
+        arr = np.load(fname)
+        res = Atlas(arr['shape'])
+        res.count,res.mean,res.m2 = arr['count'],arr['mean'],arr['m2']
+        return res
+
+
+def build_atlases(atypes=ATYPES,indices=INDICES,template_name=TEMPLATE_ANIMAL,cache_dir=ATLAS_DIR):
+    """
+    builds per-species atlases on the template
+
+    parameters:
+        atypes: animal types
+        indices: animal indices
+        template_name: name of the template animal
+        cache_dir: directory for warps and atlases (or None)
+
+    returns:
+        dictionary {atype: Atlas}
+    """
+    _,template = get_animal(template_name)
+    atlases = {}
+    for atype in atypes:
+        atlas = Atlas(template.shape)
+        for i in indices:
+            name = get_name(atype,i)
+            data,_ = get_animal(name)
+            atlas.add(data,get_warp(name,template_name,cache_dir=cache_dir))
+        atlases[atype] = atlas
+        if cache_dir is not None:
+            atlas.save(os.path.join(cache_dir,'atlas_{}_{}.npz'.format(template_name,atype)))
+    return atlases
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from thermal_testing import synthetic_fixture
+        self.tmp = synthetic_fixture(self,indices=[1,2,3])
+
+    def test_warp(self):
+        _,anno = get_animal('H.1')
+        warp = compute_warp(anno,anno)
+        self.assertTrue(np.array_equal(warp[anno.ravel()>0],np.flatnonzero(anno.ravel()>0)))
+        self.assertTrue(np.all(warp[anno.ravel()==0]==-1))
+        shifted = np.roll(anno,(3,2),axis=(0,1))
+        warp = compute_warp(shifted,anno)
+        self.assertTrue(np.all(shifted.ravel()[warp[warp>=0]]==anno.ravel()[warp>=0]))
+
+    def test_atlas(self):
+        atlases = build_atlases(indices=[1,2,3],template_name='H.1',cache_dir=os.path.join(self.tmp,'atlas'))
+        frames = np.array([get_animal(get_name('D',i))[0] for i in [1,2,3]])
+        _,anno = get_animal('H.1')
+        where = anno>0
+        self.assertTrue(np.allclose(atlases['D'].get_mean()[where],np.mean(frames,axis=0)[where]))
+        self.assertTrue(np.allclose(atlases['D'].get_var()[where],np.var(frames,axis=0,ddof=1)[where]))
+        atlas = Atlas.load(os.path.join(self.tmp,'atlas','atlas_H.1_D.npz'))
+        self.assertTrue(np.array_equal(atlas.count,atlases['D'].count))
+        #an edited annotation is not served from the cache
+        cache = os.path.join(self.tmp,'atlas')
+        warp = get_warp('D.2','H.1',cache_dir=cache)
+        fname = os.path.join(self.tmp,'data','da_D.2.npz')
+        arr = dict(np.load(fname))
+        arr['gt'] = np.roll(arr['gt'],(3,2),axis=(0,1))
+        np.savez_compressed(fname,**arr)
+        self.assertFalse(np.array_equal(get_warp('D.2','H.1',cache_dir=cache),warp))
+        self.assertTrue(np.array_equal(get_warp('D.2','H.1',cache_dir=cache),compute_warp(arr['gt'],get_animal('H.1')[1])))
+
+
+if __name__ == '__main__':
+    build_atlases()
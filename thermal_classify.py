@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Species classifier and anomaly flagging from ROI/GOR features
+
+Features of a frame are mean/std/skew/kurtosis (as in plot_groups) of
+every ROI and GOR, computed from power sums of all labels in one pass.
+Features are cached per animal (keyed by the archive digest), models are
+evaluated with leave-one-animal-out CV (folds run in parallel with joblib)
+and cached by a hash of the training data. An animal is flagged as
+anomalous when the probability of its own species is below a threshold.
+
+usage:
+    python thermal_classify.py [frame.npz ...]   (scores frames, default: CV)
+"""
+import os
+import sys
+import unittest
+import numpy as np
+import thermal_utlis
+from thermal_utlis import get_animal,get_name,GOR_CLASSES,SCHEMA,ATYPES,INDICES,ANOMALOUS_DONKEY_INDICES
+from thermal_validate import get_digest,animal_file
+from thermal_results import array_key
+
+FEATURE_DIR = os.path.join('cache','features')
+MODEL_DIR = os.path.join('cache','models')
+FEATURE_STATS = ['mean','std','skew','kurtosis']
+#min. probability of the own species for a typical animal
+ANOMALY_THRESHOLD = 0.5
+
+
+def frame_features(data,anno,gors=GOR_CLASSES,normalise=False):
+    """
+    returns features of a frame (ROIs followed by GORs x FEATURE_STATS,
+    biased skewness/kurtosis as in scipy.stats)
+
+    parameters:
+        data: 2D array of thermal data
+        anno: 2D array with class map
+        gors: list of GORs (as GOR_CLASSES)
+        normalise: remove the average temperature of all ROIs
+    """
+    a = anno.ravel().astype(np.intp)
+    x = data.ravel().astype(np.float64)
+    #power sums of labels (shifted by the mean of ROIs for stability)
+    shift = np.mean(x[a>0])
+    d = x-shift
+    sums,w = [],np.ones_like(d)
+    for _ in range(5):
+        sums.append(np.bincount(a,weights=w,minlength=SCHEMA.n_labels))
+        w *= d
+    sums = np.stack(sums)[:,SCHEMA.roi_ids]
+    sums = np.concatenate([sums,sums@SCHEMA.gor_matrix(gors).T],axis=1)
+    n = sums[0]
+    with np.errstate(invalid='ignore',divide='ignore'):
+        m1 = sums[1]/n
+        m2 = sums[2]/n-m1**2
+        m3 = sums[3]/n-3*m1*sums[2]/n+2*m1**3
+        m4 = sums[4]/n-4*m1*sums[3]/n+6*m1**2*sums[2]/n-3*m1**4
+        feats = np.stack([m1+(0 if normalise else shift),np.sqrt(m2),m3/m2**1.5,m4/m2**2-3],axis=1)
+    return feats.ravel()
+
+
+def get_features(names,normalise=False,cache_dir=FEATURE_DIR):
+    """
+    returns features of animals, cached per animal and archive digest
+
+    returns:
+        X: features (animals x features)
+    """
+    res = []
+    for name in names:
+        fname = None
+        if cache_dir is not None:
+            fname = os.path.join(cache_dir,'feat_{}_{}_{}{}.npy'.format(name,SCHEMA.name,get_digest(name)[:16],'_norm' if normalise else ''))
+            if os.path.exists(fname):
+                res.append(np.load(fname))
+                continue
+        data,anno = get_animal(name)
+        f = frame_features(data,anno,normalise=normalise)
+        if fname is not None:
+            os.makedirs(cache_dir,exist_ok=True)
+            np.save(fname,f)
+        res.append(f)
+    return np.array(res)
+
+
+def get_dataset(indices=INDICES,anomalous=True,normalise=False,cache_dir=FEATURE_DIR):
+    """
+    returns features, species labels (0: horse, 1: donkey), anomaly
+    labels and names of the dataset animals
+    """
+    names,y,anomaly = [],[],[]
+    for atype in ATYPES:
+        for i in list(indices)+(ANOMALOUS_DONKEY_INDICES if anomalous and atype=='D' else []):
+            names.append(get_name(atype,i))
+            y.append(ATYPES.index(atype))
+            anomaly.append(atype=='D' and i in ANOMALOUS_DONKEY_INDICES)
+    return get_features(names,normalise=normalise,cache_dir=cache_dir),np.array(y),np.array(anomaly),names
+
+
+def make_model(C=1.0):
+    """
+    returns an unfitted classifier (standardisation + logistic regression)
+    """
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.linear_model import LogisticRegression
+    return make_pipeline(StandardScaler(),LogisticRegression(C=C,max_iter=1000))
+
+
+def _clean(X):
+    return np.where(np.isfinite(X),X,0.0)
+
+
+def fit_model(X,y,C=1.0,cache_dir=MODEL_DIR):
+    """
+    returns a fitted classifier, loaded from the cache if it has been
+    trained on the same data before
+    """
+    import joblib
+    fname = None
+    if cache_dir is not None:
+        fname = os.path.join(cache_dir,'model_{}.joblib'.format(array_key(np.column_stack([X,y]),C)))
+        if os.path.exists(fname):
+            return joblib.load(fname)
+    model = make_model(C).fit(_clean(X),y)
+    if fname is not None:
+        os.makedirs(cache_dir,exist_ok=True)
+        joblib.dump(model,fname)
+    return model
+
+
+def _fold(X,y,train,test,C):
+    return make_model(C).fit(_clean(X[train]),y[train]).predict_proba(_clean(X[test]))
+
+
+def cross_validate(X,y,groups=None,C=1.0,n_jobs=-1):
+    """
+    leave-one-animal-out cross-validation (folds in parallel)
+
+    parameters:
+        X: features
+        y: labels
+        groups: animal of every row (None: one row per animal)
+        C: regularisation of the logistic regression
+        n_jobs: number of joblib workers
+
+    returns:
+        held-out class probabilities (rows x classes)
+    """
+    from joblib import Parallel,delayed
+    groups = np.arange(len(y)) if groups is None else np.asarray(groups)
+    folds = [(np.flatnonzero(groups!=g),np.flatnonzero(groups==g)) for g in np.unique(groups)]
+    probs = Parallel(n_jobs=n_jobs)(delayed(_fold)(X,y,train,test,C) for train,test in folds)
+    res = np.zeros((len(y),len(np.unique(y))))
+    for (_,test),p in zip(folds,probs):
+        res[test] = p
+    return res
+
+
+def anomaly_scores(probs,y):
+    """
+    returns probabilities of the own species and anomaly flags
+    """
+    own = probs[np.arange(len(y)),y]
+    return own,own<ANOMALY_THRESHOLD
+
+
+def evaluate(normalise=False,n_jobs=-1,verbose=True):
+    """
+    cross-validates the species classifier on typical animals and scores
+    anomalous donkeys with the model trained on all typical animals
+
+    returns:
+        dictionary with names, y, probabilities of the own species,
+        anomaly flags and the CV accuracy
+    """
+    X,y,anomaly,names = get_dataset(normalise=normalise)
+    probs = np.zeros((len(y),len(ATYPES)))
+    probs[~anomaly] = cross_validate(X[~anomaly],y[~anomaly],n_jobs=n_jobs)
+    probs[anomaly] = fit_model(X[~anomaly],y[~anomaly]).predict_proba(_clean(X[anomaly]))
+    own,flags = anomaly_scores(probs,y)
+    accuracy = np.mean(np.argmax(probs[~anomaly],axis=1)==y[~anomaly])
+    if verbose:
+        print ("LOAO accuracy: {:0.3f}".format(accuracy))
+        for k in np.argsort(own,kind='stable'):
+            print ("{}: {:0.3f}{}".format(names[k],own[k],' *' if flags[k] else ''))
+    return {'names':names,'y':y,'own':own,'flags':flags,'accuracy':accuracy}
+
+
+def score_frames(frames,model=None,normalise=False,n_jobs=1,batch=256):
+    """
+    batch scoring of new frames
+
+    parameters:
+        frames: iterable of (data,anno) or of archive file names (npz with
+            'data' and 'gt')
+        model: fitted classifier (None: trained on the dataset, cached)
+        n_jobs: number of joblib workers for features
+        batch: number of frames per worker task
+
+    returns:
+        class probabilities (frames x classes: H, D)
+    """
+    if model is None:
+        X,y,anomaly,_ = get_dataset(normalise=normalise)
+        model = fit_model(X[~anomaly],y[~anomaly])
+    frames = list(frames)
+    chunks = [frames[i:i+batch] for i in range(0,len(frames),batch)]
+    if n_jobs==1:
+        feats = [_batch_features(c,normalise) for c in chunks]
+    else:
+        from joblib import Parallel,delayed
+        feats = Parallel(n_jobs=n_jobs)(delayed(_batch_features)(c,normalise) for c in chunks)
+    if not feats:
+        return np.zeros((0,len(ATYPES)))
+    return model.predict_proba(_clean(np.concatenate(feats)))
+
+
+def _batch_features(frames,normalise):
+    res = []
+    for f in frames:
+        if isinstance(f,str):
+            arr = np.load(f)
+            f = (arr['data'],arr['gt'])
+        res.append(frame_features(f[0],f[1],normalise=normalise))
+    return np.array(res)
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from thermal_testing import synthetic_fixture
+        self.tmp = synthetic_fixture(self,indices=list(range(1,9)),shape=(30,40))
+
+    def test_features(self):
+        from scipy.stats import skew,kurtosis
+        data,anno = get_animal('D.3')
+        f = frame_features(data,anno).reshape(-1,len(FEATURE_STATS))
+        rois = thermal_utlis.get_animal_rois('D.3')
+        for c in [0,9]:
+            v = rois[c]
+            self.assertTrue(np.allclose(f[c],[np.mean(v),np.std(v),skew(v),kurtosis(v)]))
+        v = np.concatenate([rois[r-1] for r in GOR_CLASSES[1]['roi_group']])
+        self.assertTrue(np.allclose(f[16],[np.mean(v),np.std(v),skew(v),kurtosis(v)]))
+        fn = frame_features(data,anno,normalise=True).reshape(-1,len(FEATURE_STATS))
+        self.assertTrue(np.allclose(fn[:,0],f[:,0]-np.mean(data[anno>0])))
+        cache = os.path.join(self.tmp,'feat')
+        X = get_features(['D.3','H.1'],cache_dir=cache)
+        self.assertEqual(len(os.listdir(cache)),2)
+        self.assertTrue(np.array_equal(get_features(['D.3','H.1'],cache_dir=cache),X))
+
+    def test_classifier(self):
+        names = [get_name(a,i) for a in ATYPES for i in range(1,9)]
+        X = get_features(names,cache_dir=None)
+        y = np.repeat([0,1],8)
+        probs = cross_validate(X,y,n_jobs=2)
+        self.assertTrue(np.mean(np.argmax(probs,axis=1)==y)>=0.75)
+        model = fit_model(X,y,cache_dir=os.path.join(self.tmp,'models'))
+        self.assertEqual(len(os.listdir(os.path.join(self.tmp,'models'))),1)
+        frames = [animal_file(n) for n in names]
+        p = score_frames(frames,model=model,n_jobs=2,batch=5)
+        self.assertTrue(np.allclose(p,model.predict_proba(X)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv)>1:
+        for f,p in zip(sys.argv[1:],score_frames(sys.argv[1:])):
+            print ("{}: H {:0.3f}, D {:0.3f}".format(f,p[0],p[1]))
+    else:
+        evaluate()
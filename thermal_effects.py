@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Effect sizes of GOR comparisons computed from the histogram index
+
+For GORs r, c the common-language effect size (AUC) is
+P(X_r>X_c)+0.5*P(X_r=X_c) = U/(n_r*n_c) and Cliff's delta is 2*AUC-1.
+Histograms of the index put values at bin centres: with temperatures
+rounded to HIST_STEP (as the dataset) both are exact, otherwise values
+within a bin count as ties and values outside [HIST_MIN, HIST_MAX] are
+counted in the edge bins (thermal_index warns about them). All GOR pairs of all animals are computed in one batched pass from
+histograms; confidence intervals come from a bootstrap over animals
+(replicates are weighted sums of per-animal histograms).
+
+vector_effects computes the same effects from sorted GOR vectors (e.g.
+ROIs aggregated to tiles or superpixels, which are not on the grid of the
+index): U statistics of all pairs of animals are merged once and
+bootstrap replicates are weighted sums of them.
+"""
+import unittest
+import numpy as np
+import thermal_utlis
+from thermal_utlis import get_name,GOR_CLASSES,INDICES
+from thermal_index import get_index,hist_centers
+from thermal_ranks import merge_u
+
+
+def gor_histograms(atype='H',a_indices=INDICES,gors=GOR_CLASSES):
+    """
+    returns per-animal GOR histograms on the global grid
+
+    parameters:
+        atype: animal type [H,D]
+        a_indices: animal indices
+        gors: list of GORs (as GOR_CLASSES)
+
+    returns:
+        array (animals x GORs x bins) of counts, bin centres
+    """
+    names = [get_name(atype,a) for a in a_indices]
+    idx = get_index(names)
+    pos = {n:i for i,n in enumerate(idx['names'])}
+    hist = idx['hist'][[pos[n] for n in names]]
+    H = np.stack([hist[:,g['roi_group']].sum(axis=1) for g in gors],axis=1)
+    #trim the empty part of the grid
+    nz = np.flatnonzero(H.sum(axis=(0,1)))
+    lo,hi = (nz[0],nz[-1]+1) if len(nz) else (0,0)
+    return H[:,:,lo:hi].astype(np.float64),hist_centers()[lo:hi]
+
+
+def pair_effects(H):
+    """
+    returns AUC for all pairs of histograms (batched over leading axes)
+
+    parameters:
+        H: array (... x GORs x bins) of counts
+
+    returns:
+        array (... x GORs x GORs) of P(X_r>X_c)+0.5*P(X_r=X_c)
+    """
+    below = np.cumsum(H,axis=-1)-H
+    greater = np.einsum('...rb,...cb->...rc',H,below)
+    ties = np.einsum('...rb,...cb->...rc',H,H)
+    n = H.sum(axis=-1)
+    nn = n[...,:,np.newaxis]*n[...,np.newaxis,:]
+    with np.errstate(invalid='ignore',divide='ignore'):
+        return (greater+0.5*ties)/nn
+
+
+def mean_deltas(H,x):
+    """
+    returns differences of means (values at bin centres) for all pairs of
+    histograms
+    """
+    with np.errstate(invalid='ignore',divide='ignore'):
+        means = (H@x)/H.sum(axis=-1)
+    return means[...,:,np.newaxis]-means[...,np.newaxis,:]
+
+
+def bootstrap_effects(H,x,n_boot=1000,alpha=0.05,seed=0,chunk=50):
+    """
+    bootstrap confidence intervals of pooled effects, resampling animals
+
+    parameters:
+        H: array (animals x GORs x bins) of counts
+        x: bin centres
+        n_boot: number of bootstrap replicates
+        alpha: 1-confidence level
+        seed: random seed
+        chunk: number of replicates computed at once
+
+    returns:
+        dictionary with arrays (2 x GORs x GORs) of lower/upper bounds:
+        auc_ci, cliff_ci, delta_ci
+    """
+    W = _bootstrap_weights(H.shape[0],n_boot,seed)
+    auc,delta = [],[]
+    for i in range(0,n_boot,chunk):
+        Hb = np.einsum('ka,agb->kgb',W[i:i+chunk],H)
+        auc.append(pair_effects(Hb))
+        delta.append(mean_deltas(Hb,x))
+    return _intervals(np.concatenate(auc),np.concatenate(delta),alpha)
+
+
+def _bootstrap_weights(A,n_boot,seed):
+    """
+    returns multiplicities of animals in bootstrap replicates (n_boot x A)
+    """
+    rs = np.random.RandomState(seed)
+    return rs.multinomial(A,np.ones(A)/A,size=n_boot).astype(np.float64)
+
+
+def _intervals(auc,delta,alpha):
+    q = [alpha/2,1-alpha/2]
+    auc_ci = np.quantile(auc,q,axis=0)
+    return {'auc_ci':auc_ci,'cliff_ci':2*auc_ci-1,'delta_ci':np.quantile(delta,q,axis=0)}
+
+
+def effect_sizes(atype='H',a_indices=INDICES,gors=GOR_CLASSES,n_boot=1000,alpha=0.05,seed=0):
+    """
+    computes effect sizes of all GOR pairs of a species
+
+    parameters:
+        atype: animal type [H,D]
+        a_indices: animal indices
+        gors: list of GORs (as GOR_CLASSES)
+        n_boot: number of bootstrap replicates (0: no confidence intervals)
+        alpha: 1-confidence level
+        seed: random seed
+
+    returns:
+        dictionary with auc_global, cliff_global (GORs x GORs),
+        auc_local, cliff_local (GORs x GORs x animals) and bootstrap
+        intervals (see bootstrap_effects)
+    """
+    H,x = gor_histograms(atype,a_indices,gors)
+    auc_local = np.moveaxis(pair_effects(H),0,-1)
+    auc_global = pair_effects(H.sum(axis=0))
+    res = {'auc_global':auc_global,'cliff_global':2*auc_global-1
+           ,'auc_local':auc_local,'cliff_local':2*auc_local-1}
+    if n_boot>0:
+        res.update(bootstrap_effects(H,x,n_boot=n_boot,alpha=alpha,seed=seed))
+    return res
+
+
+def vector_effects(vectors,n_boot=1000,alpha=0.05,seed=0):
+    """
+    computes effect sizes of all GOR pairs from GOR vectors of animals
+
+    parameters:
+        vectors: list (GORs) of lists (animals) of sorted 1D arrays
+        n_boot: number of bootstrap replicates (0: no confidence intervals)
+        alpha: 1-confidence level
+        seed: random seed (replicates are those of effect_sizes)
+
+    returns:
+        dictionary as effect_sizes
+    """
+    N,A = len(vectors),len(vectors[0])
+    n = np.array([[len(v) for v in g] for g in vectors],dtype=np.float64)
+    s = np.array([[np.sum(v) for v in g] for g in vectors])
+    #U[r,c,a,b]: U statistic of animal a in GOR r against animal b in GOR c
+    U = np.zeros((N,N,A,A))
+    for r in range(N):
+        for c in range(r,N):
+            for a in range(A):
+                for b in range(A):
+                    U[r,c,a,b] = merge_u(vectors[r][a],vectors[c][b])[0]
+            U[c,r] = (n[r][:,np.newaxis]*n[c][np.newaxis,:]-U[r,c]).T
+    with np.errstate(invalid='ignore',divide='ignore'):
+        auc_local = np.diagonal(U,axis1=2,axis2=3)/(n[:,np.newaxis,:]*n[np.newaxis,:,:])
+        nt = n.sum(axis=1)
+        auc_global = U.sum(axis=(2,3))/(nt[:,np.newaxis]*nt[np.newaxis,:])
+    res = {'auc_global':auc_global,'cliff_global':2*auc_global-1
+           ,'auc_local':auc_local,'cliff_local':2*auc_local-1}
+    if n_boot>0:
+        W = _bootstrap_weights(A,n_boot,seed)
+        nb,sb = W@n.T,W@s.T
+        with np.errstate(invalid='ignore',divide='ignore'):
+            auc = np.einsum('ka,rcab,kb->krc',W,U,W)/(nb[:,:,np.newaxis]*nb[:,np.newaxis,:])
+            means = sb/nb
+        res.update(_intervals(auc,means[:,:,np.newaxis]-means[:,np.newaxis,:],alpha))
+    return res
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from thermal_testing import synthetic_fixture
+        self.tmp = synthetic_fixture(self,indices=[1,2,3])
+
+    def test_effects(self):
+        from scipy.stats import mannwhitneyu
+        gors = GOR_CLASSES[:3]
+        res = effect_sizes('D',[1,2,3],gors,n_boot=200)
+        rois = {a:thermal_utlis.get_animal_rois(get_name('D',a)) for a in [1,2,3]}
+        gor = lambda a,g: np.concatenate([rois[a][r-1] for r in g['roi_group']])
+        x,y = gor(2,gors[0]),gor(2,gors[2])
+        u = mannwhitneyu(x,y,alternative='greater').statistic
+        self.assertAlmostEqual(res['auc_local'][0,2,1],u/(len(x)*len(y)))
+        x = np.concatenate([gor(a,gors[1]) for a in [1,2,3]])
+        y = np.concatenate([gor(a,gors[0]) for a in [1,2,3]])
+        u = mannwhitneyu(x,y,alternative='greater').statistic
+        self.assertAlmostEqual(res['cliff_global'][1,0],2*u/(len(x)*len(y))-1)
+        self.assertTrue(np.allclose(res['auc_global']+res['auc_global'].T,1))
+        self.assertEqual(res['auc_ci'].shape,(2,3,3))
+        self.assertTrue(np.all(res['auc_ci'][0]<=res['auc_ci'][1]))
+        self.assertTrue(np.all(res['delta_ci'][0]<=res['delta_ci'][1]))
+
+    def test_vectors(self):
+        #values of the synthetic dataset are on the grid: both ways agree
+        gors = GOR_CLASSES[:3]
+        res = effect_sizes('D',[1,2,3],gors,n_boot=100)
+        rois = {a:thermal_utlis.get_animal_rois(get_name('D',a)) for a in [1,2,3]}
+        vectors = [[np.sort(np.concatenate([rois[a][r-1] for r in g['roi_group']])) for a in [1,2,3]] for g in gors]
+        res_v = vector_effects(vectors,n_boot=100)
+        self.assertSequenceEqual(sorted(res_v),sorted(res))
+        for k in res:
+            self.assertTrue(np.allclose(res_v[k],res[k]),k)
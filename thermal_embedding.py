@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Embeddings of ROI features (t-SNE, PCA, UMAP)
+
+Embeddings are seeded and stored in a cache directory keyed by a hash of
+the features and the parameters, so re-plotting needs no refit.
+Distance graphs used by t-SNE (dense for the exact method, kNN for
+Barnes-Hut) are cached per feature set as well; with the PCA
+initialisation computed from the features (pca_init) sklearn gives the
+same embedding as TSNE() fitted on the features.
+The t-SNE variant is chosen by the number of points: exact, Barnes-Hut
+and, with openTSNE installed, FFT-accelerated interpolation.
+UMAP requires umap-learn.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from thermal_results import array_key
+
+#max. number of points for exact / Barnes-Hut t-SNE (method='auto')
+EXACT_MAX = 1000
+BARNES_HUT_MAX = 20000
+EMBEDDING_DIR = 'embeddings'
+
+
+def choose_method(n):
+    """
+    returns the t-SNE variant for n points: 'exact', 'barnes_hut' or 'fft'
+    """
+    if n<=EXACT_MAX:
+        return 'exact'
+    if n<=BARNES_HUT_MAX:
+        return 'barnes_hut'
+    try:
+        import openTSNE
+        return 'fft'
+    except ImportError:
+        return 'barnes_hut'
+
+
+def get_distances(X,n_neighbors=None,cache_dir=EMBEDDING_DIR):
+    """
+    returns the (cached) distance graph of the features
+
+    parameters:
+        X: features (points x features)
+        n_neighbors: None for a dense distance matrix, or a number of
+            nearest neighbours for a sparse kNN graph
+        cache_dir: cache directory or None
+
+    returns:
+        dense array or scipy.sparse CSR matrix of euclidean distances
+    """
+    from scipy import sparse
+    fname = None
+    if cache_dir is not None:
+        fname = os.path.join(cache_dir,'dist_{}.npz'.format(array_key(X,n_neighbors,'self')))
+        if os.path.exists(fname):
+            arr = np.load(fname)
+            if n_neighbors is None:
+                return arr['dist']
+            return sparse.csr_matrix((arr['data'],arr['indices'],arr['indptr']),shape=tuple(arr['shape']))
+    if n_neighbors is None:
+        from scipy.spatial.distance import pdist,squareform
+        res = squareform(pdist(X))
+        arrays = {'dist':res}
+    else:
+        from sklearn.neighbors import NearestNeighbors
+        #the graph includes every point as its own (first) neighbour, as
+        #sklearn.manifold.TSNE expects from a precomputed kNN graph
+        nn = NearestNeighbors(n_neighbors=min(n_neighbors,len(X))).fit(X)
+        res = nn.kneighbors_graph(X,mode='distance').tocsr()
+        arrays = {'data':res.data,'indices':res.indices,'indptr':res.indptr,'shape':np.array(res.shape)}
+    if fname is not None:
+        os.makedirs(cache_dir,exist_ok=True)
+        np.savez(fname,**arrays)
+    return res
+
+
+def pca_init(X,n_components=2,seed=0):
+    """
+    returns the PCA initialisation of t-SNE computed from the features,
+    as init='pca' of sklearn.manifold.TSNE (not available with precomputed
+    distances): PCA scaled to the standard deviation 1e-4 of the 1st axis
+    """
+    from sklearn.decomposition import PCA
+    from sklearn.utils import check_random_state
+    Y = PCA(n_components=n_components,random_state=check_random_state(seed)).fit_transform(X).astype(np.float32)
+    return Y/np.std(Y[:,0])*1e-4
+
+
+def _tsne(X,method,perplexity,n_components,seed,cache_dir):
+    if method=='fft':
+        import openTSNE
+        return np.asarray(openTSNE.TSNE(perplexity=perplexity,random_state=seed
+                                        ,negative_gradient_method='fft').fit(X))
+    from sklearn.manifold import TSNE
+    #sklearn queries 3*perplexity+1 neighbours plus the point itself
+    n_neighbors = None if method=='exact' else int(3*perplexity+1)+1
+    D = get_distances(X,n_neighbors=n_neighbors,cache_dir=cache_dir)
+    #the same embedding as TSNE(init='pca') fitted on X
+    tsne = TSNE(n_components=n_components,perplexity=perplexity,method=method,metric='precomputed'
+                ,init=pca_init(X,n_components,seed),random_state=seed)
+    return tsne.fit_transform(D)
+
+
+def embed(X,method='tsne',seed=0,perplexity=5,n_components=2,cache_dir=EMBEDDING_DIR):
+    """
+    returns a 2D embedding of the features (loaded from the cache if
+    it has been computed before)
+
+    parameters:
+        X: features (points x features)
+        method: 'tsne' (variant chosen by size), 'exact', 'barnes_hut',
+            'fft', 'pca' or 'umap'
+        seed: random seed
+        perplexity: t-SNE perplexity (n_neighbors for UMAP)
+        n_components: number of dimensions
+        cache_dir: cache directory or None (no caching)
+    """
+    X = np.asarray(X,dtype=np.float64)
+    if method=='tsne':
+        method = choose_method(len(X))
+    assert method in ['exact','barnes_hut','fft','pca','umap'],method
+    fname = None
+    if cache_dir is not None:
+        fname = os.path.join(cache_dir,'emb_{}.npy'.format(array_key(X,method,seed,perplexity,n_components,'pca')))
+        if os.path.exists(fname):
+            return np.load(fname)
+    if method=='pca':
+        from sklearn.decomposition import PCA
+        Y = PCA(n_components=n_components,random_state=seed).fit_transform(X)
+    elif method=='umap':
+        import umap
+        Y = umap.UMAP(n_components=n_components,n_neighbors=int(perplexity),random_state=seed).fit_transform(X)
+    else:
+        assert n_components==2 or method=='exact',"Barnes-Hut/FFT t-SNE embeds only into 2D"
+        Y = _tsne(X,method,perplexity,n_components,seed,cache_dir)
+    if fname is not None:
+        os.makedirs(cache_dir,exist_ok=True)
+        np.save(fname,Y)
+    return Y
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        rs = np.random.RandomState(0)
+        self.X = np.vstack([rs.randn(20,15),rs.randn(20,15)+3])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_cache(self):
+        a = embed(self.X,cache_dir=self.tmp)
+        files = sorted(os.listdir(self.tmp))
+        self.assertEqual(len(files),2)
+        b = embed(self.X,cache_dir=self.tmp)
+        self.assertTrue(np.array_equal(a,b))
+        c = embed(self.X,cache_dir=None)
+        self.assertTrue(np.allclose(a,c))
+
+    def test_sklearn(self):
+        from sklearn.manifold import TSNE
+        for method in ['exact','barnes_hut']:
+            Y = TSNE(perplexity=5,method=method,random_state=0).fit_transform(self.X)
+            self.assertTrue(np.allclose(embed(self.X,method=method,cache_dir=self.tmp),Y),method)
+
+    def test_methods(self):
+        self.assertEqual(choose_method(32),'exact')
+        self.assertEqual(choose_method(5000),'barnes_hut')
+        Y = embed(self.X,method='barnes_hut',cache_dir=self.tmp)
+        self.assertEqual(Y.shape,(40,2))
+        Y = embed(self.X,method='pca',cache_dir=None)
+        self.assertNotEqual(np.sign(np.mean(Y[:20,0])),np.sign(np.mean(Y[20:,0])))
+
+
+if __name__ == '__main__':
+    unittest.main()
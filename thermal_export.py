@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Export of ROI/GOR statistics as a long-format table
+(Parquet/Arrow with pyarrow, CSV otherwise)
+"""
+import csv
+import os
+from importlib.util import find_spec
+import unittest
+import numpy as np
+import thermal_utlis
+from thermal_utlis import get_animal,get_name,extract_rois,GOR_CLASSES,SCHEMA,ATYPES,INDICES,ANOMALOUS_DONKEY_INDICES
+from thermal_index import get_bboxes
+
+#pyarrow is optional and imported only when needed
+HAS_PYARROW = find_spec('pyarrow') is not None
+
+
+QUANTILES = [0.05,0.25,0.75,0.95]
+
+#column name, arrow type name
+COLUMNS = [('species','string'),('animal','string'),('index','int16'),('roi','int16'),('gor','string')
+           ,('n_pixels','int64'),('min','float64'),('mean','float64'),('median','float64')
+           ,('max','float64'),('std','float64'),('skew','float64'),('kurtosis','float64')]\
+          +[('q{:02d}'.format(int(round(100*q))),'float64') for q in QUANTILES]
+
+
+def vector_stats(v):
+    """
+    returns statistics of a temperature vector as a dictionary
+    (statistics as in get_roi_differences/plot_roi_histo)
+    """
+    from scipy.stats import skew, kurtosis
+    v = np.asarray(v,dtype=np.float64)
+    res = {'n_pixels':len(v)}
+    if len(v)==0:
+        for c,t in COLUMNS[6:]:
+            res[c] = np.nan
+        return res
+    qs = np.quantile(v,[0.5]+QUANTILES)
+    res.update({'min':np.min(v),'mean':np.mean(v),'median':qs[0],'max':np.max(v)
+                ,'std':np.std(v),'skew':skew(v),'kurtosis':kurtosis(v)})
+    for c,q in zip([c for c,_ in COLUMNS[-len(QUANTILES):]],qs[1:]):
+        res[c] = q
+    return res
+
+
+def roi_stats_rows(atypes=ATYPES,indices=INDICES,anomalous=False,pooled=True,gors=GOR_CLASSES):
+    """
+    computes ROI and GOR statistics for every animal in a single pass
+    over the dataset
+
+    parameters:
+        atypes: animal types
+        indices: animal indices
+        anomalous: True/False: include ANOMALOUS_DONKEY_INDICES
+        pooled: True/False: add rows for ROIs/GORs pooled over all animals
+            of a species (animal=species, index=0)
+        gors: list of GORs (as GOR_CLASSES)
+
+    returns:
+        list of rows (dictionaries with keys from COLUMNS), roi is None
+        for GOR rows and gor is None for ROI rows
+    """
+    rows = []
+    for atype in atypes:
+        a_indices = list(indices)
+        if anomalous and atype=='D':
+            a_indices += ANOMALOUS_DONKEY_INDICES
+        species_rois = [[] for _ in range(SCHEMA.n_rois)]
+        for i in a_indices:
+            name = get_name(atype,i)
+            arr,anno = get_animal(name)
+            rois = extract_rois(arr,anno,get_bboxes(name))
+            rows.extend(_rows(atype,name,i,rois,gors))
+            if pooled:
+                for c in range(SCHEMA.n_rois):
+                    species_rois[c].append(rois[c])
+        if pooled:
+            rois = [np.concatenate(v) for v in species_rois]
+            rows.extend(_rows(atype,atype,0,rois,gors))
+    return rows
+
+
+def _rows(atype,name,index,rois,gors):
+    """
+    returns table rows for ROIs and GORs of one animal
+    """
+    rows = []
+    for c,v in enumerate(rois):
+        row = {'species':atype,'animal':name,'index':index,'roi':int(SCHEMA.roi_ids[c]),'gor':None}
+        row.update(vector_stats(v))
+        rows.append(row)
+    for g in gors:
+        row = {'species':atype,'animal':name,'index':index,'roi':None,'gor':g['group_name']}
+        row.update(vector_stats(np.concatenate([rois[SCHEMA.lut[r]] for r in g['roi_group']])))
+        rows.append(row)
+    return rows
+
+
+def write_roi_stats(rows,path,fmt=None,partition=False):
+    """
+    writes ROI statistics rows as a typed table
+
+    parameters:
+        rows: rows from roi_stats_rows()
+        path: output file (or a directory if partition is True)
+        fmt: 'parquet', 'arrow', 'csv' or None for parquet if pyarrow
+            is available and csv otherwise
+        partition: True/False: partition the table by species
+            (hive-style directories species=H, species=D)
+    returns:
+        used format
+    """
+    if fmt is None:
+        fmt = 'parquet' if HAS_PYARROW else 'csv'
+    assert fmt in ['parquet','arrow','csv'],fmt
+    if fmt!='csv' and not HAS_PYARROW:
+        raise ImportError("pyarrow is required for the {} format".format(fmt))
+    parts = [(None,rows)]
+    if partition:
+        os.makedirs(path,exist_ok=True)
+        parts = [(s,[r for r in rows if r['species']==s]) for s in sorted(set(r['species'] for r in rows))]
+    for species,prows in parts:
+        fname = path if species is None else os.path.join(path,'species={}'.format(species),'part-0.{}'.format(fmt))
+        if species is not None:
+            os.makedirs(os.path.dirname(fname),exist_ok=True)
+        if fmt=='csv':
+            _write_csv(prows,fname)
+        else:
+            _write_arrow(prows,fname,fmt,drop_species=species is not None)
+    return fmt
+
+
+def _write_csv(rows,fname):
+    with open(fname,'w',newline='') as f:
+        w = csv.writer(f)
+        w.writerow([c for c,_ in COLUMNS])
+        for r in rows:
+            w.writerow(['' if r[c] is None else r[c] for c,_ in COLUMNS])
+
+
+def _write_arrow(rows,fname,fmt,drop_species=False):
+    import pyarrow as pa
+    columns = [(c,t) for c,t in COLUMNS if not (drop_species and c=='species')]
+    schema = pa.schema([(c,getattr(pa,t)()) for c,t in columns])
+    table = pa.Table.from_pydict({c:[r[c] for r in rows] for c,_ in columns},schema=schema)
+    if fmt=='parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table,fname)
+    else:
+        import pyarrow.feather as feather
+        feather.write_feather(table,fname)
+
+
+def export_roi_stats(path='roi_stats.parquet',fmt=None,partition=False,anomalous=True):
+    """
+    computes and writes the ROI/GOR statistics table for the dataset
+
+    parameters:
+        path: output file or directory
+        fmt: output format (see write_roi_stats)
+        partition: True/False: partition by species
+        anomalous: True/False: include anomalous donkeys
+    """
+    rows = roi_stats_rows(anomalous=anomalous)
+    if fmt is None and not HAS_PYARROW and path.endswith('.parquet'):
+        path = path[:-len('.parquet')]+'.csv'
+    fmt = write_roi_stats(rows,path,fmt=fmt,partition=partition)
+    print ("{} rows written to {} ({})".format(len(rows),path,fmt))
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from thermal_testing import synthetic_fixture
+        self.tmp = synthetic_fixture(self,indices=[1,2,3])
+
+    def test_rows(self):
+        rows = roi_stats_rows(indices=[1,2,3])
+        self.assertEqual(len(rows),2*4*(15+len(GOR_CLASSES)))
+        rois = thermal_utlis.get_animal_rois('H.2')
+        r = [v for v in rows if v['animal']=='H.2' and v['roi']==4][0]
+        self.assertEqual(r['n_pixels'],len(rois[3]))
+        self.assertAlmostEqual(r['median'],np.median(rois[3]))
+        pooled = [v for v in rows if v['animal']=='D' and v['gor']=='Rump'][0]
+        self.assertEqual(pooled['n_pixels'],sum(len(thermal_utlis.get_animal_rois(get_name('D',i))[r-1])
+                                                for i in [1,2,3] for r in [8,9]))
+
+    def test_csv(self):
+        rows = roi_stats_rows(indices=[1,2,3],pooled=False)
+        write_roi_stats(rows,os.path.join(self.tmp,'out'),fmt='csv',partition=True)
+        with open(os.path.join(self.tmp,'out','species=D','part-0.csv')) as f:
+            lines = list(csv.DictReader(f))
+        self.assertEqual(len(lines),3*(15+len(GOR_CLASSES)))
+
+    @unittest.skipIf(not HAS_PYARROW,'pyarrow not available')
+    def test_parquet(self):
+        import pyarrow.parquet as pq
+        rows = roi_stats_rows(indices=[1,2,3])
+        write_roi_stats(rows,os.path.join(self.tmp,'out.parquet'),fmt='parquet')
+        table = pq.read_table(os.path.join(self.tmp,'out.parquet'))
+        self.assertEqual(table.num_rows,len(rows))
+        self.assertEqual(str(table.schema.field('n_pixels').type),'int64')
+
+
+if __name__ == '__main__':
+    export_roi_stats()
@@ -29,8 +29,10 @@ Histograms for GORs
 
 import matplotlib.pyplot as plt
 import numpy as np
-from thermal_utlis import get_name,get_animal_rois,GOR_CLASSES,INDICES,GLOBAL_SHOW
-from scipy.stats import mannwhitneyu
+from thermal_utlis import get_name,GOR_CLASSES,SCHEMA,INDICES,GLOBAL_SHOW
+from thermal_index import get_histogram,rebin
+from thermal_stats import stats_species_gors
+from thermal_stats import get_roi_group_a as get_roi_group_a_animals
 
 
    
@@ -45,40 +47,7 @@ def get_roi_group_a(atype='H',roi_group=[8,9]):
     return:
         vector of temperature values of all animals in GOR
     """
-    data = []
-    for i in INDICES:
-        name=get_name(atype,i)
-        rois = get_animal_rois(name)
-        for r in roi_group: 
-            data.append(rois[r-1])
-    return np.concatenate(data)
-
-
-def stats_species_gors(roi_group=[8,9],group_name='rump',p=0.001,short=None):
-    """
-    wilcoxon test of statistical significance for temp. difference
-    between H/D GORs
-    
-    parameters:
-        roi_group -  list of rois to include
-        group_name - name of the group (savefile name)
-        p - required p value
-        short: short name (optional)
-    return:
-        test result (True/False)
- 
-    """
-    
-    H = get_roi_group_a(atype='H',roi_group=roi_group)
-    D = get_roi_group_a(atype='D',roi_group=roi_group)
-
-    mm = np.min([len(H),len(D)])
-    np.random.shuffle(H)
-    np.random.shuffle(D)
-    s,s_p = mannwhitneyu(H[:mm],D[:mm],alternative='greater')
-    print ("{}: {}/{:0.4f}, {}".format(group_name,s,s_p,s_p<p))
-    return (s_p<p)
-    
+    return get_roi_group_a_animals(atype=atype,roi_group=roi_group)[1]
 
 
 def plot_species_gor_histo(roi_group=[8,9],group_name='rump',short=None,show=GLOBAL_SHOW):
@@ -91,16 +60,17 @@ def plot_species_gor_histo(roi_group=[8,9],group_name='rump',short=None,show=GLO
         short: short name (optional)
         show: True/False: show or save image
     """
-    assert len(roi_group)>0 and np.min(roi_group)>0 and np.max(roi_group)<16
+    assert len(roi_group)>0 and all(SCHEMA.is_roi(r) for r in roi_group)
 
     plt.rcParams.update({'font.size': 10})
     plt.figure(figsize=(2,1.5),dpi=300)
     
     for atype in ['H','D']:
-        data = get_roi_group_a(atype=atype,roi_group=roi_group)
+        counts = get_histogram([get_name(atype,i) for i in INDICES],roi_group)
+        c,edges = rebin(counts,100)
         cc = '#DC3220' if atype == 'H' else '#005AB5'
         ll = 'H' if atype == 'H' else 'D'
-        plt.hist(data,bins=100,color=cc,alpha=0.7,label=ll,density=True)
+        plt.hist(edges[:-1],weights=c,bins=edges,color=cc,alpha=0.7,label=ll,density=True)
     plt.xlabel("Temperature")
     plt.ylabel("Density")
 
@@ -30,82 +30,29 @@ Thermal pattern matrices
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
-from thermal_utlis import get_name,get_animal_rois,GOR_CLASSES,mww_test,INDICES,ATYPES,GLOBAL_SHOW
+from thermal_utlis import GOR_CLASSES,ATYPES,GLOBAL_SHOW
+from thermal_stats import prepare_pattern_matrices,load_pattern_matrices,compare_pattern_matrices
 from matplotlib.colors import ListedColormap
  
 
-def get_roi_group_a(atype='H',roi_group=[8,9],a_indices=INDICES):
-    """
-    returns ROI groups for every animal of a given species as a concatenated vector
-    
-    parameters:
-        atype = animal type [H,D]
-        roi_group -  list of rois to include
-        a_indices - animal indices
-    
-    return:
-        a dictinary indexed by animals with individual roi vectors
-        a concatenated roi vector
-    """
-    animals = {}
-    for a in a_indices:
-        animals[a]=[]
-        
-    for a in a_indices:
-        name=get_name(atype,a)
-        rois = get_animal_rois(name)
-        for r in roi_group: 
-            animals[a].append(rois[r-1])
-    for a in a_indices:
-        animals[a]=np.concatenate(animals[a])
-    
-    data = np.concatenate([animals[a] for a in animals])
-    
-    return animals,data
-    
-
-def prepare_pattern_matrices(atype='H',p=0.001):
-    """
-    prepares a thermal pattern matrix
-    
-    parameters:
-        atype: animal type [H,D]
-        p: required p value for the MWW test
 
-    """    
-    N = len(GOR_CLASSES)
-    rgs = []
-    for rg in GOR_CLASSES:
-        animals,data = get_roi_group_a(atype=atype,roi_group=rg['roi_group'])
-        rgs.append({'animals':animals,'data':data})
-    
-    deltas = np.zeros((N,N))    
-    s_global = np.zeros((N,N),dtype=np.int32)
-    s_local = np.zeros((N,N,len(INDICES)),dtype=np.int32)
-    for r in range(N):
-        for c in range(N):
-            deltas[r,c]=np.mean(rgs[r]['data'])-np.mean(rgs[c]['data'])
-            alternative = 'greater' if deltas[r,c]>0 else 'less'  
-            s_global[r,c] = mww_test(rgs[r]['data'],rgs[c]['data'],p=p,alternative=alternative)
-            for a in INDICES:
-                s_local[r,c,a-1] = mww_test(rgs[r]['animals'][a],rgs[c]['animals'][a],p=p,alternative=alternative)
-    np.savez_compressed('pattern_matrices_{}.npz'.format(atype),deltas=deltas,s_global=s_global,s_local=s_local)            
-                
-            
-def plot_pattern_matrix_global(atype='H',show=GLOBAL_SHOW):
+def plot_pattern_matrix_global(atype='H',p=0.001,gors=GOR_CLASSES,suffix='',show=GLOBAL_SHOW):
     """
     Plots the global thermal pattern matrix
     
     parameters:
         atype: animal type [H,D]
+        p: required p value for the MWW test
+        gors: list of GORs used to prepare the matrix
+        suffix: file name suffix of the matrix
         show: True/False: show or save image   
     """      
 
-    pm = np.load('pattern_matrices_{}.npz'.format(atype))
+    pm = load_pattern_matrices(atype,p=p,suffix=suffix)
     cmap = 'RdBu_r'
 
     plt.rcParams.update({'font.size': 10})
-    labels = [v['short'] for v in GOR_CLASSES]
+    labels = [v['short'] for v in gors]
     
     sns.heatmap(data=pm['deltas'],cmap=cmap,annot=True,linewidths=.5,fmt=".2f",mask = np.logical_or(pm['s_global'],pm['deltas']==0),cbar=False
                 ,xticklabels=labels, yticklabels=labels)
@@ -118,27 +65,30 @@ def plot_pattern_matrix_global(atype='H',show=GLOBAL_SHOW):
     if show:
         plt.show()
     else:    
-        plt.savefig('fig/m_deltas_{}.pdf'.format(atype),bbox_inches='tight',pad_inches=0)
+        plt.savefig('fig/m_deltas_{}{}{}.pdf'.format(atype,suffix,_p_suffix(p)),bbox_inches='tight',pad_inches=0)
     plt.close()
         
-def plot_pattern_matrix_local(atype='H',show=GLOBAL_SHOW):
+def plot_pattern_matrix_local(atype='H',p=0.001,gors=GOR_CLASSES,suffix='',show=GLOBAL_SHOW):
     """
     Plots the local thermal pattern matrix
     
     parameters:
         atype: animal type [H,D]
+        p: required p value for the MWW test
+        gors: list of GORs used to prepare the matrix
+        suffix: file name suffix of the matrix
         show: True/False: show or save image   
     """      
     
-    pm = np.load('pattern_matrices_{}.npz'.format(atype))
+    pm = load_pattern_matrices(atype,p=p,suffix=suffix)
     loc = pm['s_local']
     loc = np.sum(loc,axis=2)
-    labels = [v['short'] for v in GOR_CLASSES]
+    labels = [v['short'] for v in gors]
 
     cmap = 'YlGn'
     plt.rcParams.update({'font.size': 10})
     res = sns.heatmap(loc,cmap=cmap,annot=True,linewidths=.5,annot_kws={'fontsize':'10'}
-                      ,xticklabels=labels, yticklabels=labels,mask=np.eye(loc.shape[0]),vmin=0,vmax=16)
+                      ,xticklabels=labels, yticklabels=labels,mask=np.eye(loc.shape[0]),vmin=0,vmax=len(pm.meta['a_indices']))
      
     for _, spine in res.spines.items():
         spine.set_visible(True)
@@ -146,56 +96,59 @@ def plot_pattern_matrix_local(atype='H',show=GLOBAL_SHOW):
     if show:
         plt.show()
     else:
-        plt.savefig('fig/m_ss_{}.pdf'.format(atype),bbox_inches='tight',pad_inches=0)    
+        plt.savefig('fig/m_ss_{}{}{}.pdf'.format(atype,suffix,_p_suffix(p)),bbox_inches='tight',pad_inches=0)    
     plt.close()
 
-                
-def plot_pattern_matrix_global_combined(show=GLOBAL_SHOW):
+
+def plot_pattern_matrix_effect(atype='H',gors=GOR_CLASSES,suffix='',show=GLOBAL_SHOW):
     """
-    plots the comparison of both the global and the local pattern matrices
+    Plots Cliff's delta of the global thermal pattern matrix, values
+    with a bootstrap confidence interval excluding 0 are in bold
+    
     parameters:
+        atype: animal type [H,D]
+        gors: list of GORs used to prepare the matrix
+        suffix: file name suffix of the matrix
         show: True/False: show or save image   
-    """
+    """      
+    pm = load_pattern_matrices(atype,suffix=suffix)
+    cliff = pm['cliff_global']
+    strong = np.logical_or(pm['cliff_ci'][0]>0,pm['cliff_ci'][1]<0)
+    cmap = 'RdBu_r'
 
-    pmhd = [np.load('pattern_matrices_{}.npz'.format('H')),np.load('pattern_matrices_{}.npz'.format('D'))]
     plt.rcParams.update({'font.size': 10})
+    labels = [v['short'] for v in gors]
     
-    labels = [v['short'] for v in GOR_CLASSES]
-    
-    ddhd = [v['deltas'] for v in pmhd]
-    for i in range(2):
-        ddhd[i][ddhd[i]<0]=-1
-        ddhd[i][ddhd[i]>0]=1
+    sns.heatmap(data=cliff,cmap=cmap,annot=True,linewidths=.5,fmt=".2f",mask=np.logical_or(strong,np.eye(len(cliff))),cbar=False
+                ,xticklabels=labels, yticklabels=labels,vmin=-1,vmax=1)
+    res= sns.heatmap(data=cliff,cmap=cmap,annot=True,linewidths=.5,fmt=".2f",mask=~strong,annot_kws={"style": "italic", "weight": "bold",'fontsize':'10'}
+                     ,xticklabels=labels, yticklabels=labels,vmin=-1,vmax=1)
     
-    sshd = [v['s_global'] for v in pmhd]
-    combined = np.zeros_like(ddhd[0],dtype=np.int32)-10 #sanity check
-    
-    #1: same and significant
-    mask =  np.logical_and( ddhd[0]==ddhd[1] , (sshd[0]+sshd[1])==2 )
-    combined[mask]=1
-
-    #2: same but insignificant
-    mask =  np.logical_and( ddhd[0]==ddhd[1] , (sshd[0]+sshd[1])!=2 )
-    combined[mask]=2
-
-    #3: H warmer, significant
-    mask =  np.logical_and( ddhd[0]>ddhd[1] , (sshd[0]+sshd[1])==2 )
-    combined[mask]=3
-
-    #4: H warmer, insifnificant
-    mask =  np.logical_and( ddhd[0]>ddhd[1] , (sshd[0]+sshd[1])!=2 )
-    combined[mask]=4
-
-
-    #5: H warmer, significant
-    mask =  np.logical_and( ddhd[0]<ddhd[1] , (sshd[0]+sshd[1])==2 )
-    combined[mask]=5
+    for _, spine in res.spines.items():
+        spine.set_visible(True)
+    plt.tight_layout(0.1,0.1,0.1)
+    if show:
+        plt.show()
+    else:    
+        plt.savefig('fig/m_cliff_{}{}.pdf'.format(atype,suffix),bbox_inches='tight',pad_inches=0)
+    plt.close()
 
-    #6: H warmer, insifnificant
-    mask =  np.logical_and( ddhd[0]<ddhd[1] , (sshd[0]+sshd[1])!=2 )
-    combined[mask]=6
+                
+def plot_pattern_matrix_global_combined(p=0.001,groups=('H','D'),show=GLOBAL_SHOW):
+    """
+    plots the comparison of both the global and the local pattern matrices
+    parameters:
+        p: required p value for the MWW test
+        groups: two groups to compare (see compare_pattern_matrices)
+        show: True/False: show or save image   
+    """
+    comp = compare_pattern_matrices(groups,p=p)
+    combined = comp['categories'][0,1]
+    plt.rcParams.update({'font.size': 10})
     
-    np.fill_diagonal(combined,0)
+    labels = [v.get('short',v['group_name']) for v in comp['gors']]
+    name = groups[0] if isinstance(groups[0],str) else groups[0][0]
+    gsuffix = '' if tuple(groups)==('H','D') else '_'+'_'.join(g if isinstance(g,str) else ''.join(g) for g in groups)
     
     colors = ['white','#117733','#44AA99', '#882255','#CC6677','#0072B2','#56B4E9']
     cmap = ListedColormap(colors, name='colors')
@@ -204,33 +157,26 @@ def plot_pattern_matrix_global_combined(show=GLOBAL_SHOW):
     for _, spine in res.spines.items():
         spine.set_visible(True)
     cbar = res.collections[0].colorbar    
-    cbar.set_ticks([1,2,3,4,5,6,7])
-    cbar.set_ticklabels(['SPS','SP','HWS','HW','HCS','HC'])
+    cbar.set_ticks([1,2,3,4,5,6])
+    cbar.set_ticklabels(['SPS','SP',name+'WS',name+'W',name+'CS',name+'C'])
 
     plt.tight_layout(0.1,0.1,0.1)
     if show:
         plt.show()
     else:
-        plt.savefig('fig/m_comp.pdf',bbox_inches='tight',pad_inches=0)
+        plt.savefig('fig/m_comp{}{}.pdf'.format(gsuffix,_p_suffix(p)),bbox_inches='tight',pad_inches=0)
     plt.close()
 
     #the second table - local summary
-
-    lpmmhd = [np.load('pattern_matrices_{}.npz'.format('H')),np.load('pattern_matrices_{}.npz'.format('D'))]
-    
-    lddhd = np.dstack([np.sum(v['s_local'],axis=2) for v in lpmmhd])
-    lddhd = np.min(lddhd,axis=2)
+    lddhd = comp['local'][0,1].copy()
     
     #only show statistically significant classes 
-    for i in [2,4,6]:
-        lddhd[combined==i]=0
-    
-    labels = [v['short'] for v in GOR_CLASSES]
+    lddhd[combined%2==0]=0
     
     cmap = 'YlGn'
     plt.rcParams.update({'font.size': 10})
     res = sns.heatmap(lddhd,cmap=cmap,annot=True,linewidths=.5,annot_kws={'fontsize':'10'}
-                      ,xticklabels=labels, yticklabels=labels,mask=lddhd==0,vmin=0,vmax=16)
+                      ,xticklabels=labels, yticklabels=labels,mask=lddhd==0,vmin=0,vmax=min(comp['n_animals'][:2]))
      
     for _, spine in res.spines.items():
         spine.set_visible(True)
@@ -238,13 +184,38 @@ def plot_pattern_matrix_global_combined(show=GLOBAL_SHOW):
     if show:
         plt.show()
     else:
-        plt.savefig('fig/m_comp_local.pdf',bbox_inches='tight',pad_inches=0)
+        plt.savefig('fig/m_comp_local{}{}.pdf'.format(gsuffix,_p_suffix(p)),bbox_inches='tight',pad_inches=0)
     plt.close()
     
+def plot_pattern_matrix_sweep(atype='H',ps=[0.05,0.01,0.001,1e-6],gors=GOR_CLASSES,suffix='',show=GLOBAL_SHOW):
+    """
+    plots global and local thermal pattern matrices for many p values
+    (p-values are thresholded, no recomputation is needed)
+    
+    parameters:
+        atype: animal type [H,D]
+        ps: list of required p values
+        gors: list of GORs used to prepare the matrix
+        suffix: file name suffix of the matrix
+        show: True/False: show or save image   
+    """
+    for p in ps:
+        plot_pattern_matrix_global(atype,p=p,gors=gors,suffix=suffix,show=show)
+        plot_pattern_matrix_local(atype,p=p,gors=gors,suffix=suffix,show=show)
+
+
+def _p_suffix(p):
+    """
+    figure name suffix for a non-default p value
+    """
+    return '' if p==0.001 else '_p{:g}'.format(p)
+
+    
 if __name__ == '__main__':
     for a in ATYPES:
         prepare_pattern_matrices(a)
     for a in ATYPES:
         plot_pattern_matrix_global(a)
         plot_pattern_matrix_local(a)
+        plot_pattern_matrix_effect(a)
     plot_pattern_matrix_global_combined()
@@ -32,38 +32,11 @@ from thermal_utlis import GOR_CLASSES,GLOBAL_SHOW
 from matplotlib.colors import ListedColormap
 
 
-from thermal_fig_ROI_matrix import mww_test,get_roi_group_a
+from thermal_stats import prepare_pattern_matrices_spec,load_pattern_matrices
 import seaborn as sns
 
-    
-#prepare outlier cases
-def prepare_pattern_matrices_spec(atype='D',p=0.001,a_index=17):
-    """
-    prepares a thermal pattern matrix for a specific animal
-    (used for outlier cases of D.17,D.18)
-    
-    parameters:
-        atype: animal type [H,D]
-        p: required p value for the MWW test
-        a_index: animal index
-    
-    """
-    N = len(GOR_CLASSES)
-    rgs = []
-    for rg in GOR_CLASSES:
-        animals,data = get_roi_group_a(atype=atype,roi_group=rg['roi_group'],a_indices=[a_index])
-        rgs.append({'animals':animals,'data':data})
-    
-    deltas = np.zeros((N,N))    
-    s_global = np.zeros((N,N),dtype=np.int32)
-    for r in range(N):
-        for c in range(N):
-            deltas[r,c]=np.mean(rgs[r]['data'])-np.mean(rgs[c]['data'])
-            alternative = 'greater' if deltas[r,c]>0 else 'less'  
-            s_global[r,c] = mww_test(rgs[r]['data'],rgs[c]['data'],p=p,alternative=alternative)
-    np.savez_compressed('pattern_matrices_{}_spec_{}.npz'.format(atype,a_index),deltas=deltas,s_global=s_global)            
-            
-def plot_pattern_matrix_global_spec(atype='D',a_index=18,show=GLOBAL_SHOW):
+
+def plot_pattern_matrix_global_spec(atype='D',a_index=18,p=0.001,show=GLOBAL_SHOW):
     """
     plots a thermal pattern matrix for a specific animal
     (used for outlier cases of D.17,D.18)
@@ -71,10 +44,11 @@ def plot_pattern_matrix_global_spec(atype='D',a_index=18,show=GLOBAL_SHOW):
     parameters:
         atype: animal type [H,D]
         a_index: animal index
+        p: required p value for the MWW test
         show: True/False: show or save image    
     """    
 
-    pm = np.load('pattern_matrices_{}_spec_{}.npz'.format(atype,a_index))
+    pm = load_pattern_matrices(atype,p=p,suffix='_spec_{}'.format(a_index))
     cmap = 'RdBu_r'
     
     plt.rcParams.update({'font.size': 10})
@@ -94,7 +68,7 @@ def plot_pattern_matrix_global_spec(atype='D',a_index=18,show=GLOBAL_SHOW):
     plt.close()
 
 
-def plot_pattern_matrix_combined_spced(atype='D',a_index=17,show=GLOBAL_SHOW):
+def plot_pattern_matrix_combined_spced(atype='D',a_index=17,p=0.001,show=GLOBAL_SHOW):
     """
     plots a a comparison of thermal pattern similarity for an animal
     (used for outlier cases of D.17,D.18)
@@ -102,12 +76,13 @@ def plot_pattern_matrix_combined_spced(atype='D',a_index=17,show=GLOBAL_SHOW):
     parameters:
         atype: animal type [H,D]
         a_index: animal index
+        p: required p value for the MWW test
         show: True/False: show or save image    
 
     plots the comparison of pattern similarity
     """
 
-    pmhd = [np.load('pattern_matrices_{}_spec_{}.npz'.format(atype,a_index)),np.load('pattern_matrices_{}.npz'.format(atype))]
+    pmhd = [load_pattern_matrices(atype,p=p,suffix='_spec_{}'.format(a_index)),load_pattern_matrices(atype,p=p)]
     plt.rcParams.update({'font.size': 10})
     
     labels = [v['short'] for v in GOR_CLASSES]
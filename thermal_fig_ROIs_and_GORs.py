@@ -29,8 +29,9 @@ Visualisation of ROIs and GORs
 
 import matplotlib.pyplot as plt
 import numpy as np
-from thermal_utlis import get_animal, GOR_CLASSES,GLOBAL_SHOW
+from thermal_utlis import get_animal, GOR_CLASSES,SCHEMA,GLOBAL_SHOW
 from scipy.ndimage.measurements import center_of_mass
+from thermal_index import get_crop
 
 
 
@@ -48,7 +49,8 @@ def plot_gors(gors,ids=[1],im_index=1,show=GLOBAL_SHOW):
     plt.figure(figsize=(4,3),dpi=300)
 
     data,anno = get_animal('D.3')
-    anno = anno[20:201,52:300]
+    r0,r1,c0,c1 = get_crop(['D.3'])
+    anno = anno[r0:r1,c0:c1]
     ax=plt.subplot(111)
 
     res = np.zeros(anno.shape)
@@ -95,14 +97,17 @@ def plot_rois(show=GLOBAL_SHOW):
     plt.figure(figsize=(4,3),dpi=300)
 
     _,anno = get_animal('D.3')
-    anno = anno[20:201,52:300]
+    r0,r1,c0,c1 = get_crop(['D.3'])
+    anno = anno[r0:r1,c0:c1]
     ax=plt.subplot(111)
-    plt.imshow(anno,cmap='nipy_spectral',vmax=15)
+    plt.imshow(anno,cmap='nipy_spectral',vmax=SCHEMA.n_labels-1)
     
-    #custom values :-/
+    #custom values :-/ (for the 15-ROI protocol)
     cr_c = [0,0,3,5,0,0,0,0,0,0,0,5,0,0,0]
     cc_c = [-10,-5,-3,-5,0,-5,0,0,-5,-7,0,-10,-7,-10,-7]
-    for i,c in enumerate(range(1,16)):
+    if SCHEMA.n_rois!=len(cr_c):
+        cr_c = cc_c = [0]*SCHEMA.n_rois
+    for i,c in enumerate(SCHEMA.roi_ids):
         temp=anno.copy()
 
         temp[temp!=c]=0
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics, 
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by  
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Species thermal atlases (mean maps and horse-donkey differences)
+"""
+
+import matplotlib.pyplot as plt
+import numpy as np
+from mpl_toolkits.axes_grid1 import make_axes_locatable
+from thermal_utlis import GLOBAL_SHOW
+from thermal_atlas import build_atlases,TEMPLATE_ANIMAL
+
+
+def _plot_map(arr,cmap,vmin,vmax,fname,show):
+    """
+    plots a map on the template with a colorbar
+    """
+    plt.rcParams.update({'font.size': 14})
+    plt.figure(figsize=(4,3),dpi=300)
+    ax=plt.subplot(111)
+    im = plt.imshow(np.ma.masked_invalid(arr),cmap=cmap,vmin=vmin,vmax=vmax)
+    divider = make_axes_locatable(ax)
+    cax = divider.append_axes("right", size="5%", pad=0.05)
+    plt.colorbar(im, cax=cax)
+    ax.set_axis_off()
+    ax.get_xaxis().set_visible(False)
+    ax.get_yaxis().set_visible(False)
+    plt.tight_layout()
+    if show:
+        plt.show()
+    else:
+        plt.savefig(fname,bbox_inches='tight',pad_inches=0)
+    plt.close()
+
+
+def plot_atlas_mean(atlases,atype='H',gmin=8.80,gmax=30.65,show=GLOBAL_SHOW):
+    """
+    plots the mean temperature map of a species on the template
+    parameters:
+        atlases: result of thermal_atlas.build_atlases()
+        atype: animal type [H,D]
+        gmin, gmax: temperature range for colormap scaling
+        show: True/False: show or save image
+    """
+    _plot_map(atlases[atype].get_mean(),'nipy_spectral',gmin,gmax,'fig/atlas_{}.pdf'.format(atype),show)
+
+
+def plot_atlas_difference(atlases,show=GLOBAL_SHOW):
+    """
+    plots the difference of mean maps of horses and donkeys (H-D)
+    parameters:
+        atlases: result of thermal_atlas.build_atlases()
+        show: True/False: show or save image
+    """
+    diff = atlases['H'].get_mean()-atlases['D'].get_mean()
+    vmax = np.nanmax(np.abs(diff))
+    _plot_map(diff,'RdBu_r',-vmax,vmax,'fig/atlas_diff.pdf',show)
+
+
+if __name__ == '__main__':
+    atlases = build_atlases(template_name=TEMPLATE_ANIMAL)
+    for atype in ['H','D']:
+        plot_atlas_mean(atlases,atype)
+    plot_atlas_difference(atlases)
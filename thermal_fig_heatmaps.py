@@ -32,26 +32,11 @@ import numpy as np
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from thermal_utlis import get_animal,get_name
 from thermal_utlis import INDICES,ATYPES,GLOBAL_SHOW
+from thermal_stats import print_global_temperatures
+from thermal_index import get_crop
 
 
-def print_global_temperatures():
-    """
-    prints global temperature stats for animals
-    """
-    temps = {}
-    for atype in ATYPES:
-        temps[atype]=[]
-        for i in INDICES:
-            arr, anno = get_animal(get_name(atype,i))
-            temps[atype].append(arr[anno!=0])
-        temps[atype] = np.concatenate(temps[atype])
-        print (atype,'min: {:0.2f},mean:{:0.2f}({:0.2f}), median:{:0.2f},  max: {:0.2f}'.format(np.min(temps[atype])
-                                                                                              ,np.mean(temps[atype])
-                                                                                              ,np.std(temps[atype])
-                                                                                              ,np.median(temps[atype])
-                                                                                              ,np.max(temps[atype])))         
-
-def plot_animal_heatmap(name,gmin=8.80,gmax=30.65,cutb=None,is_bg=False,show=GLOBAL_SHOW,custom_name=None):
+def plot_animal_heatmap(name,gmin=8.80,gmax=30.65,cutb=None,is_bg=False,show=GLOBAL_SHOW,custom_name=None,data=None,out=None):
     """
     plots heatmaps for a given animal
     parameters:
@@ -60,22 +45,27 @@ def plot_animal_heatmap(name,gmin=8.80,gmax=30.65,cutb=None,is_bg=False,show=GLO
         gmin: min temperature for colormap scaling, if None
             local temperature range is used
         gmax: max temperature for colormap  scaling
-        cutb: None or cut box for the image [cutb[0]:cutb[1],cutb[2]:cutb[3]]
+        cutb: None, cut box for the image [cutb[0]:cutb[1],cutb[2]:cutb[3]]
+            or 'auto' for the box of the animal silhouette (thermal_index.get_crop)
         is_bg: True for masked background, False otherwise
+        data: None or (data,anno) of the animal (e.g. already loaded)
+        out: None or a file-like object, the image is saved to it 
+            as png (show is ignored)
     
     """
     assert (gmin is None and gmax is None) or (gmin>0 and gmax>gmin)
     
     plt.rcParams.update({'font.size': 14})
     plt.figure(figsize=(4,3),dpi=300)
-    arr, anno = get_animal(name)
-    if not is_bg:
-        arr[anno==0]=0
-    
-    
+    arr, anno = get_animal(name) if data is None else data
+    if cutb=='auto':
+        cutb = get_crop([name])
     if cutb is not None:
         arr = arr[cutb[0]:cutb[1],cutb[2]:cutb[3]]
         anno = anno[cutb[0]:cutb[1],cutb[2]:cutb[3]]
+    arr = arr.copy()
+    if not is_bg:
+        arr[anno==0]=0
     
     vmin = np.min(arr[anno>0]) if gmin is None else gmin
     vmax = np.max(arr[anno>0]) if gmax is None else gmax
@@ -93,7 +83,9 @@ def plot_animal_heatmap(name,gmin=8.80,gmax=30.65,cutb=None,is_bg=False,show=GLO
     
     plt.tight_layout()
     indstr = '_relative' if gmin is None else ''
-    if show:
+    if out is not None:
+        plt.savefig(out,format='png',bbox_inches='tight',pad_inches=0)
+    elif show:
         plt.show()
     else:
         name = '{}.pdf'.format(custom_name) if custom_name is not None else 'fig/{}{}.pdf'.format(name,indstr)
@@ -102,8 +94,8 @@ def plot_animal_heatmap(name,gmin=8.80,gmax=30.65,cutb=None,is_bg=False,show=GLO
 
 
 if __name__ == '__main__':
-    plot_animal_heatmap(name='D.3',gmin=8.80,gmax=30.65,cutb=[20,201,52,300],is_bg=False,custom_name='fig/heat')
-    plot_animal_heatmap(name='D.3',gmin=8.80,gmax=30.65,cutb=[20,201,52,300],is_bg=True,custom_name='fig/heat_all')
+    plot_animal_heatmap(name='D.3',gmin=8.80,gmax=30.65,cutb='auto',is_bg=False,custom_name='fig/heat')
+    plot_animal_heatmap(name='D.3',gmin=8.80,gmax=30.65,cutb='auto',is_bg=True,custom_name='fig/heat_all')
     print_global_temperatures()
     plot_animal_heatmap('D.17',gmin=8.80,gmax=30.65)
     plot_animal_heatmap('D.18',gmin=8.80,gmax=30.65)
@@ -29,38 +29,33 @@ Boxplots of ROI for animal types
 
 import matplotlib.pyplot as plt
 import numpy as np
-from thermal_utlis import get_name,get_animal_rois,INDICES,GLOBAL_SHOW
+from thermal_utlis import get_name,SCHEMA,INDICES,GLOBAL_SHOW
+from thermal_index import get_histogram,box_stats
 
-def plot_box(atype='H',show=GLOBAL_SHOW):
+def plot_box(atype='H',show=GLOBAL_SHOW,a_indices=INDICES,max_fliers=500):
     """
     plots boxplot of temperatures in rois for a given animal type
+    (statistics come from the histogram index, boxes are sorted by medians)
     parameters:
         
         atype - animal type ['H','D']
+        a_indices - animal indices
+        max_fliers - max. number of distinct outlier values drawn per ROI
     """
-    arr = [] 
-    for i in INDICES:
-        name = get_name(atype,i)
-        rois = get_animal_rois(name)
-        arr.append(rois)
-    
-    rois = []
-    for rid in range(15):
-        rois.append(np.concatenate([v[rid] for v in arr]))
+    names = [get_name(atype,i) for i in a_indices]
+    indices = SCHEMA.roi_ids
+    stats = [box_stats(get_histogram(names,[rid]),max_fliers=max_fliers,label=rid) for rid in indices]
     
     plt.rcParams.update({'font.size': 10})
-    plt.figure(figsize=(4,3),dpi=300)
+    fig = plt.figure(figsize=(4,3),dpi=300)
     
-    medians = [np.median(v) for v in rois]
+    medians = [s['med'] for s in stats]
     arg = np.argsort(medians)[::-1]
-    rois=np.array(rois)
-    rois=rois[arg]
-    indices = np.arange(15)+1
     
-    plt.boxplot(rois,widths = 0.6,flierprops={'marker':'o','markersize':1,'alpha':0.7,'markeredgecolor':'#DC3220','linestyle':'none'})
+    fig.gca().bxp([stats[a] for a in arg],widths = 0.6,flierprops={'marker':'o','markersize':1,'alpha':0.7,'markeredgecolor':'#DC3220','linestyle':'none'})
 
     plt.ylim(10,30)
-    plt.xticks(np.arange(15)+1,indices[arg])
+    plt.xticks(np.arange(len(indices))+1,indices[arg])
     plt.xlabel("ROI")
     plt.ylabel("Temperature")
     plt.tight_layout(0.2,0.2,0.2)
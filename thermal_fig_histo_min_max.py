@@ -29,47 +29,9 @@ Histograms for ROIs
 
 import matplotlib.pyplot as plt
 import numpy as np
-from thermal_utlis import get_name,get_animal_rois,INDICES,ATYPES,GLOBAL_SHOW
-from scipy.stats import skew, kurtosis  
-
-def get_roi_differences(rid):
-    """
-    returns (and prints) differences between animals in ROI
-    parameters:
-        rid: ROI id
-    
-    returns:
-        dictionary of differences i.e. 
-        {diff: roi difference,H:<horse roi stats>,D:<donkey roi stats>} 
-    """
-    temps = {}
-    rets = {}
-    for atype in ATYPES:
-        temps[atype]=[]
-        for i in INDICES:
-            name = get_name(atype,i)
-            rois = get_animal_rois(name)
-            temps[atype].append(rois[rid-1])
-        temps[atype] = np.concatenate(temps[atype])
-        rmin,rmean,rmedian,rmax = np.min(temps[atype]),np.mean(temps[atype]),np.median(temps[atype]),np.max(temps[atype])
-        rets[atype] = [rmin,rmean,rmedian,rmax]
-    dd = np.abs(rets['H'][1]-rets['D'][1])
-    print ("{}: {:0.2f}, {}".format(rid,dd,rets))
-    rets['diff'] = dd    
-    return rets    
-                        
-def count_rois_differences():
-    """
-    counts average differences between no. pixels in ROIs
-    """
-    h =[[len(l) for l in get_animal_rois(get_name('H',i))] for i in INDICES]
-    d =[[len(l) for l in get_animal_rois(get_name('D',i))] for i in INDICES]
-    h = np.sum(np.asarray(h),axis=0)
-    d = np.sum(np.asarray(d),axis=0)
-    diff = np.abs(h-d)
-    print (100*np.mean([np.median(diff/h),np.median(diff/d)]))
-    print ("average difference: {:0.2f}({:0.2f})".format(100*np.mean([np.mean(diff/h),np.mean(diff/d)]),100*np.mean([np.std(diff/h),np.std(diff/d)])))
-
+from thermal_utlis import get_name,SCHEMA,INDICES,ATYPES,GLOBAL_SHOW
+from thermal_stats import get_roi_differences,count_rois_differences
+from thermal_index import get_histogram,get_moments,rebin
 
 def plot_roi_histo(rid,small=False,show=GLOBAL_SHOW):
     """
@@ -79,23 +41,18 @@ def plot_roi_histo(rid,small=False,show=GLOBAL_SHOW):
         small - True/False: wheather to generate small (half-size) histograms
         show: True/False: show or save image
     """
-    assert rid>=0 and rid<16,"{}".format(rid) 
-    temps = {}
+    assert rid==0 or SCHEMA.is_roi(rid),"{}".format(rid) 
+    counts = {}
     for atype in ATYPES:
-        temps[atype]=[]
-        for i in INDICES:
-            name = get_name(atype,i)
-            rois = get_animal_rois(name)
-            if rid>0:
-                temps[atype].append(rois[rid-1])
-            else:    
-                temps[atype].append(np.concatenate(rois))
-        temps[atype] = np.concatenate(temps[atype])
+        names = [get_name(atype,i) for i in INDICES]
+        rois = [rid] if rid>0 else SCHEMA.roi_ids
+        counts[atype] = get_histogram(names,rois)
+        _,rmean,rstd,rskew,rkurtosis = get_moments(names,rois)
         print ("{} ROI {}: mean: {:0.2f}, std: {:0.2f}, skew:{:0.2f}, kurtosis:{:0.2f}".format(atype,rid
-                                                                                               ,np.mean(temps[atype])
-                                                                                               ,np.std(temps[atype])
-                                                                                               ,skew(temps[atype])
-                                                                                               ,kurtosis(temps[atype])))    
+                                                                                               ,rmean
+                                                                                               ,rstd
+                                                                                               ,rskew
+                                                                                               ,rkurtosis))    
 
     if not small:
         plt.rcParams.update({'font.size': 12})
@@ -103,10 +60,11 @@ def plot_roi_histo(rid,small=False,show=GLOBAL_SHOW):
     else:    
         plt.rcParams.update({'font.size': 10})
         plt.figure(figsize=(2,1.5),dpi=300)
-    nbins = int(np.max([np.sqrt(len(temps[atype])) for atype in ['H','D']]))
+    nbins = int(np.max([np.sqrt(np.sum(counts[atype])) for atype in ['H','D']]))
     
-    plt.hist(temps['H'],color='#DC3220',alpha=0.7,density=True,bins=nbins,label='Horses')
-    plt.hist(temps['D'],color='#005AB5',alpha=0.7,density=True,bins=nbins,label='Donkeys')
+    for atype,cc,ll in [('H','#DC3220','Horses'),('D','#005AB5','Donkeys')]:
+        c,edges = rebin(counts[atype],nbins)
+        plt.hist(edges[:-1],weights=c,color=cc,alpha=0.7,density=True,bins=edges,label=ll)
     if not small:
         plt.xlabel("Temperature")
     else:
@@ -126,14 +84,14 @@ def plot_roi_histo(rid,small=False,show=GLOBAL_SHOW):
 if __name__ == '__main__':
     count_rois_differences()
     plot_roi_histo(0,small=True)
-    for rid in range(1,16):
+    for rid in SCHEMA.roi_ids:
         plot_roi_histo(rid,small=True)
     imin=4
     imax=7
     if True:
-        diffs = [get_roi_differences(rid)['diff'] for rid in range(1,16)]
-        imin = np.argmin(diffs)+1
-        imax = np.argmax(diffs)+1
+        diffs = [get_roi_differences(rid)['diff'] for rid in SCHEMA.roi_ids]
+        imin = SCHEMA.roi_ids[np.argmin(diffs)]
+        imax = SCHEMA.roi_ids[np.argmax(diffs)]
         print (imin,imax)
     
     plot_roi_histo(rid=imin) 
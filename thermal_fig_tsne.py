@@ -29,40 +29,29 @@ T-SNE data visualisation
 
 import matplotlib.pyplot as plt
 import numpy as np
-from thermal_utlis import get_name,get_animal_rois,ATYPES,INDICES,GLOBAL_SHOW
+from thermal_utlis import GLOBAL_SHOW
+from thermal_stats import get_roi_features
+from thermal_embedding import embed
 from scipy.stats import skew, kurtosis  
-from sklearn.manifold import TSNE
 
 
-def plot_groups(stat=np.mean,normalise=False,show=GLOBAL_SHOW):
+def plot_groups(stat=np.mean,normalise=False,method='tsne',seed=0,show=GLOBAL_SHOW):
     """
     Compare ROI features with t-SNE (expecting observable structure in data)
-    warning: t-SNE is a nondeterministic algorithm
+    embeddings are seeded and cached (see thermal_embedding)
     paramters:
         stat: feature extraction statistics
         normalise: normalise features by removing the global average
+        method: embedding method (see thermal_embedding.embed)
+        seed: random seed
         show: True/False: show or save image   
     """
     
-    data = []
-    y = []
-    for atype in ATYPES:
-        for a in INDICES:
-            rois = get_animal_rois(get_name(atype=atype,index=a))
-            if rois != None:
-                y.append(0 if atype =='H' else 1)
-                if normalise:
-                    gv = np.mean(np.concatenate(rois))
-                    rois = [v-gv for v in rois]
-                temp = [stat(v) for v in rois]
-                data.append(temp) 
-    
+    X,y = get_roi_features(stat=stat,normalise=normalise)
+
     plt.rcParams.update({'font.size': 12})
     
-    X = np.array(data)
-    y=np.array(y)
-    tsne = TSNE(perplexity=5)
-    X = tsne.fit_transform(X)
+    X = embed(X,method=method,seed=seed,perplexity=5)
     where = y==0
     plt.scatter(X[where,0],X[where,1],color = '#DC3220', label='Horses')
     where = y==1
@@ -72,7 +61,8 @@ def plot_groups(stat=np.mean,normalise=False,show=GLOBAL_SHOW):
     if show:
         plt.show()
     else:
-        plt.savefig('fig/tsne_{}{}.pdf'.format(stat.__name__,nstr),bbox_inches='tight',pad_inches=0)
+        mstr = '' if method=='tsne' else '_{}'.format(method)
+        plt.savefig('fig/tsne_{}{}{}.pdf'.format(stat.__name__,nstr,mstr),bbox_inches='tight',pad_inches=0)
     plt.close()    
     
 
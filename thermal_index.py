@@ -0,0 +1,533 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Dataset index: per-animal data precomputed once and stored next to
+the dataset (index.npz in the dataset directory, thermal_utlis.get_ds_dir)
+
+The index holds per-(animal, ROI) histograms on a fixed global
+temperature grid (HIST_MIN, HIST_MAX, HIST_STEP, row 0 is the background),
+exact moments of labels (count, mean and central sums, see
+label_moments), frame shapes and bounding boxes of ROIs and of the animal
+silhouette (row 0, see thermal_utlis.label_bboxes), used to crop ROI
+extraction and figures, and areas/perimeters of labels
+(thermal_utlis.label_geometry, see thermal_areas).
+Density plots for any ROI/GOR/species are built by summing and rebinning
+the counts. Statistics of histograms (hist_moments, hist_quantiles,
+box_stats) treat every value as the centre of its bin: they are exact for
+data rounded to HIST_STEP (as the dataset) and approximate (within
+HIST_STEP/2) otherwise, values outside [HIST_MIN, HIST_MAX] are counted in
+the edge bins (a warning is issued when the index is built). Mean, std,
+skewness and kurtosis from get_moments are exact. Entries are recomputed only for archives whose digest
+(thermal_validate.get_digest) changed.
+"""
+import os
+import tempfile
+import unittest
+import warnings
+import numpy as np
+import thermal_utlis
+from thermal_utlis import get_animal,label_bboxes,label_geometry,SCHEMA
+from thermal_validate import all_names,animal_file,get_digest
+
+#global temperature grid (bin centres HIST_MIN+k*HIST_STEP)
+HIST_MIN = 0.0
+HIST_MAX = 50.0
+HIST_STEP = 0.01
+#histograms and boxes are indexed by label values
+N_LABELS = SCHEMA.n_labels
+#arrays stored in the index (an older index is rebuilt)
+INDEX_KEYS = ['names','digests','hist','moments','bbox','shape','area','perimeter']
+
+
+def hist_centers():
+    """
+    returns the centres of the global histogram bins
+    """
+    return HIST_MIN+HIST_STEP*np.arange(int(round((HIST_MAX-HIST_MIN)/HIST_STEP))+1)
+
+
+def index_file():
+    return os.path.join(thermal_utlis.get_ds_dir(),'index.npz')
+
+
+def animal_histograms(data,anno):
+    """
+    returns histograms of all labels of a frame on the global grid
+    (a single pass over the frame)
+
+    returns:
+        array (N_LABELS x bins) of counts
+    """
+    nb = len(hist_centers())
+    b = np.rint((data-HIST_MIN)/HIST_STEP).astype(np.int64)
+    np.clip(b,0,nb-1,out=b)
+    return np.bincount((anno.astype(np.int64)*nb+b).ravel(),minlength=N_LABELS*nb).reshape(N_LABELS,nb).astype(np.int32)
+
+
+def label_moments(data,anno):
+    """
+    returns exact moments of all labels of a frame
+
+    returns:
+        array (N_LABELS x 5): count, mean and central sums of powers
+        2, 3 and 4 (combine them with combine_moments)
+    """
+    a = anno.ravel().astype(np.intp)
+    x = data.ravel().astype(np.float64)
+    n = np.bincount(a,minlength=N_LABELS).astype(np.float64)
+    mean = np.bincount(a,weights=x,minlength=N_LABELS)/np.maximum(n,1)
+    d = x-mean[a]
+    return np.stack([n,mean]+[np.bincount(a,weights=d**k,minlength=N_LABELS) for k in [2,3,4]],axis=1)
+
+
+def combine_moments(m):
+    """
+    returns moments (as label_moments) of the union of disjoint sets of
+    values
+
+    parameters:
+        m: array (... x sets x 5) of moments of sets (as label_moments)
+
+    returns:
+        array (... x 5)
+    """
+    m = np.asarray(m,dtype=np.float64)
+    c = [m[...,k] for k in range(5)]
+    n = np.sum(c[0],axis=-1)
+    mean = np.sum(c[0]*c[1],axis=-1)/np.maximum(n,1)
+    d = c[1]-mean[...,np.newaxis]
+    return np.stack([n,mean,np.sum(c[2]+c[0]*d**2,axis=-1),np.sum(c[3]+3*d*c[2]+c[0]*d**3,axis=-1)
+                     ,np.sum(c[4]+4*d*c[3]+6*d**2*c[2]+c[0]*d**4,axis=-1)],axis=-1)
+
+
+def moment_stats(m):
+    """
+    returns n, mean, std, skew, kurtosis (biased, as in scipy.stats) of
+    moments given as label_moments (NaN statistics for no values)
+    """
+    m = np.asarray(m,dtype=np.float64)
+    n = int(m[0])
+    if n==0:
+        return 0,np.nan,np.nan,np.nan,np.nan
+    m2,m3,m4 = m[2:]/n
+    with np.errstate(invalid='ignore',divide='ignore'):
+        return n,m[1],np.sqrt(m2),m3/m2**1.5,m4/m2**2-3
+
+
+def _compute_entry(name):
+    data,anno = get_animal(name)
+    area,perimeter = label_geometry(anno,N_LABELS)
+    outside = np.count_nonzero((data<HIST_MIN-HIST_STEP/2)|(data>HIST_MAX+HIST_STEP/2))
+    if outside:
+        warnings.warn("{}: {} pixels outside [{}, {}] are counted in the edge bins of histograms".format(name,outside,HIST_MIN
+                                                                                                          ,HIST_MAX))
+    return {'hist':animal_histograms(data,anno),'moments':label_moments(data,anno),'bbox':label_bboxes(anno,N_LABELS)
+            ,'shape':np.array(anno.shape,dtype=np.int32)
+            ,'area':area.astype(np.int32),'perimeter':perimeter.astype(np.int32)}
+
+
+#the index loaded in this process and names whose digests have been checked
+_index = {'file':None,'data':None,'checked':set()}
+
+def get_index(names=None,rebuild=False,save=True,check=False):
+    """
+    returns the dataset index, updated for new or changed archives
+    (digests of archives are checked once per process)
+
+    parameters:
+        names: animals which must be present (all_names() if None)
+        rebuild: True/False: recompute all entries
+        save: True/False: write the updated index to index_file()
+        check: True/False: check digests of names checked before (for
+            archives changed while the process runs)
+
+    returns:
+        dictionary with 'names' (list), 'digests' and per-animal
+        arrays (first axis follows names)
+    """
+    names = all_names() if names is None else list(names)
+    fname = index_file()
+    idx = _index['data'] if _index['file']==fname else None
+    checked = _index['checked'] if idx is not None and not rebuild else set()
+    if idx is None and os.path.exists(fname) and not rebuild:
+        arr = np.load(fname,allow_pickle=False)
+        if set(INDEX_KEYS)<=set(arr.files) and arr['hist'].shape[1:]==(N_LABELS,len(hist_centers())):
+            idx = {k:arr[k] for k in arr.files}
+            idx['names'] = idx['names'].tolist()
+            idx['digests'] = idx['digests'].tolist()
+    if idx is None or rebuild:
+        idx = {'names':[],'digests':[]}
+    pos = {n:i for i,n in enumerate(idx['names'])}
+    changed = False
+    for name in names:
+        if name in pos and name in checked and not check:
+            continue
+        digest = get_digest(name)
+        checked.add(name)
+        if name in pos and idx['digests'][pos[name]]==digest:
+            continue
+        entry = _compute_entry(name)
+        changed = True
+        if name in pos:
+            i = pos[name]
+            idx['digests'][i] = digest
+            for k,v in entry.items():
+                idx[k][i] = v
+        else:
+            pos[name] = len(idx['names'])
+            idx['names'].append(name)
+            idx['digests'].append(digest)
+            for k,v in entry.items():
+                idx[k] = v[np.newaxis] if k not in idx else np.concatenate([idx[k],v[np.newaxis]])
+    if changed and save:
+        #written to a temporary file and renamed, concurrent readers (e.g. worker processes) see a complete index
+        f,tmp = tempfile.mkstemp(dir=os.path.dirname(fname) or '.',prefix='.index',suffix='.npz')
+        with os.fdopen(f,'wb') as fo:
+            np.savez_compressed(fo,**{k:(np.array(v) if k in ['names','digests'] else v) for k,v in idx.items()})
+        os.replace(tmp,fname)
+    _index['file'],_index['data'],_index['checked'] = fname,idx,checked
+    return idx
+
+
+def get_histogram(names,rois):
+    """
+    returns the summed histogram of ROIs of animals on the global grid
+
+    parameters:
+        names: list of animal names
+        rois: list of ROI ids (e.g. a GOR)
+    """
+    idx,pos = _positions(names)
+    return np.sum(idx['hist'][pos][:,list(rois)],axis=(0,1))
+
+
+def _positions(names):
+    """
+    returns the index updated for animals and their positions in it, when
+    an animal is not indexed yet all animals of the dataset are indexed in
+    one batch (a single write of the index)
+    """
+    names = list(names)
+    idx = get_index([])
+    if not set(names)<=set(idx['names']):
+        names_ds = [n for n in all_names() if n not in set(names) and os.path.exists(animal_file(n))]
+        get_index(names+names_ds)
+    idx = get_index(names)
+    pos = {n:i for i,n in enumerate(idx['names'])}
+    return idx,[pos[n] for n in names]
+
+
+def indexed_bboxes(name):
+    """
+    returns bounding boxes of an animal if the index holds an up-to-date
+    entry, None otherwise (the index is neither built nor updated, the
+    digest is checked once per process)
+    """
+    idx = get_index([])
+    if name in idx['names']:
+        i = idx['names'].index(name)
+        if name in _index['checked'] or idx['digests'][i]==get_digest(name):
+            _index['checked'].add(name)
+            return idx['bbox'][i]
+    return None
+
+
+def get_moments(names,rois):
+    """
+    returns exact statistics of ROIs of animals (pooled pixels)
+
+    parameters:
+        names: list of animal names
+        rois: list of ROI ids (e.g. a GOR)
+
+    returns:
+        n, mean, std, skew, kurtosis (biased, as in scipy.stats)
+    """
+    return moment_stats(combine_moments(animal_moments(names)[:,list(rois)].reshape(-1,5)))
+
+
+def animal_moments(names):
+    """
+    returns exact moments (see label_moments) of all labels of animals
+    (array animals x N_LABELS x 5)
+    """
+    idx,pos = _positions(names)
+    return idx['moments'][pos]
+
+
+def pixel_counts(names):
+    """
+    returns numbers of pixels of all labels of animals
+    (array animals x N_LABELS)
+    """
+    idx,pos = _positions(names)
+    return idx['area'][pos]
+
+
+def frame_shapes(names):
+    """
+    returns shapes of frames of animals (array animals x 2)
+    """
+    idx,pos = _positions(names)
+    return idx['shape'][pos]
+
+
+def perimeters(names):
+    """
+    returns perimeters (see thermal_utlis.label_geometry) of all labels
+    of animals (array animals x N_LABELS)
+    """
+    idx,pos = _positions(names)
+    return idx['perimeter'][pos]
+
+
+def get_bboxes(name):
+    """
+    returns bounding boxes of an animal (see thermal_utlis.label_bboxes)
+    """
+    idx,pos = _positions([name])
+    return idx['bbox'][pos[0]]
+
+
+def get_crop(names,margin=5):
+    """
+    returns a crop box [r0,r1,c0,c1] covering silhouettes of animals
+    (used as cutb in figures)
+    
+    parameters:
+        names: list of animal names
+        margin: margin in pixels
+    """
+    idx,pos = _positions(names)
+    boxes = idx['bbox'][pos,0]
+    h,w = np.min(idx['shape'][pos],axis=0)
+    return [int(max(0,np.min(boxes[:,0])-margin)),int(min(h,np.max(boxes[:,1])+margin))
+            ,int(max(0,np.min(boxes[:,2])-margin)),int(min(w,np.max(boxes[:,3])+margin))]
+
+
+def rebin(counts,nbins):
+    """
+    rebins a histogram on the global grid into about nbins equal bins
+    spanning its nonzero range
+
+    returns:
+        counts, bin edges
+    """
+    nz = np.flatnonzero(counts)
+    lo,hi = nz[0],nz[-1]+1
+    factor = int(max(1,np.ceil((hi-lo)/float(nbins))))
+    hi = lo+factor*int(np.ceil((hi-lo)/float(factor)))
+    c = np.zeros(hi-lo,dtype=np.int64)
+    part = counts[lo:min(hi,len(counts))]
+    c[:len(part)] = part
+    edges = HIST_MIN+HIST_STEP*(np.arange(lo,hi+1,factor)-0.5)
+    return c.reshape(-1,factor).sum(axis=1),edges
+
+
+def hist_moments(counts):
+    """
+    returns statistics of the data from its histogram on the global grid
+    (values at bin centres, see get_moments for exact ones)
+
+    returns:
+        n, mean, std, skew, kurtosis (biased, as in scipy.stats)
+    """
+    x = hist_centers()
+    n = np.sum(counts)
+    w = counts/float(n)
+    mean = np.sum(w*x)
+    d = x-mean
+    m2 = np.sum(w*d**2)
+    m3 = np.sum(w*d**3)
+    m4 = np.sum(w*d**4)
+    return n,mean,np.sqrt(m2),m3/m2**1.5,m4/m2**2-3
+
+
+def hist_quantiles(counts,q):
+    """
+    returns quantiles of the data from its histogram on the global grid,
+    linear interpolation between order statistics as np.quantile (values
+    at bin centres: exact for data rounded to HIST_STEP, within
+    HIST_STEP/2 otherwise)
+    """
+    h = (np.sum(counts)-1)*np.asarray(q,dtype=np.float64)
+    lo,hi = _sorted_values(counts,np.floor(h)),_sorted_values(counts,np.ceil(h))
+    return lo+(h-np.floor(h))*(hi-lo)
+
+
+def _sorted_values(counts,k):
+    """
+    returns values at positions k of the sorted data of a histogram
+    """
+    return hist_centers()[np.searchsorted(np.cumsum(counts),k,side='right')]
+
+
+def box_stats(counts,whis=1.5,max_fliers=500,seed=0,label=None):
+    """
+    returns boxplot statistics of the data from its histogram on the global
+    grid (as matplotlib.cbook.boxplot_stats, for Axes.bxp), values at bin
+    centres (exact for data rounded to HIST_STEP)
+
+    parameters:
+        counts: histogram on the global grid (e.g. get_histogram)
+        whis: whisker length (multiple of the IQR)
+        max_fliers: max. number of distinct flier values (a random sample
+            is drawn if there are more)
+        seed: random seed of the flier sample
+        label: label of the box
+    """
+    counts = np.asarray(counts)
+    x = hist_centers()
+    n = np.sum(counts)
+    #linear interpolation between order statistics (as np.percentile)
+    h = (n-1)*np.array([0.25,0.5,0.75])
+    lo,hi = _sorted_values(counts,np.floor(h)),_sorted_values(counts,np.ceil(h))
+    q1,med,q3 = lo+(h-np.floor(h))*(hi-lo)
+    iqr = q3-q1
+    nz = counts>0
+    inside = nz&(x>=q1-whis*iqr)&(x<=q3+whis*iqr)
+    whislo,whishi = (np.min(x[inside]),np.max(x[inside])) if np.any(inside) else (q1,q3)
+    fliers = x[nz&~inside]
+    if len(fliers)>max_fliers:
+        fliers = np.sort(np.random.RandomState(seed).choice(fliers,max_fliers,replace=False))
+    res = {'med':med,'q1':q1,'q3':q3,'iqr':iqr,'whislo':min(whislo,q1),'whishi':max(whishi,q3)
+           ,'fliers':fliers,'mean':np.dot(counts,x)/float(n)}
+    if label is not None:
+        res['label'] = label
+    return res
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from thermal_testing import synthetic_fixture
+        self.tmp = synthetic_fixture(self,indices=[1,2])
+        self.names = ['H.1','H.2','D.1','D.2']
+
+    def test_histograms(self):
+        from scipy.stats import skew,kurtosis
+        idx = get_index(self.names)
+        self.assertEqual(idx['names'],self.names)
+        rois = thermal_utlis.get_animal_rois('D.2')
+        self.assertSequenceEqual(np.sum(idx['hist'][3],axis=1)[1:].tolist(),[len(v) for v in rois])
+        v = np.concatenate([thermal_utlis.get_animal_rois(n)[7] for n in self.names])
+        n,mean,std,s,k = hist_moments(get_histogram(self.names,[8]))
+        self.assertEqual(n,len(v))
+        self.assertAlmostEqual(mean,np.mean(v))
+        self.assertAlmostEqual(std,np.std(v))
+        self.assertAlmostEqual(s,skew(v))
+        self.assertAlmostEqual(k,kurtosis(v))
+        self.assertAlmostEqual(hist_quantiles(get_histogram(self.names,[8]),0.5),np.median(v))
+        #an even number of values, the median is between the middle ones
+        w = np.round(np.random.RandomState(0).rand(10)*10,2)
+        c = np.bincount(np.round(w/HIST_STEP).astype(np.int64),minlength=len(hist_centers()))
+        self.assertTrue(np.allclose(hist_quantiles(c,[0,0.25,0.5,0.9,1]),np.quantile(w,[0,0.25,0.5,0.9,1])))
+        counts,edges = rebin(get_histogram(self.names,[8]),20)
+        self.assertEqual(np.sum(counts),len(v))
+        self.assertEqual(len(edges),len(counts)+1)
+        self.assertTrue(edges[0]<=np.min(v)<=edges[1] and edges[-2]<=np.max(v)<=edges[-1])
+
+    def test_moments(self):
+        from scipy.stats import skew,kurtosis
+        #data off the grid and outside it
+        fname = animal_file('D.1')
+        arr = dict(np.load(fname))
+        arr['data'] = arr['data']+np.random.RandomState(0).rand(*arr['data'].shape)*HIST_STEP
+        rr,cc = np.nonzero(arr['gt']==8)
+        arr['data'][rr[:3],cc[:3]] = [-5,60,70]
+        np.savez_compressed(fname,**arr)
+        with self.assertWarns(UserWarning):
+            get_index(self.names)
+        for rois in [[8],[1,2,8]]:
+            v = np.concatenate([thermal_utlis.get_animal_rois(n)[r-1] for n in self.names for r in rois])
+            n,mean,std,s,k = get_moments(self.names,rois)
+            self.assertEqual(n,len(v))
+            self.assertTrue(np.allclose([mean,std,s,k],[np.mean(v),np.std(v),skew(v),kurtosis(v)],rtol=1e-10))
+            self.assertFalse(np.isclose(hist_moments(get_histogram(self.names,rois))[1],np.mean(v),rtol=1e-6))
+
+    def test_empty(self):
+        get_index(self.names)
+        self.assertTrue(np.all(np.isnan(moment_stats(np.zeros(5))[1:])))
+        self.assertEqual(moment_stats(np.zeros(5))[0],0)
+
+    def test_checked(self):
+        from unittest import mock
+        import thermal_index
+        get_index(self.names)
+        with mock.patch.object(thermal_index,'get_digest',wraps=get_digest) as digest:
+            get_index(self.names)
+            get_bboxes('D.2')
+            thermal_utlis.get_animal_rois('H.1')
+            self.assertEqual(digest.call_count,0)
+            get_index(self.names,check=True)
+            self.assertEqual(digest.call_count,len(self.names))
+
+    def test_box_stats(self):
+        from matplotlib.cbook import boxplot_stats
+        for r in [3,8]:
+            v = np.concatenate([thermal_utlis.get_animal_rois(n)[r-1] for n in self.names])
+            v[:3] = [0.5,49,48.5]
+            counts = np.bincount(np.round(v/HIST_STEP).astype(np.int64),minlength=len(hist_centers()))
+            bs = boxplot_stats(v)[0]
+            res = box_stats(counts)
+            for k in ['med','q1','q3','whislo','whishi','mean']:
+                self.assertAlmostEqual(res[k],bs[k])
+            self.assertTrue(np.allclose(res['fliers'],np.unique(bs['fliers'])))
+        self.assertEqual(len(box_stats(counts,whis=0,max_fliers=10)['fliers']),10)
+
+    def test_bboxes(self):
+        data,anno = get_animal('D.2')
+        box = get_bboxes('D.2')
+        for c in range(1,N_LABELS):
+            rr,cc = np.nonzero(anno==c)
+            self.assertSequenceEqual(box[c].tolist(),[rr.min(),rr.max()+1,cc.min(),cc.max()+1])
+        rr,cc = np.nonzero(anno>0)
+        self.assertSequenceEqual(box[0].tolist(),[rr.min(),rr.max()+1,cc.min(),cc.max()+1])
+        rois = thermal_utlis.get_animal_rois('D.2')
+        self.assertSequenceEqual(rois[6],data[anno==7].tolist())
+        r0,r1,c0,c1 = get_crop(self.names,margin=2)
+        self.assertTrue(np.all(anno[:r0]==0) and np.all(anno[r1:]==0) and r0==box[0,0]-2)
+        self.assertTrue(np.all(anno[:,:c0]==0) and np.all(anno[:,c1:]==0) and c1==box[0,3]+2)
+
+    def test_lazy(self):
+        rois = thermal_utlis.get_animal_rois('D.2')
+        self.assertFalse(os.path.exists(index_file()))
+        get_bboxes('D.2')
+        self.assertEqual(sorted(get_index([])['names']),sorted(self.names))
+        self.assertSequenceEqual(thermal_utlis.get_animal_rois('D.2'),rois)
+
+    def test_update(self):
+        get_index(self.names)
+        _index['file'] = None
+        fname = animal_file('H.2')
+        arr = dict(np.load(fname))
+        arr['gt'][arr['gt']==4] = 0
+        np.savez_compressed(fname,**arr)
+        idx = get_index(self.names)
+        self.assertEqual(np.sum(idx['hist'][1,4]),0)
+        self.assertTrue(np.sum(idx['hist'][0,4])>0)
+
+
+if __name__ == '__main__':
+    get_index()
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Hierarchical (mixed-effects) GOR comparisons
+
+Pixels are nested within animals: a pixel of GOR g of animal i is
+y = mu_g + u_i + e, with a random animal effect u_i ~ N(0,tau2) and
+pixel noise e ~ N(0,sigma2_ig). The model is fitted from per-animal
+sufficient statistics (count, mean and variance of pixels, exact moments
+from the dataset index): animal means have variance tau2+sigma2_ig/n_ig, tau2 is
+estimated by REML (Fisher scoring, batched over all comparisons at once).
+
+compare_gors_mixed: GOR r vs c within a species (differences of animal
+    means, tau2 is the between-animal variance of the difference),
+    shaped like the pattern matrices; GORs may overlap (e.g. Neck and
+    Frontquarter), the variance of a difference includes the covariance
+    of the means through shared pixels
+compare_species_mixed: species effects per GOR (random animal intercept)
+"""
+import math
+import os
+import unittest
+import numpy as np
+import thermal_utlis
+from thermal_utlis import get_name,GOR_CLASSES,INDICES,ATYPES
+from thermal_index import animal_moments,combine_moments
+from thermal_results import PatternMatrices,gors_meta
+
+
+def _stats(m):
+    """
+    n, mean, variance of pixels from moments (... x 5)
+    """
+    n = m[...,0]
+    with np.errstate(invalid='ignore',divide='ignore'):
+        var = m[...,2]/(n-1)
+    return n,m[...,1],var
+
+
+def gor_moments(atype='H',a_indices=INDICES,gors=GOR_CLASSES):
+    """
+    returns per-animal sufficient statistics of GORs
+
+    returns:
+        n, mean, variance of pixels (arrays animals x GORs)
+    """
+    m = animal_moments([get_name(atype,a) for a in a_indices])
+    return _stats(np.stack([combine_moments(m[:,g['roi_group']]) for g in gors],axis=1))
+
+
+def overlap_moments(atype='H',a_indices=INDICES,gors=GOR_CLASSES):
+    """
+    returns per-animal sufficient statistics of pixels shared by pairs
+    of GORs (ROIs in both)
+
+    returns:
+        n, mean, variance of pixels (arrays animals x GORs x GORs)
+    """
+    m = animal_moments([get_name(atype,a) for a in a_indices])
+    N = len(gors)
+    res = np.zeros((len(a_indices),N,N,5))
+    for r in range(N):
+        for c in range(N):
+            shared = sorted(set(gors[r]['roi_group'])&set(gors[c]['roi_group']))
+            if shared:
+                res[:,r,c] = combine_moments(m[:,shared])
+    return _stats(res)
+
+
+def reml(y,v,X,n_iter=100,tol=1e-10):
+    """
+    REML fit of y ~ N(X beta, diag(tau2+v)), batched over leading axes
+
+    parameters:
+        y: observations (... x A)
+        v: known variances of observations (... x A)
+        X: design matrix (A x P), shared by all fits
+        n_iter: max. number of Fisher scoring iterations
+        tol: tolerance for tau2
+
+    returns:
+        beta (... x P), covariance of beta (... x P x P), tau2 (...)
+    """
+    y,v = np.asarray(y,dtype=np.float64),np.asarray(v,dtype=np.float64)
+    A,P = X.shape
+    #moment estimate as a starting point
+    tau2 = np.maximum(np.var(y,axis=-1,ddof=P)-np.mean(v,axis=-1),0)
+    for _ in range(n_iter):
+        w = 1/(v+tau2[...,np.newaxis])
+        XtWX = np.einsum('ap,...a,aq->...pq',X,w,X)
+        WX = w[...,:,np.newaxis]*X
+        Pm = np.einsum('...a,ab->...ab',w,np.eye(A))-WX@np.linalg.solve(XtWX,np.swapaxes(WX,-1,-2))
+        Py = np.einsum('...ab,...b->...a',Pm,y)
+        score = 0.5*(np.einsum('...a,...a->...',Py,Py)-np.trace(Pm,axis1=-2,axis2=-1))
+        info = 0.5*np.einsum('...ab,...ba->...',Pm,Pm)
+        new = np.maximum(tau2+score/info,0)
+        done = np.all(np.abs(new-tau2)<=tol*np.maximum(1,tau2))
+        tau2 = new
+        if done:
+            break
+    w = 1/(v+tau2[...,np.newaxis])
+    cov = np.linalg.inv(np.einsum('ap,...a,aq->...pq',X,w,X))
+    beta = np.einsum('...pq,aq,...a,...a->...p',cov,X,w,y)
+    return beta,cov,tau2
+
+
+def _pvalue(delta,se):
+    """
+    one-sided p-value in the direction of delta (as in the pattern matrices)
+    """
+    with np.errstate(invalid='ignore',divide='ignore'):
+        z = np.abs(delta)/se
+    return 0.5*np.vectorize(math.erfc)(z/math.sqrt(2))
+
+
+def compare_gors_mixed(atype='H',a_indices=INDICES,gors=GOR_CLASSES):
+    """
+    compares all pairs of GORs of a species with the hierarchical model
+
+    returns:
+        dictionary with deltas, se, tau2, p_global (GORs x GORs) and
+        p_local (GORs x GORs x animals, a z-test of the difference of means
+        of every animal, as the local matrices of prepare_pattern_matrices)
+    """
+    n,mean,var = gor_moments(atype,a_indices,gors)
+    y = np.moveaxis(mean[:,:,np.newaxis]-mean[:,np.newaxis,:],0,-1)
+    e = var/n
+    #Var(mean_r-mean_c) = Var(mean_r)+Var(mean_c)-2*n_o*var_o/(n_r*n_c) for n_o shared pixels
+    n_o,_,var_o = overlap_moments(atype,a_indices,gors)
+    with np.errstate(invalid='ignore',divide='ignore'):
+        cov = np.where(n_o>1,n_o*var_o,0)/(n[:,:,np.newaxis]*n[:,np.newaxis,:])
+    v = np.moveaxis(e[:,:,np.newaxis]+e[:,np.newaxis,:]-2*cov,0,-1)
+    N = len(gors)
+    res = {k:np.zeros((N,N)) for k in ['deltas','se','tau2']}
+    res['p_global'] = np.ones((N,N))
+    r,c = np.nonzero(~np.eye(N,dtype=bool))
+    beta,cov,tau2 = reml(y[r,c],v[r,c],np.ones((len(a_indices),1)))
+    res['deltas'][r,c] = beta[:,0]
+    res['se'][r,c] = np.sqrt(cov[:,0,0])
+    res['tau2'][r,c] = tau2
+    res['p_global'][r,c] = _pvalue(res['deltas'][r,c],res['se'][r,c])
+    res['p_local'] = np.ones((N,N,len(a_indices)))
+    res['p_local'][r,c] = _pvalue(y[r,c],np.sqrt(v[r,c]))
+    return res
+
+
+def compare_species_mixed(atypes=ATYPES,a_indices=INDICES,gors=GOR_CLASSES):
+    """
+    compares species in every GOR with a random animal intercept
+
+    returns:
+        dictionary with deltas, se, p (species x species x GORs,
+        [k,l] is species k minus species l) and tau2 (GORs)
+    """
+    stats = [gor_moments(atype,a_indices,gors) for atype in atypes]
+    K = len(atypes)
+    y = np.concatenate([m for _,m,_ in stats]).T
+    v = np.concatenate([s/n for n,_,s in stats]).T
+    X = np.kron(np.eye(K),np.ones((len(a_indices),1)))
+    beta,cov,tau2 = reml(y,v,X)
+    deltas = np.moveaxis(beta[:,:,np.newaxis]-beta[:,np.newaxis,:],0,-1)
+    d = np.diagonal(cov,axis1=1,axis2=2)
+    var = d[:,:,np.newaxis]+d[:,np.newaxis,:]-2*cov
+    se = np.moveaxis(np.sqrt(np.maximum(var,0)),0,-1)
+    p = np.ones_like(deltas)
+    off = ~np.eye(K,dtype=bool)
+    p[off] = _pvalue(deltas[off],se[off])
+    return {'deltas':deltas,'se':se,'p':p,'tau2':tau2}
+
+
+def stats_species_gors_mixed(gors=GOR_CLASSES,p=0.001):
+    """
+    prints H/D differences of GORs from the hierarchical model
+    (a counterpart of stats_species_gors)
+    """
+    res = compare_species_mixed(['H','D'],gors=gors)
+    for g,rg in enumerate(gors):
+        print ("{}: H-D {:0.2f} ({:0.2f}), p {:0.4f}, {}".format(rg['group_name'],res['deltas'][0,1,g]
+                                                                 ,res['se'][0,1,g],res['p'][0,1,g],res['p'][0,1,g]<p))
+    return res
+
+
+def prepare_pattern_matrices_mixed(atype='H',gors=GOR_CLASSES,suffix='_mixed',a_indices=INDICES):
+    """
+    saves pattern matrices of the hierarchical model (deltas, p_global,
+    p_local, se, tau2), use load_pattern_matrices(atype,suffix=suffix)
+    """
+    res = compare_gors_mixed(atype,a_indices,gors)
+    PatternMatrices(res,atype=atype,a_indices=[int(a) for a in a_indices],gors=gors_meta(gors)
+                    ,model='random animal effect').save('pattern_matrices_{}{}'.format(atype,suffix))
+    return res
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from thermal_testing import synthetic_fixture
+        self.tmp = synthetic_fixture(self,indices=[1,2,3,4,5,6],shape=(30,40))
+
+    def test_reml(self):
+        rs = np.random.RandomState(0)
+        y = rs.randn(5,12)*2+1
+        v = np.full((5,12),0.5)
+        beta,cov,tau2 = reml(y,v,np.ones((12,1)))
+        #balanced case: closed form
+        self.assertTrue(np.allclose(tau2,np.maximum(np.var(y,axis=1,ddof=1)-0.5,0)))
+        self.assertTrue(np.allclose(beta[:,0],np.mean(y,axis=1)))
+        self.assertTrue(np.allclose(cov[:,0,0],(tau2+0.5)/12))
+
+    def test_gors(self):
+        gors = GOR_CLASSES[:4]
+        n,mean,var = gor_moments('D',[1,2,3],gors)
+        v = np.concatenate([np.array(thermal_utlis.get_animal_rois('D.2')[r-1]) for r in gors[2]['roi_group']])
+        self.assertEqual(n[1,2],len(v))
+        self.assertAlmostEqual(mean[1,2],np.mean(v))
+        self.assertAlmostEqual(var[1,2],np.var(v,ddof=1))
+        res = compare_gors_mixed('D',[1,2,3,4,5,6],gors)
+        self.assertTrue(np.allclose(res['deltas'],-res['deltas'].T))
+        self.assertTrue(np.allclose(res['p_global'],res['p_global'].T))
+        self.assertTrue(res['p_global'][0,1]<0.001 and res['deltas'][0,1]<0)
+        sp = compare_species_mixed(['H','D'],[1,2,3,4,5,6],gors)
+        self.assertEqual(sp['deltas'].shape,(2,2,4))
+        self.assertTrue(np.all(sp['deltas'][0,1]>0))
+        means = [np.mean(gor_moments(a,[1,2,3,4,5,6],gors)[1],axis=0) for a in 'HD']
+        self.assertTrue(np.allclose(sp['deltas'][0,1],means[0]-means[1],atol=0.05))
+
+    def test_nested(self):
+        #Neck is a part of Frontquarter, Trunk is disjoint from both
+        gors = GOR_CLASSES[:3]
+        self.assertTrue(set(gors[0]['roi_group'])<set(gors[1]['roi_group']))
+        n,mean,var = gor_moments('D',[1,2,3,4,5,6],gors)
+        n_o,mean_o,var_o = overlap_moments('D',[1,2,3,4,5,6],gors)
+        self.assertTrue(np.array_equal(n_o[:,0,1],n[:,0]) and np.all(n_o[:,0,2]==0))
+        self.assertTrue(np.allclose(var_o[:,0,1],var[:,0]))
+        #nested GORs: Var(mean_neck-mean_front) = s2_neck/n_neck+s2_front/n_front-2*s2_neck/n_front
+        e = var/n
+        v = e[:,0]+e[:,1]-2*n_o[:,0,1]*var_o[:,0,1]/(n[:,0]*n[:,1])
+        self.assertTrue(np.allclose(v,var[:,0]/n[:,0]+var[:,1]/n[:,1]-2*var[:,0]/n[:,1]))
+        self.assertTrue(np.all((v>0)&(v<e[:,0]+e[:,1])))
+        res = compare_gors_mixed('D',[1,2,3,4,5,6],gors)
+        self.assertTrue(np.allclose(res['se'],res['se'].T))
+
+    def test_pattern_matrices(self):
+        from thermal_stats import load_pattern_matrices,compare_pattern_matrices,prepare_pattern_matrices
+        #results are saved in the run directory, relative to the working directory
+        cwd = os.getcwd()
+        os.chdir(self.tmp)
+        self.addCleanup(os.chdir,cwd)
+        gors = GOR_CLASSES[:4]
+        indices = [1,2,3,4,5,6]
+        res = prepare_pattern_matrices_mixed('D',gors=gors,a_indices=indices)
+        pm = load_pattern_matrices('D',suffix='_mixed')
+        self.assertEqual(pm['p_local'].shape,(4,4,6))
+        self.assertEqual(pm['s_local'].shape,(4,4,6))
+        self.assertTrue(np.all(np.diagonal(pm['p_local'])==1))
+        #the local test of an animal: difference of means over its standard error
+        n,mean,var = gor_moments('D',[2],gors)
+        n_o,_,var_o = overlap_moments('D',[2],gors)
+        se = np.sqrt(var[0,0]/n[0,0]+var[0,2]/n[0,2]-2*np.where(n_o[0,0,2]>1,n_o[0,0,2]*var_o[0,0,2],0)/(n[0,0]*n[0,2]))
+        self.assertAlmostEqual(res['p_local'][0,2,1],_pvalue(mean[0,0]-mean[0,2],se))
+        prepare_pattern_matrices('D',gors=gors,n_boot=0,a_indices=indices)
+        comp = compare_pattern_matrices(['D',('D','_mixed')])
+        self.assertEqual(comp['local'].shape,(2,2,4,4))
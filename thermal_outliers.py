@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Leave-one-animal-out outlier scoring
+
+Every animal's individual pattern matrix is compared with the pattern
+matrix of its species computed without that animal (as in
+thermal_fig_ROI_matrix_spec.plot_pattern_matrix_combined_spced).
+The MWW test uses complete (not truncated) GOR vectors, so the U statistic
+of the species matrix decomposes over animals and the leave-one-out
+statistic is obtained from the pooled one without re-sorting. The species
+matrix of the scores is therefore not the one of stats_species_gors or
+prepare_pattern_matrices (thermal_stats), which truncate samples to the
+length of the shorter one.
+Sorted GOR vectors of animals are cached (GOR_STATS_DIR, keyed by the
+archive digest and the GOR set).
+"""
+import os
+import unittest
+import numpy as np
+from thermal_utlis import get_animal,get_name,extract_rois,GOR_CLASSES,SCHEMA,INDICES,ANOMALOUS_DONKEY_INDICES
+from thermal_index import get_bboxes
+from thermal_validate import get_digest
+from thermal_results import OutlierScores,GorVectors,gors_meta,gors_key
+from thermal_ranks import merge_u,runs,u_pvalue,u_statistic,mww_sorted
+
+GOR_STATS_DIR = os.path.join('cache','gor_stats')
+
+
+def get_animal_gor_stats(atype='D',a_indices=INDICES,gors=GOR_CLASSES,cache_dir=GOR_STATS_DIR):
+    """
+    returns per-animal GOR statistics reused by the scoring engine,
+    cached per animal (archive digest) and GOR set
+
+    parameters:
+        atype: animal type [H,D]
+        a_indices: animal indices
+        gors: list of GORs (as GOR_CLASSES)
+        cache_dir: None (no cache) or the cache directory
+
+    returns:
+        a dictionary indexed by animals with lists (one element per GOR)
+        of sorted GOR vectors
+    """
+    stats = {}
+    for a in a_indices:
+        name = get_name(atype,a)
+        key = None
+        if cache_dir is not None:
+            digest = get_digest(name)
+            key = 'gor_{}_{}_{}'.format(name,gors_key(gors),digest[:16])
+            if os.path.exists(os.path.join(cache_dir,key+'.res')):
+                res = GorVectors.load(key,run_dir=cache_dir,mmap=False)
+                o = res['offsets']
+                stats[a] = [res['data'][o[g]:o[g+1]] for g in range(len(gors))]
+                continue
+        arr,anno = get_animal(name)
+        rois = extract_rois(arr,anno,get_bboxes(name))
+        stats[a] = [np.sort(np.concatenate([rois[SCHEMA.lut[r]] for r in g['roi_group']])) for g in gors]
+        if key is not None:
+            offsets = np.concatenate([[0],np.cumsum([len(v) for v in stats[a]])]).astype(np.int64)
+            GorVectors({'data':np.concatenate(stats[a]),'offsets':offsets},name=name,digest=digest
+                       ,gors=gors_meta(gors)).save(key,run_dir=cache_dir)
+    return stats
+
+
+def _pooled_counts(values,xs,ys):
+    """
+    returns counts of values in the pooled sample of sorted xs and ys
+    """
+    return (np.searchsorted(xs,values,side='right')-np.searchsorted(xs,values,side='left')
+            +np.searchsorted(ys,values,side='right')-np.searchsorted(ys,values,side='left')).astype(np.float64)
+
+
+def score_animals(atype='D',a_indices=INDICES+ANOMALOUS_DONKEY_INDICES,ref_indices=INDICES,p=0.001
+                  ,gors=GOR_CLASSES,stats=None,cache_dir=GOR_STATS_DIR):
+    """
+    scores agreement of individual pattern matrices with the
+    leave-one-out species pattern matrix
+
+    parameters:
+        atype: animal type [H,D]
+        a_indices: indices of scored animals
+        ref_indices: indices of animals forming the species matrix
+            (a scored animal is left out if it is among them)
+        p: required p value for the MWW test
+        gors: list of GORs (as GOR_CLASSES)
+        stats: None or the result of get_animal_gor_stats() for all
+            a_indices and ref_indices
+        cache_dir: cache of get_animal_gor_stats() (None: no cache)
+
+    returns:
+        dictionary with:
+            indices: scored animal indices
+            scores: fraction of significant cells of the species matrix
+                with the same sign and significance in the animal matrix
+            deltas, p: individual pattern matrices (animals x N x N)
+            loo_deltas, loo_p: leave-one-out species matrices
+    """
+    N = len(gors)
+    a_indices = list(a_indices)
+    if stats is None:
+        stats = get_animal_gor_stats(atype,sorted(set(a_indices)|set(ref_indices)),gors=gors,cache_dir=cache_dir)
+
+    pool = [np.sort(np.concatenate([stats[a][g] for a in ref_indices])) for g in range(N)]
+    pool_n = np.array([len(v) for v in pool],dtype=np.float64)
+    pool_s = np.array([np.sum(v) for v in pool])
+    pool_u = np.zeros((N,N))
+    pool_t = np.zeros((N,N))
+    for r in range(N):
+        for c in range(r+1,N):
+            pool_u[r,c],pool_t[r,c] = merge_u(pool[r],pool[c])
+
+    A = len(a_indices)
+    deltas = np.zeros((A,N,N))
+    pvals = np.ones((A,N,N))
+    loo_deltas = np.zeros((A,N,N))
+    loo_p = np.ones((A,N,N))
+    for i,a in enumerate(a_indices):
+        x = stats[a]
+        n = np.array([len(v) for v in x],dtype=np.float64)
+        s = np.array([np.sum(v) for v in x])
+        inside = a in ref_indices
+        ln = pool_n-n if inside else pool_n
+        ls = pool_s-s if inside else pool_s
+        for r in range(N):
+            for c in range(r+1,N):
+                deltas[i,r,c] = s[r]/n[r]-s[c]/n[c]
+                alternative = 'greater' if deltas[i,r,c]>0 else 'less'
+                pvals[i,r,c] = mww_sorted(x[r],x[c],alternative=alternative)[1]
+
+                u,ties = pool_u[r,c],pool_t[r,c]
+                if inside:
+                    #U(X\a,Y\a) = U(X,Y)-U(Xa,Y)-U(X,Ya)+U(Xa,Ya)
+                    u_ay = u_statistic(x[r],pool[c])
+                    u_xa = pool_n[r]*n[c]-u_statistic(x[c],pool[r])
+                    u_aa = u_statistic(x[r],x[c])
+                    u = u-u_ay-u_xa+u_aa
+                    #tie groups of the animal are removed from the pooled groups
+                    values,counts = runs(np.sort(np.concatenate([x[r],x[c]])))
+                    pc = _pooled_counts(values,pool[r],pool[c])
+                    lc = pc-counts
+                    ties = ties-np.sum(pc**3-pc)+np.sum(lc**3-lc)
+                loo_deltas[i,r,c] = ls[r]/ln[r]-ls[c]/ln[c]
+                alternative = 'greater' if loo_deltas[i,r,c]>0 else 'less'
+                loo_p[i,r,c] = u_pvalue(u,ln[r],ln[c],ties,alternative=alternative)
+    for arr in [deltas,loo_deltas]:
+        arr -= np.transpose(arr,(0,2,1))
+    for arr in [pvals,loo_p]:
+        arr[:] = np.minimum(arr,np.transpose(arr,(0,2,1)))
+
+    s_ind = pvals<p
+    s_loo = loo_p<p
+    cells = s_loo.copy()
+    cells[:,np.arange(N),np.arange(N)] = False
+    agree = np.logical_and(np.sign(deltas)==np.sign(loo_deltas),s_ind==s_loo)
+    total = np.sum(cells,axis=(1,2))
+    scores = np.sum(np.logical_and(agree,cells),axis=(1,2))/np.maximum(total,1)
+    return {'indices':np.array(a_indices),'scores':scores,'deltas':deltas,'p':pvals
+            ,'loo_deltas':loo_deltas,'loo_p':loo_p}
+
+
+def rank_animals(atype='D',p=0.001,save=True,**kwargs):
+    """
+    ranks animals of a species by agreement with their species pattern
+    (the least typical first) and prints the ranking
+
+    parameters:
+        atype: animal type [H,D]
+        p: required p value for the MWW test
+        save: True/False: save results as outlier_scores_{atype}
+            (thermal_results.OutlierScores)
+        kwargs: parameters of score_animals()
+
+    returns:
+        result of score_animals()
+    """
+    if atype!='D' and 'a_indices' not in kwargs:
+        kwargs['a_indices'] = INDICES
+    res = score_animals(atype=atype,p=p,**kwargs)
+    for k in np.argsort(res['scores'],kind='stable'):
+        print ("{}: {:0.3f}".format(get_name(atype,res['indices'][k]),res['scores'][k]))
+    if save:
+        OutlierScores(res,atype=atype,p=p).save('outlier_scores_{}'.format(atype))
+    return res
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from thermal_testing import synthetic_fixture
+        self.tmp = synthetic_fixture(self,atypes=['D'],indices=[1,2,3,4,5])
+        #an animal with the reversed thermal pattern
+        fname = '{}data/da_D.5.npz'.format(self.tmp)
+        arr = dict(np.load(fname))
+        arr['data'][arr['gt']>0] = 50-arr['data'][arr['gt']>0]
+        np.savez_compressed(fname,**arr)
+
+    def test_loo(self):
+        from scipy.stats import mannwhitneyu
+        gors = GOR_CLASSES[:4]
+        res = score_animals(a_indices=[1,5],ref_indices=[1,2,3,4],gors=gors,cache_dir=None)
+        stats = get_animal_gor_stats('D',[2,3,4],gors=gors,cache_dir=None)
+        for r,c in [(0,2),(3,1)]:
+            x = np.concatenate([stats[a][r] for a in [2,3,4]])
+            y = np.concatenate([stats[a][c] for a in [2,3,4]])
+            alternative = 'greater' if np.mean(x)>np.mean(y) else 'less'
+            _,s_p = mannwhitneyu(x,y,alternative=alternative,method='asymptotic')
+            self.assertAlmostEqual(res['loo_deltas'][0,r,c],np.mean(x)-np.mean(y))
+            self.assertTrue(np.isclose(res['loo_p'][0,r,c],s_p,rtol=1e-6,atol=1e-300))
+
+    def test_scores(self):
+        cache = os.path.join(self.tmp,'gor_stats')
+        res = score_animals(a_indices=[1,2,3,4,5],ref_indices=[1,2,3,4],cache_dir=cache)
+        self.assertEqual(np.argmin(res['scores']),4)
+        self.assertTrue(np.all(res['scores'][:4]>0.5))
+        self.assertEqual(len(os.listdir(cache)),5)
+        res2 = score_animals(a_indices=[1,2,3,4,5],ref_indices=[1,2,3,4],cache_dir=cache)
+        self.assertTrue(np.array_equal(res2['loo_p'],res['loo_p']))
+
+    def test_cache(self):
+        gors = GOR_CLASSES[:3]
+        cache = os.path.join(self.tmp,'gor_stats')
+        stats = get_animal_gor_stats('D',[1,2],gors=gors,cache_dir=cache)
+        cached = get_animal_gor_stats('D',[1,2],gors=gors,cache_dir=cache)
+        self.assertTrue(all(np.array_equal(u,v) for a in [1,2] for u,v in zip(stats[a],cached[a])))
+        self.assertEqual(len(os.listdir(cache)),2)
+        get_animal_gor_stats('D',[1],gors=gors[:2],cache_dir=cache)
+        self.assertEqual(len(os.listdir(cache)),3)
+        #a changed archive is recomputed
+        fname = '{}data/da_D.2.npz'.format(self.tmp)
+        arr = dict(np.load(fname))
+        arr['data'] = arr['data']+1
+        np.savez_compressed(fname,**arr)
+        stats = get_animal_gor_stats('D',[2],gors=gors,cache_dir=cache)
+        self.assertEqual(len(os.listdir(cache)),4)
+        self.assertTrue(np.allclose(stats[2][0],cached[2][0]+1))
+
+
+if __name__ == '__main__':
+    rank_animals('D')
+    rank_animals('H')
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Rank kernel for the Mann-Whitney-Wilcoxon test
+
+The U statistic and the tie term are computed by merging two pre-sorted
+vectors in O(n+m), so every GOR vector has to be sorted only once
+(see presort()). The kernel is JIT-compiled with numba if it is
+available, otherwise a vectorised NumPy version is used.
+The p-value follows the normal approximation with tie and continuity
+correction, as in scipy.stats.mannwhitneyu.
+"""
+import math
+import unittest
+import numpy as np
+
+def _merge_u_numpy(xs,ys):
+    """
+    U statistic of xs and the tie term of the pooled sample (NumPy version)
+    parameters:
+        xs, ys: sorted 1D arrays
+    returns:
+        u: U statistic of xs
+        ties: sum of t^3-t over groups of tied values in xs+ys
+    """
+    vx,cx = runs(xs)
+    vy,cy = runs(ys)
+    lo = np.searchsorted(ys,vx,side='left')
+    hi = np.searchsorted(ys,vx,side='right')
+    cxy = (hi-lo).astype(np.float64)
+    cx = cx.astype(np.float64)
+    cy = cy.astype(np.float64)
+    u = np.sum(cx*(lo+0.5*cxy))
+    tt = cx+cxy
+    ties = np.sum(tt**3-tt)+np.sum(cy**3-cy)-np.sum(cxy**3-cxy)
+    return float(u),float(ties)
+
+
+def runs(s):
+    """
+    returns unique values and their counts for a sorted array
+    """
+    if len(s)==0:
+        return s,np.zeros(0,dtype=np.int64)
+    flags = np.empty(len(s),dtype=bool)
+    flags[0] = True
+    np.not_equal(s[1:],s[:-1],out=flags[1:])
+    idx = np.flatnonzero(flags)
+    return s[idx],np.diff(np.append(idx,len(s)))
+
+
+def _merge_u_loop(xs,ys):
+    """
+    U statistic of xs and the tie term of the pooled sample (merge loop,
+    compiled with numba)
+    """
+    n = xs.shape[0]
+    m = ys.shape[0]
+    i = 0
+    j = 0
+    u = 0.0
+    ties = 0.0
+    while i<n or j<m:
+        if j>=m or (i<n and xs[i]<=ys[j]):
+            v = xs[i]
+        else:
+            v = ys[j]
+        below = j
+        cx = 0
+        while i<n and xs[i]==v:
+            i+=1
+            cx+=1
+        cy = 0
+        while j<m and ys[j]==v:
+            j+=1
+            cy+=1
+        u += cx*(below+0.5*cy)
+        t = float(cx+cy)
+        ties += t*t*t-t
+    return u,ties
+
+
+_kernel = None
+
+def merge_u(xs,ys):
+    """
+    U statistic of xs and the tie term of the pooled sample
+    parameters:
+        xs, ys: sorted 1D arrays
+
+    the kernel is selected (and compiled with numba) on the first call
+    """
+    global _kernel
+    if _kernel is None:
+        try:
+            from numba import njit
+            _kernel = njit(cache=True,nogil=True)(_merge_u_loop)
+        except ImportError:
+            _kernel = _merge_u_numpy
+    return _kernel(xs,ys)
+
+
+def u_statistic(xs,ys):
+    """
+    U statistic of xs without the tie term, O(n log m) for a short xs
+    and a long ys
+    parameters:
+        xs: 1D array
+        ys: sorted 1D array
+    """
+    lo = np.searchsorted(ys,xs,side='left')
+    hi = np.searchsorted(ys,xs,side='right')
+    return float(np.sum(lo)+0.5*np.sum(hi-lo))
+
+
+def presort(v):
+    """
+    returns a sorted copy of a vector with the sorting permutation,
+    to be reused by the MWW test for every comparison of the vector
+
+    parameters:
+        v: 1D array
+    returns:
+        (sorted v, stable argsort of v)
+    """
+    v = np.asarray(v)
+    order = np.argsort(v,kind='stable')
+    return v[order],order
+
+
+def sorted_prefix(v,m,cache=None):
+    """
+    returns the sorted first m elements of v
+    parameters:
+        v: 1D array
+        m: length of the prefix
+        cache: None or the result of presort(v)
+
+    with a cache the prefix is selected in O(n) without sorting
+    """
+    if cache is None:
+        return np.sort(np.asarray(v)[:m])
+    s,order = cache
+    if m>=len(s):
+        return s
+    return s[order<m]
+
+
+def u_pvalue(u,n1,n2,ties,alternative='greater'):
+    """
+    p-value of the U statistic (normal approximation with tie and
+    continuity correction)
+    parameters:
+        u: U statistic of the 1st sample
+        n1,n2: sizes of samples
+        ties: tie term, sum of t^3-t over groups of tied values
+        alternative: 'greater','less' or 'two-sided'
+    """
+    n = n1+n2
+    if alternative not in ('greater','less','two-sided'):
+        raise ValueError("unknown alternative: {}".format(alternative))
+    #as scipy: no p-value for an empty sample
+    if n1==0 or n2==0:
+        return float('nan')
+    if alternative=='greater':
+        uu = u
+    elif alternative=='less':
+        uu = n1*n2-u
+    else:
+        uu = max(u,n1*n2-u)
+    s = math.sqrt(max(n1*n2/12.0*((n+1)-ties/(n*(n-1.0))),0.0))
+    d = uu-n1*n2/2.0-0.5
+    if s==0:
+        #all values tied, as scipy (d/0 -> +-inf)
+        z = math.copysign(float('inf'),d)
+    else:
+        z = d/s
+    p = 0.5*math.erfc(z/math.sqrt(2.0))
+    if alternative=='two-sided':
+        p = min(2*p,1.0)
+    return p
+
+
+def mww_sorted(xs,ys,alternative='greater'):
+    """
+    Mann-Whitney-Wilcoxon test for sorted samples
+    parameters:
+        xs,ys: sorted 1D arrays
+        alternative: 'greater','less' or 'two-sided'
+    returns:
+        U statistic of xs, p-value
+    """
+    u,ties = merge_u(xs,ys)
+    return u,u_pvalue(u,len(xs),len(ys),ties,alternative=alternative)
+
+
+class Test(unittest.TestCase):
+    def _compare(self,x,y):
+        from scipy.stats import mannwhitneyu
+        for alternative in ['greater','less','two-sided']:
+            s,s_p = mannwhitneyu(x,y,alternative=alternative,method='asymptotic')
+            u,p = mww_sorted(np.sort(x),np.sort(y),alternative=alternative)
+            self.assertAlmostEqual(u,s)
+            self.assertTrue(np.isclose(p,s_p,rtol=1e-9,atol=1e-300))
+
+    def test_scipy(self):
+        rs = np.random.RandomState(0)
+        self._compare(rs.rand(200),rs.rand(150)+0.05)
+        self._compare(np.round(rs.rand(300)*20),np.round(rs.rand(100)*20+1))
+        self._compare(np.round(rs.rand(20),1),np.round(rs.rand(30),1))
+
+    def test_small(self):
+        from scipy.stats import mannwhitneyu
+        for alternative in ['greater','less','two-sided']:
+            for x,y in [([],[1.,2.]),([1.],[]),([],[])]:
+                self.assertTrue(np.isnan(mww_sorted(np.array(x),np.array(y),alternative=alternative)[1]))
+            for x,y in [([1.],[2.]),([1.,1.],[1.,1.]),([3.,3.],[3.])]:
+                p = mww_sorted(np.array(x),np.array(y),alternative=alternative)[1]
+                self.assertAlmostEqual(p,mannwhitneyu(x,y,alternative=alternative,method='asymptotic').pvalue)
+
+    def test_kernels(self):
+        rs = np.random.RandomState(1)
+        xs = np.sort(np.round(rs.rand(500)*30,1))
+        ys = np.sort(np.round(rs.rand(400)*30,1))
+        u1,t1 = _merge_u_loop(xs,ys)
+        u2,t2 = _merge_u_numpy(xs,ys)
+        self.assertAlmostEqual(u1,u2)
+        self.assertAlmostEqual(t1,t2)
+        self.assertAlmostEqual(u_statistic(xs,ys),u1)
+
+    def test_prefix(self):
+        rs = np.random.RandomState(2)
+        v = np.round(rs.rand(100)*5)
+        cache = presort(v)
+        for m in [1,17,99,100,120]:
+            self.assertSequenceEqual(sorted_prefix(v,m,cache).tolist(),np.sort(v[:m]).tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
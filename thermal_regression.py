@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Golden-output regression harness for compute stages of the figures
+
+Every stage returns named arrays: 'run' calls the code used by the
+figures, 'reference' is an independent implementation of the same numbers
+(a straightforward loop with numpy/scipy over raw ROI pixels). record() saves outputs of 'run' as golden results
+(thermal_results format, GOLDEN_DIR/<data>/golden_<stage>.res), check()
+compares a new run with the golden results and with the reference
+(within tolerances of the stage) and reports timings, so an optimisation
+ships with an equivalence and speedup report.
+
+Stages:
+    pattern_matrices_H/D: deltas, p-values and significance tensors
+        (prepare_pattern_matrices/load_pattern_matrices)
+    roi_differences: min/mean/median/max of ROIs (get_roi_differences)
+    pixel_counts: numbers of ROI pixels (count_rois_differences)
+    species_gors: H/D significance of GORs (stats_species_gors)
+
+usage:
+    python thermal_regression.py [--synthetic] [--record] [--no-reference] [stage ...]
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+import thermal_utlis
+import thermal_results
+from thermal_utlis import get_name,GOR_CLASSES,SCHEMA,ATYPES,INDICES
+from thermal_results import Result
+
+GOLDEN_DIR = 'golden'
+#significance threshold of pattern matrices and GOR comparisons
+P_VALUE = 0.001
+SEED = 0
+
+
+class Golden(Result):
+    """
+    canonical outputs of a compute stage, metadata: stage, schema, names
+    """
+    __slots__ = ()
+    kind = 'golden'
+
+
+@contextlib.contextmanager
+def _run_dir(run_dir):
+    """
+    temporarily redirects saved results to run_dir
+    """
+    old = thermal_results.RUN_DIR
+    thermal_results.RUN_DIR = run_dir
+    try:
+        yield
+    finally:
+        thermal_results.RUN_DIR = old
+
+
+def _quiet(f,*args,**kwargs):
+    """
+    calls f without printing
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        return f(*args,**kwargs)
+
+
+def _mww_scipy(x,y,alternative):
+    from scipy.stats import mannwhitneyu
+    mm = min(len(x),len(y))
+    return mannwhitneyu(np.asarray(x)[:mm],np.asarray(y)[:mm],alternative=alternative,method='asymptotic').pvalue
+
+
+def _raw_frames(atype):
+    """
+    returns data and class maps of animals read directly from archives
+    (dictionary indexed by animals), reference stages do not use
+    extract_rois or the dataset index
+    """
+    frames = {}
+    for a in INDICES:
+        with np.load("{}data/da_{}.npz".format(thermal_utlis.get_ds_dir(),get_name(atype,a))) as arr:
+            frames[a] = arr['data'],arr['gt']
+    return frames
+
+
+def _raw_group(frames,roi_group):
+    """
+    returns GOR vectors of animals (dictionary) and their concatenation
+    """
+    animals = {a:np.concatenate([data[gt==r] for r in roi_group]) for a,(data,gt) in frames.items()}
+    return animals,np.concatenate([animals[a] for a in INDICES])
+
+
+def pattern_matrices_run(atype):
+    from thermal_stats import prepare_pattern_matrices,load_pattern_matrices
+    tmp = tempfile.mkdtemp(prefix='golden_')
+    try:
+        with _run_dir(tmp):
+            prepare_pattern_matrices(atype,n_boot=0)
+            pm = load_pattern_matrices(atype,p=P_VALUE)
+            return {k:np.array(v) for k,v in pm.items()}
+    finally:
+        shutil.rmtree(tmp)
+
+
+def pattern_matrices_reference(atype):
+    N = len(GOR_CLASSES)
+    frames = _raw_frames(atype)
+    groups = [_raw_group(frames,g['roi_group']) for g in GOR_CLASSES]
+    deltas = np.zeros((N,N))
+    p_global = np.ones((N,N))
+    p_local = np.ones((N,N,len(INDICES)))
+    for r in range(N):
+        for c in range(N):
+            deltas[r,c] = np.mean(groups[r][1])-np.mean(groups[c][1])
+            alternative = 'greater' if deltas[r,c]>0 else 'less'
+            p_global[r,c] = _mww_scipy(groups[r][1],groups[c][1],alternative)
+            for i,a in enumerate(INDICES):
+                p_local[r,c,i] = _mww_scipy(groups[r][0][a],groups[c][0][a],alternative)
+    return {'deltas':deltas,'p_global':p_global,'p_local':p_local
+            ,'s_global':(p_global<P_VALUE).astype(np.int32),'s_local':(p_local<P_VALUE).astype(np.int32)}
+
+
+def roi_differences_run():
+    from thermal_stats import get_roi_differences
+    res = [_quiet(get_roi_differences,rid) for rid in SCHEMA.roi_ids]
+    return {'stats':np.array([[r[atype] for atype in ATYPES] for r in res]),'diff':np.array([r['diff'] for r in res])}
+
+
+def roi_differences_reference():
+    """
+    ROI statistics from raw pixels of frames (without bounding boxes of
+    the index)
+    """
+    rois = {atype:[[data[gt==rid] for rid in SCHEMA.roi_ids] for data,gt in _raw_frames(atype).values()] for atype in ATYPES}
+    stats = np.zeros((SCHEMA.n_rois,len(ATYPES),4))
+    for k in range(SCHEMA.n_rois):
+        for j,atype in enumerate(ATYPES):
+            v = np.concatenate([r[k] for r in rois[atype]])
+            stats[k,j] = [np.min(v),np.mean(v),np.median(v),np.max(v)]
+    return {'stats':stats,'diff':np.abs(stats[:,ATYPES.index('H'),1]-stats[:,ATYPES.index('D'),1])}
+
+
+def pixel_counts_run():
+    from thermal_stats import count_rois_differences
+    res = _quiet(count_rois_differences)
+    return {k:np.asarray(v) for k,v in res.items()}
+
+
+def pixel_counts_reference():
+    h,d = [np.sum([[np.count_nonzero(gt==rid) for rid in SCHEMA.roi_ids] for _,gt in _raw_frames(atype).values()],axis=0)
+           for atype in ['H','D']]
+    diff = np.abs(h-d)
+    return {'h':h,'d':d,'median':100*np.mean([np.median(diff/h),np.median(diff/d)])
+            ,'mean':100*np.mean([np.mean(diff/h),np.mean(diff/d)]),'std':100*np.mean([np.std(diff/h),np.std(diff/d)])}
+
+
+def species_gors_run():
+    from thermal_stats import stats_species_gors
+    res = []
+    for g in GOR_CLASSES:
+        np.random.seed(SEED)
+        res.append(_quiet(stats_species_gors,g['roi_group'],g['group_name'],p=P_VALUE))
+    return {'significant':np.array(res)}
+
+
+def species_gors_reference():
+    frames = {atype:_raw_frames(atype) for atype in ['H','D']}
+    res = []
+    for g in GOR_CLASSES:
+        np.random.seed(SEED)
+        _,H = _raw_group(frames['H'],g['roi_group'])
+        _,D = _raw_group(frames['D'],g['roi_group'])
+        np.random.shuffle(H)
+        np.random.shuffle(D)
+        res.append(_mww_scipy(H,D,'greater')<P_VALUE)
+    return {'significant':np.array(res)}
+
+
+#name: (run, reference, rtol, atol)
+STAGES = [('pattern_matrices_H',lambda: pattern_matrices_run('H'),lambda: pattern_matrices_reference('H'),1e-7,1e-12)
+          ,('pattern_matrices_D',lambda: pattern_matrices_run('D'),lambda: pattern_matrices_reference('D'),1e-7,1e-12)
+          ,('roi_differences',roi_differences_run,roi_differences_reference,1e-12,1e-12)
+          ,('pixel_counts',pixel_counts_run,pixel_counts_reference,0,1e-9)
+          ,('species_gors',species_gors_run,species_gors_reference,0,0)]
+STAGE_NAMES = [s[0] for s in STAGES]
+
+
+def golden_dir(synthetic=False):
+    return os.path.join(GOLDEN_DIR,'synthetic' if synthetic else 'dataset')
+
+
+def compare_outputs(a,b,rtol,atol):
+    """
+    compares arrays present in both outputs
+
+    returns:
+        dictionary {name: max. absolute difference (inf for mismatching
+        shapes or NaNs)}, True/False: all arrays within tolerances
+    """
+    errors,ok = {},True
+    for k in sorted(set(a.keys())&set(b.keys())):
+        x,y = np.asarray(a[k]),np.asarray(b[k])
+        if x.shape!=y.shape:
+            errors[k],ok = np.inf,False
+            continue
+        x,y = np.atleast_1d(x).astype(np.float64),np.atleast_1d(y).astype(np.float64)
+        same = np.isclose(x,y,rtol=rtol,atol=atol,equal_nan=True)
+        ok = ok and bool(np.all(same))
+        d = np.abs(x-y)
+        d[np.isnan(x)&np.isnan(y)] = 0
+        errors[k] = float(np.max(np.where(np.isnan(d),np.inf,d))) if d.size else 0.0
+    return errors,ok
+
+
+def _timed(f):
+    t = time.perf_counter()
+    res = f()
+    return res,time.perf_counter()-t
+
+
+def record(stages=STAGE_NAMES,synthetic=False,out_dir=None):
+    """
+    saves outputs of stages as golden results
+    """
+    out_dir = golden_dir(synthetic) if out_dir is None else out_dir
+    for name,run,_,_,_ in STAGES:
+        if name not in stages:
+            continue
+        res,t = _timed(run)
+        Golden(res,stage=name,schema=SCHEMA.name,indices=list(INDICES),seconds=t).save('golden_{}'.format(name),run_dir=out_dir)
+        print ("{}: recorded ({:0.2f}s)".format(name,t))
+
+
+def check(stages=STAGE_NAMES,synthetic=False,reference=True,out_dir=None,verbose=True):
+    """
+    runs stages and compares them with the golden results and (optionally)
+    with reference implementations
+
+    returns:
+        dictionary {stage: {'golden': (errors, ok) or None if not recorded,
+        'reference': (errors, ok) or None, 'time', 'time_reference',
+        'time_golden' (of the recorded run), 'speedup'}}
+    """
+    out_dir = golden_dir(synthetic) if out_dir is None else out_dir
+    report = {}
+    for name,run,ref,rtol,atol in STAGES:
+        if name not in stages:
+            continue
+        res,t = _timed(run)
+        r = {'time':t,'golden':None,'reference':None,'time_reference':None,'time_golden':None,'speedup':None}
+        if os.path.exists(thermal_results.result_file('golden_{}'.format(name),out_dir)):
+            golden = Golden.load('golden_{}'.format(name),run_dir=out_dir,mmap=False)
+            r['golden'] = compare_outputs(res,golden,rtol,atol)
+            if set(golden.keys())!=set(res.keys()):
+                r['golden'] = (r['golden'][0],False)
+            r['time_golden'] = golden.meta.get('seconds')
+        if reference:
+            out,r['time_reference'] = _timed(ref)
+            r['reference'] = compare_outputs(res,out,rtol,atol)
+            r['speedup'] = r['time_reference']/max(t,1e-9)
+        report[name] = r
+    if verbose:
+        print_report(report)
+    return report
+
+
+def print_report(report):
+    status = lambda v: 'not recorded' if v is None else ('ok' if v[1] else 'FAILED {}'.format(
+        {k:e for k,e in v[0].items() if e>0}))
+    for name,r in report.items():
+        print ("{}: {:0.3f}s (golden run {}), golden: {}".format(name,r['time']
+                                                                ,'-' if r['time_golden'] is None else '{:0.3f}s'.format(r['time_golden'])
+                                                                ,status(r['golden'])))
+        if r['reference'] is not None:
+            print ("    reference: {:0.3f}s, speedup {:0.1f}x, {}".format(r['time_reference'],r['speedup'],status(r['reference'])))
+
+
+def passed(report):
+    """
+    True if all comparisons of a check() report are within tolerances
+    """
+    return all(v[1] for r in report.values() for v in [r['golden'],r['reference']] if v is not None)
+
+
+@contextlib.contextmanager
+def synthetic_dataset(**kwargs):
+    """
+    thermal_testing.synthetic_dataset() in a temporary directory (removed
+    on exit) with the index built beforehand, so stage timings do not
+    include it
+    """
+    from thermal_index import get_index
+    from thermal_testing import synthetic_dataset as synthetic
+    tmp = tempfile.mkdtemp(prefix='thermal_ds_')
+    try:
+        with synthetic(tmp+'/',**kwargs) as ds_dir:
+            get_index([get_name(a,i) for a in kwargs.get('atypes',ATYPES) for i in kwargs.get('indices',INDICES)])
+            yield ds_dir
+    finally:
+        shutil.rmtree(tmp)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='checks outputs of compute stages against golden results')
+    parser.add_argument('stages',nargs='*',default=STAGE_NAMES,help='stages: {}'.format(', '.join(STAGE_NAMES)))
+    parser.add_argument('--synthetic',action='store_true',help='use a synthetic dataset')
+    parser.add_argument('--record',action='store_true',help='record golden results')
+    parser.add_argument('--no-reference',action='store_true',help='skip reference implementations')
+    args = parser.parse_args(argv)
+    with (synthetic_dataset(indices=INDICES+thermal_utlis.ANOMALOUS_DONKEY_INDICES) if args.synthetic
+          else contextlib.suppress()):
+        if args.record:
+            record(args.stages,synthetic=args.synthetic)
+            return 0
+        return 0 if passed(check(args.stages,synthetic=args.synthetic,reference=not args.no_reference)) else 1
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_harness(self):
+        from thermal_index import _index
+        stages = ['pattern_matrices_D','roi_differences','pixel_counts','species_gors']
+        with synthetic_dataset(shape=(30,40)) as ds_dir:
+            _quiet(record,stages,out_dir=self.tmp)
+            report = check(stages,out_dir=self.tmp,verbose=False)
+            for name in stages:
+                self.assertTrue(report[name]['golden'][1],name)
+                self.assertTrue(report[name]['reference'][1],(name,report[name]['reference']))
+            golden = Golden.load('golden_roi_differences',run_dir=self.tmp,mmap=False)
+            golden['stats'][3,1,2] += 0.1
+            golden.save('golden_roi_differences',run_dir=self.tmp)
+            report = check(['roi_differences'],out_dir=self.tmp,reference=False,verbose=False)
+            self.assertFalse(passed(report))
+            self.assertAlmostEqual(report['roi_differences']['golden'][0]['stats'],0.1)
+            #temperatures off the histogram grid
+            fname = ds_dir+'data/da_D.1.npz'
+            arr = dict(np.load(fname))
+            arr['data'] = arr['data']+0.0037
+            np.savez_compressed(fname,**arr)
+            _index['file'] = None
+            report = check(['roi_differences'],out_dir=self.tmp,verbose=False)
+            self.assertTrue(report['roi_differences']['reference'][1],report['roi_differences']['reference'])
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
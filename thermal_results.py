@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Result containers (named arrays with metadata) and their storage
+
+Results are saved in RUN_DIR (THERMAL_RUN_DIR in the environment,
+'results' otherwise; use a separate directory for each concurrent run).
+A file holds MAGIC, the length of a JSON header (little-endian uint64),
+the header (format version, kind, metadata, array dtypes, shapes and
+offsets) and uncompressed arrays aligned to ALIGN bytes, so arrays can be
+memory-mapped. Files are written to a temporary file and renamed.
+"""
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import numpy as np
+
+FORMAT_VERSION = 1
+MAGIC = b'THRMRES\n'
+ALIGN = 64
+RUN_DIR = os.environ.get('THERMAL_RUN_DIR','results')
+
+
+def result_file(name,run_dir=None):
+    """
+    returns the file of a named result in the run directory
+    """
+    return os.path.join(RUN_DIR if run_dir is None else run_dir,'{}.res'.format(name))
+
+
+class Result(object):
+    """
+    named arrays with metadata (dictionary-like access to arrays)
+    """
+    __slots__ = ('arrays','meta')
+    kind = 'result'
+
+    def __init__(self,arrays=None,**meta):
+        self.arrays = dict(arrays or {})
+        self.meta = meta
+
+    def __getitem__(self,key):
+        return self.arrays[key]
+
+    def __setitem__(self,key,value):
+        self.arrays[key] = value
+
+    def __contains__(self,key):
+        return key in self.arrays
+
+    def keys(self):
+        return self.arrays.keys()
+
+    def items(self):
+        return self.arrays.items()
+
+    def __repr__(self):
+        return '{}({}, {})'.format(type(self).__name__,sorted(self.arrays),self.meta)
+
+    def save(self,name,run_dir=None):
+        """
+        atomically writes the result to result_file(name,run_dir)
+
+        returns:
+            file name
+        """
+        fname = result_file(name,run_dir)
+        arrays = {k:np.require(v,requirements='C') for k,v in self.arrays.items()}
+        header,hb,start,size = _layout(self.kind,self.meta,{k:(v.shape,v.dtype) for k,v in arrays.items()})
+        os.makedirs(os.path.dirname(fname) or '.',exist_ok=True)
+        f,tmp = tempfile.mkstemp(dir=os.path.dirname(fname) or '.',prefix='.'+os.path.basename(fname),suffix='.tmp')
+        try:
+            with os.fdopen(f,'wb') as fo:
+                fo.write(MAGIC+struct.pack('<Q',len(hb))+hb)
+                for k in sorted(arrays):
+                    fo.seek(start+header['arrays'][k]['offset'])
+                    fo.write(arrays[k].tobytes())
+                fo.truncate(size)
+                fo.flush()
+                os.fsync(fo.fileno())
+            os.replace(tmp,fname)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return fname
+
+    @classmethod
+    def allocate(cls,specs,name,run_dir=None,**meta):
+        """
+        creates result_file(name,run_dir) with uninitialized arrays and
+        returns the result with writable memory-mapped arrays (written in
+        place, not atomically: use it for scratch files, call flush()
+        when the arrays are filled)
+
+        parameters:
+            specs: dictionary of array name -> (shape, dtype)
+            name: result name
+            run_dir: None (RUN_DIR) or the run directory
+            meta: metadata
+        """
+        fname = result_file(name,run_dir)
+        header,hb,start,size = _layout(cls.kind,meta,specs)
+        os.makedirs(os.path.dirname(fname) or '.',exist_ok=True)
+        with open(fname,'wb') as fo:
+            fo.write(MAGIC+struct.pack('<Q',len(hb))+hb)
+            fo.truncate(size)
+        arrays = {}
+        for k,a in header['arrays'].items():
+            dtype,shape = np.dtype(a['dtype']),tuple(a['shape'])
+            if np.prod(shape)>0:
+                arrays[k] = np.memmap(fname,dtype=dtype,mode='r+',offset=start+a['offset'],shape=shape)
+            else:
+                arrays[k] = np.zeros(shape,dtype=dtype)
+        return cls(arrays,**meta)
+
+    def flush(self):
+        """
+        writes memory-mapped arrays (see allocate) to the file
+        """
+        for v in self.arrays.values():
+            if isinstance(v,np.memmap):
+                v.flush()
+
+    @classmethod
+    def load(cls,name,run_dir=None,mmap=True):
+        """
+        loads a result saved with save()
+
+        parameters:
+            name: result name
+            run_dir: None (RUN_DIR) or the run directory
+            mmap: True/False: memory-map arrays (copy-on-write) or read them
+        """
+        fname = result_file(name,run_dir)
+        with open(fname,'rb') as f:
+            if f.read(len(MAGIC))!=MAGIC:
+                raise ValueError("{} is not a result file".format(fname))
+            n = struct.unpack('<Q',f.read(8))[0]
+            header = json.loads(f.read(n).decode())
+            start = len(MAGIC)+8+n
+            if header['version']>FORMAT_VERSION:
+                raise ValueError("{}: unsupported format version {}".format(fname,header['version']))
+            if cls.kind!=Result.kind and header['kind']!=cls.kind:
+                raise ValueError("{}: {} expected, got {}".format(fname,cls.kind,header['kind']))
+            arrays = {}
+            for k,a in header['arrays'].items():
+                dtype,shape = np.dtype(a['dtype']),tuple(a['shape'])
+                count = int(np.prod(shape))
+                if mmap and count>0:
+                    arrays[k] = np.memmap(fname,dtype=dtype,mode='c',offset=start+a['offset'],shape=shape)
+                else:
+                    f.seek(start+a['offset'])
+                    arrays[k] = np.fromfile(f,dtype=dtype,count=count).reshape(shape)
+        return cls(arrays,**header['meta'])
+
+
+def _layout(kind,meta,specs):
+    """
+    returns the header of a result file, the header bytes (padded to ALIGN),
+    the offset of arrays and the file size
+
+    parameters:
+        kind: result kind
+        meta: metadata
+        specs: dictionary of array name -> (shape, dtype)
+    """
+    header = {'version':FORMAT_VERSION,'kind':kind,'meta':meta,'arrays':{}}
+    offset = 0
+    for k in sorted(specs):
+        shape,dtype = [int(n) for n in specs[k][0]],np.dtype(specs[k][1])
+        assert dtype.kind not in 'OV',"{}: unsupported dtype {}".format(k,dtype)
+        header['arrays'][k] = {'dtype':dtype.str,'shape':shape,'offset':offset}
+        offset += -(-int(np.prod(shape))*dtype.itemsize//ALIGN)*ALIGN
+    hb = json.dumps(header,sort_keys=True).encode()
+    start = -(-(len(MAGIC)+8+len(hb))//ALIGN)*ALIGN
+    hb += b' '*(start-len(MAGIC)-8-len(hb))
+    return header,hb,start,start+offset
+
+
+class PatternMatrices(Result):
+    """
+    thermal pattern matrices (deltas, p-values, effect sizes) of a group
+    of animals, metadata: atype, a_indices, gors, n_boot, seed, aggregate
+    (None for pixels or [method, scale] of ROIs)
+    """
+    __slots__ = ()
+    kind = 'pattern_matrices'
+
+
+def gors_meta(gors):
+    """
+    returns a list of GORs for result metadata (with plot labels 'short')
+    """
+    return [{'group_name':g['group_name'],'roi_group':[int(r) for r in g['roi_group']]
+             ,'short':g.get('short',g['group_name'])} for g in gors]
+
+
+def gors_key(gors):
+    """
+    returns a hash of a list of GORs (cache key, labels are not part of it)
+    """
+    key = [{k:g[k] for k in ['group_name','roi_group']} for g in gors_meta(gors)]
+    return hashlib.sha1(json.dumps(key,sort_keys=True).encode()).hexdigest()[:16]
+
+
+def array_key(X,*params):
+    """
+    returns a hash of an array (as float64) and parameters (cache key)
+    """
+    X = np.ascontiguousarray(X,dtype=np.float64)
+    h = hashlib.sha1(X.tobytes())
+    h.update(str(X.shape).encode())
+    for p in params:
+        h.update(repr(p).encode())
+    return h.hexdigest()[:16]
+
+
+class OutlierScores(Result):
+    """
+    leave-one-animal-out outlier scores, metadata: atype, p, ref_indices
+    """
+    __slots__ = ()
+    kind = 'outlier_scores'
+
+
+class GorVectors(Result):
+    """
+    sorted GOR vectors of an animal (concatenated 'data' with 'offsets'),
+    metadata: name, digest, gors
+    """
+    __slots__ = ()
+    kind = 'gor_vectors'
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_save_load(self):
+        arrays = {'deltas':np.random.rand(10,10),'p_local':np.random.rand(10,10,16)
+                  ,'indices':np.arange(5,dtype=np.int16),'empty':np.zeros((0,3)),'names':np.array(['H.1','D.12']),'scalar':np.array(0.5)}
+        res = PatternMatrices(arrays,atype='H',gors=['Neck','Rump'],seed=0)
+        fname = res.save('pm_H',run_dir=self.tmp)
+        self.assertSequenceEqual(os.listdir(self.tmp),['pm_H.res'])
+        for mmap in [True,False]:
+            pm = PatternMatrices.load('pm_H',run_dir=self.tmp,mmap=mmap)
+            self.assertEqual(pm.meta,{'atype':'H','gors':['Neck','Rump'],'seed':0})
+            for k,v in arrays.items():
+                self.assertEqual(pm[k].dtype,v.dtype)
+                self.assertEqual(pm[k].shape,v.shape)
+                self.assertTrue(np.array_equal(pm[k],v))
+        pm['deltas'][0,0] = -1
+        self.assertEqual(PatternMatrices.load('pm_H',run_dir=self.tmp)['deltas'][0,0],arrays['deltas'][0,0])
+        with self.assertRaises(ValueError):
+            OutlierScores.load('pm_H',run_dir=self.tmp)
+        with open(fname,'r+b') as f:
+            f.seek(len(MAGIC))
+            n = struct.unpack('<Q',f.read(8))[0]
+            header = f.read(n).replace(b'"version": 1',b'"version": 9')
+            f.seek(len(MAGIC)+8)
+            f.write(header)
+        with self.assertRaises(ValueError):
+            Result.load('pm_H',run_dir=self.tmp)
+
+    def test_allocate(self):
+        arrays = {'data':np.random.rand(7,3),'anno':np.arange(5,dtype=np.uint8),'empty':np.zeros((0,2))}
+        res = Result.allocate({k:(v.shape,v.dtype) for k,v in arrays.items()},'alloc',run_dir=self.tmp,names=['H.1'])
+        for k,v in arrays.items():
+            res[k][:] = v
+        res.flush()
+        fname = Result(arrays,names=['H.1']).save('saved',run_dir=self.tmp)
+        with open(fname,'rb') as f, open(result_file('alloc',self.tmp),'rb') as g:
+            self.assertEqual(f.read(),g.read())
+
+    def test_array_key(self):
+        X = np.arange(12).reshape(3,4)
+        self.assertEqual(array_key(X,5),array_key(X.astype(np.float32),5))
+        self.assertNotEqual(array_key(X,5),array_key(X,6))
+        self.assertNotEqual(array_key(X),array_key(X.reshape(4,3)))
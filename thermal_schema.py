@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+ROI/GOR annotation schema
+
+A schema lists ROIs of an annotation protocol (ids are label values of
+class maps, 0 is the background) and GORs (groups of ROIs). It is compiled
+into dense lookup arrays:
+    lut: label value -> position of the ROI in ROI lists (-1: not a ROI)
+    membership: GORs x ROIs, True if the ROI belongs to the GOR
+so per-label quantities are computed with a single bincount over the label
+map and per-GOR ones with a matrix product, whatever the number of ROIs.
+
+DEFAULT_SCHEMA is the 15-ROI protocol of the paper. Another protocol is
+loaded from a JSON file given in THERMAL_SCHEMA (set it before importing
+thermal_utlis, see Schema.save for the format).
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import numpy as np
+
+SCHEMA_ENV = 'THERMAL_SCHEMA'
+
+
+class Schema(object):
+    """
+    ROIs and GORs of an annotation protocol
+
+    attributes:
+        name: name of the protocol
+        rois: list of {'id','name'}
+        gors: list of {'roi_group','group_name','short'} (as GOR_CLASSES)
+        roi_ids: array of ROI ids (order of ROI lists)
+        n_rois: number of ROIs
+        n_labels: size of the label range (max. id+1)
+        lut: array (n_labels) of ROI positions, -1 for other labels
+        membership: bool array (GORs x ROIs)
+    """
+    def __init__(self,rois,gors,name='custom'):
+        ids = [int(r['id']) for r in rois]
+        assert len(ids)>0 and min(ids)>0 and len(set(ids))==len(ids),"ROI ids must be unique and positive: {}".format(ids)
+        self.name = name
+        self.rois = [{'id':i,'name':r.get('name','ROI {}'.format(i))} for i,r in zip(ids,rois)]
+        self.roi_ids = np.array(ids,dtype=np.intp)
+        self.n_rois = len(ids)
+        self.n_labels = max(ids)+1
+        self.lut = np.full(self.n_labels,-1,dtype=np.intp)
+        self.lut[self.roi_ids] = np.arange(self.n_rois)
+        self.gors = []
+        for g in gors:
+            group = [int(r) for r in g['roi_group']]
+            unknown = sorted(set(group)-set(ids))
+            assert len(group)>0 and not unknown,"{}: unknown ROIs {}".format(g['group_name'],unknown)
+            self.gors.append({'roi_group':group,'group_name':g['group_name'],'short':g.get('short',g['group_name'])})
+        self.membership = np.zeros((len(self.gors),self.n_rois),dtype=bool)
+        for k,g in enumerate(self.gors):
+            self.membership[k,self.lut[g['roi_group']]] = True
+
+    def __repr__(self):
+        return 'Schema({}, {} ROIs, {} GORs)'.format(self.name,self.n_rois,len(self.gors))
+
+    def positions(self,ids):
+        """
+        returns positions of ROIs (given by ids) in ROI lists
+        """
+        pos = self.lut[np.asarray(ids,dtype=np.intp)]
+        assert np.all(pos>=0),"unknown ROIs: {}".format(ids)
+        return pos
+
+    def is_roi(self,rid):
+        """
+        True if rid is a ROI id of the schema
+        """
+        return 0<rid<self.n_labels and self.lut[rid]>=0
+
+    def gor_matrix(self,gors=None):
+        """
+        returns the membership matrix (GORs x ROIs) of a list of GORs
+        (the schema GORs if None)
+        """
+        if gors is None:
+            return self.membership
+        res = np.zeros((len(gors),self.n_rois),dtype=bool)
+        for k,g in enumerate(gors):
+            res[k,self.positions(g['roi_group'])] = True
+        return res
+
+    def to_dict(self):
+        return {'name':self.name,'rois':self.rois,'gors':self.gors}
+
+    def save(self,fname):
+        """
+        writes the schema as JSON:
+        {"name": ..., "rois": [{"id": 1, "name": ...}, ...],
+         "gors": [{"roi_group": [1, 2], "group_name": ..., "short": ...}, ...]}
+        """
+        with open(fname,'w') as f:
+            json.dump(self.to_dict(),f,indent=1)
+
+    @classmethod
+    def load(cls,fname):
+        with open(fname) as f:
+            d = json.load(f)
+        return cls(d['rois'],d['gors'],name=d.get('name',os.path.splitext(os.path.basename(fname))[0]))
+
+
+DEFAULT_SCHEMA = Schema([{'id':i} for i in range(1,16)]
+                        ,[{'roi_group':[1,2,3],'group_name':'Neck','short':'Neck'}
+                          ,{'roi_group':[1,2,3,4,14,15],'group_name':'Frontquarter','short':'Front.'}
+                          ,{'roi_group':[5,11],'group_name':'Trunk','short':'Trunk'}
+                          ,{'roi_group':[6,7,8,9,10],'group_name':'Hindquarter','short':'Hind.'}
+                          ,{'roi_group':[8,9],'group_name':'Rump','short':'Rump'}
+                          ,{'roi_group':[3,4,5,6],'group_name':'Dorsal aspect','short':'Dors.'}
+                          ,{'roi_group':[9,10,11,12,13],'group_name':'Ventral aspect','short':'Vent.'}
+                          ,{'roi_group':[11],'group_name':'Abdomen','short':'Abdom.'}
+                          ,{'roi_group':[10,12],'group_name':'Groins','short':'Groins'}
+                          ,{'roi_group':[9,13],'group_name':'Legs','short':'Legs'}
+                          ],name='hd15')
+
+
+def get_schema(fname=None):
+    """
+    returns the schema from a JSON file (THERMAL_SCHEMA if None),
+    DEFAULT_SCHEMA if no file is given
+    """
+    fname = os.environ.get(SCHEMA_ENV) if fname is None else fname
+    return Schema.load(fname) if fname else DEFAULT_SCHEMA
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_default(self):
+        s = DEFAULT_SCHEMA
+        self.assertEqual((s.n_rois,s.n_labels),(15,16))
+        self.assertSequenceEqual(s.lut.tolist(),[-1]+list(range(15)))
+        self.assertSequenceEqual(np.flatnonzero(s.membership[1]).tolist(),[0,1,2,3,13,14])
+        self.assertTrue(s.is_roi(15) and not s.is_roi(0) and not s.is_roi(16))
+
+    def test_custom(self):
+        rois = [{'id':i,'name':'R{}'.format(i)} for i in [2,4,40]]
+        s = Schema(rois,[{'roi_group':[40,2],'group_name':'A'}],name='test')
+        self.assertEqual(s.n_labels,41)
+        self.assertSequenceEqual(s.positions([40,4]).tolist(),[2,1])
+        self.assertSequenceEqual(s.membership.tolist(),[[True,False,True]])
+        self.assertEqual(s.gors[0]['short'],'A')
+        fname = os.path.join(self.tmp,'schema.json')
+        s.save(fname)
+        s2 = get_schema(fname)
+        self.assertEqual(s2.to_dict(),s.to_dict())
+        self.assertTrue(np.array_equal(s2.lut,s.lut))
+        with self.assertRaises(AssertionError):
+            Schema(rois,[{'roi_group':[3],'group_name':'B'}])
+
+    def test_protocol(self):
+        #a 30-ROI protocol, end to end in a fresh interpreter
+        rois = [{'id':i} for i in range(1,31)]
+        Schema(rois,[{'roi_group':list(range(1,16)),'group_name':'Front'}
+                     ,{'roi_group':list(range(16,31)),'group_name':'Back'}],name='p30').save(os.path.join(self.tmp,'p30.json'))
+        code = """
+import numpy as np,thermal_utlis
+from thermal_index import get_index
+from thermal_validate import validate_dataset
+from thermal_classify import frame_features
+from thermal_testing import synthetic_dataset
+with synthetic_dataset('{0}/',indices=[1,2],shape=(40,60)):
+    assert len(thermal_utlis.get_animal_rois('D.1'))==30
+    names = ['H.1','D.2']
+    assert get_index(names)['hist'].shape[1]==31
+    assert validate_dataset(names,workers=1,save=False)['valid']
+    assert len(frame_features(*thermal_utlis.get_animal('D.1')))==4*32
+"""
+        env = dict(os.environ,**{SCHEMA_ENV:os.path.join(self.tmp,'p30.json')})
+        out = subprocess.run([sys.executable,'-c',code.format(self.tmp)],env=env,cwd=os.path.dirname(os.path.abspath(__file__))
+                             ,stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+        self.assertEqual(out.returncode,0,out.stdout.decode())
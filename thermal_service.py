@@ -0,0 +1,387 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Local HTTP query service over the dataset
+
+The dataset and the ROI index are loaded once, requests are handled
+concurrently (computations run in a thread pool) and responses are cached.
+
+endpoints (GET, JSON unless stated otherwise):
+    /animals                                      list of animals
+    /roi_stats?animal=H.1[&roi=3]                 ROI statistics
+    /gor?atype=H&r=Neck&c=Rump[&animal=3][&p=0.001]
+                                                  GOR comparison (MWW test)
+    /heatmap?animal=D.3[&gmin=8.8&gmax=30.65][&bg=1]
+                                                  heatmap (PNG)
+
+usage:
+    python thermal_service.py [port]
+"""
+import asyncio
+import inspect
+import io
+import json
+import logging
+import sys
+import threading
+import unittest
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit,parse_qs
+import numpy as np
+import thermal_utlis
+from thermal_utlis import get_animal,get_name,extract_rois,mww_pvalue,GOR_CLASSES,SCHEMA,ATYPES,INDICES,ANOMALOUS_DONKEY_INDICES
+from thermal_ranks import presort
+from thermal_index import get_bboxes
+from thermal_export import vector_stats
+
+log = logging.getLogger(__name__)
+#pyplot state is global to the process, heatmaps are rendered one at a time
+_plot_lock = threading.Lock()
+
+
+class RequestError(Exception):
+    """
+    invalid request (reported as HTTP 400/404/405)
+    """
+    def __init__(self,message,status=400):
+        Exception.__init__(self,message)
+        self.status = status
+
+
+STATUS = {200:'200 OK',400:'400 Bad Request',404:'404 Not Found',405:'405 Method Not Allowed',500:'500 Internal Server Error'}
+
+
+def _number(name,value,kind=float):
+    """
+    converts a request parameter, errors are reported as RequestError
+    """
+    try:
+        return kind(value)
+    except ValueError:
+        raise RequestError("invalid {}: {}".format(name,value))
+
+
+def _json(obj):
+    """
+    returns a JSON body, non-finite numbers (e.g. statistics of an empty
+    ROI) are written as null
+    """
+    def finite(v):
+        if isinstance(v,dict):
+            return {k:finite(x) for k,x in v.items()}
+        if isinstance(v,(list,tuple)):
+            return [finite(x) for x in v]
+        if isinstance(v,float) and not np.isfinite(v):
+            return None
+        return v
+    return json.dumps(finite(obj),allow_nan=False).encode()
+
+
+class ThermalService(object):
+    """
+    query service over the dataset loaded once into memory
+    """
+    def __init__(self,atypes=ATYPES,indices=INDICES,anomalous=True,cache_size=1024,workers=4):
+        """
+        loads the dataset and builds the ROI index
+
+        parameters:
+            atypes: animal types
+            indices: animal indices
+            anomalous: True/False: load ANOMALOUS_DONKEY_INDICES too
+            cache_size: max. number of cached responses
+            workers: number of computation threads
+        """
+        #requests run in worker threads, they read the dataset loaded here
+        self.ds_dir = thermal_utlis.get_ds_dir()
+        self.animals = OrderedDict()
+        self.rois = {}
+        self.indices = {}
+        for atype in atypes:
+            a_indices = list(indices)+(ANOMALOUS_DONKEY_INDICES if anomalous and atype=='D' else [])
+            self.indices[atype] = list(indices)
+            for i in a_indices:
+                name = get_name(atype,i)
+                arr,anno = get_animal(name)
+                self.animals[name] = (arr,anno)
+                self.rois[name] = extract_rois(arr,anno,get_bboxes(name))
+        self.gors = {}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+        self.gor_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def _animal(self,name):
+        if name not in self.animals:
+            raise RequestError("unknown animal: {}".format(name),404)
+        return name
+
+    def _gor(self,key):
+        for i,g in enumerate(GOR_CLASSES):
+            if key in [str(i),g['short'],g['group_name']]:
+                return i
+        raise RequestError("unknown GOR: {}".format(key),404)
+
+    def _gor_vector(self,atype,g,index=None):
+        """
+        returns a presorted GOR vector of a species (index is None)
+        or of an animal
+        """
+        key = (atype,g,index)
+        with self.gor_lock:
+            if key not in self.gors:
+                names = [get_name(atype,i) for i in (self.indices[atype] if index is None else [index])]
+                roi_group = GOR_CLASSES[g]['roi_group']
+                v = np.concatenate([self.rois[n][SCHEMA.lut[r]] for n in names for r in roi_group])
+                self.gors[key] = (v,presort(v))
+            return self.gors[key]
+
+    def animal_list(self):
+        return {'animals':list(self.animals)}
+
+    def roi_stats(self,animal,roi=None):
+        """
+        ROI statistics of an animal (all ROIs if roi is None)
+        """
+        name = self._animal(animal)
+        rids = SCHEMA.roi_ids.tolist() if roi is None else [_number('roi',roi,int)]
+        res = []
+        for rid in rids:
+            if not SCHEMA.is_roi(rid):
+                raise RequestError("invalid ROI: {}".format(rid))
+            st = vector_stats(self.rois[name][SCHEMA.lut[rid]])
+            st = {k:(int(v) if k=='n_pixels' else float(v)) for k,v in st.items()}
+            st['roi'] = rid
+            res.append(st)
+        return {'animal':name,'rois':res}
+
+    def gor(self,atype,r,c,animal=None,p='0.001'):
+        """
+        compares two GORs of a species or of an animal (as in the pattern
+        matrices: delta of means and the MWW test in the direction of delta)
+        """
+        if atype not in ATYPES:
+            raise RequestError("unknown animal type: {}".format(atype),404)
+        r,c = self._gor(r),self._gor(c)
+        p = _number('p',p)
+        index = None
+        if animal is not None:
+            index = _number('animal',animal,int)
+            self._animal(get_name(atype,index))
+        hot,hot_sorted = self._gor_vector(atype,r,index)
+        cold,cold_sorted = self._gor_vector(atype,c,index)
+        delta = float(np.mean(hot)-np.mean(cold))
+        alternative = 'greater' if delta>0 else 'less'
+        s_p = mww_pvalue(hot,cold,alternative=alternative,hot_sorted=hot_sorted,cold_sorted=cold_sorted)
+        return {'atype':atype,'animal':index,'r':GOR_CLASSES[r]['group_name'],'c':GOR_CLASSES[c]['group_name']
+                ,'delta':delta,'alternative':alternative,'p_value':s_p,'significant':bool(s_p<p)}
+
+    def heatmap(self,animal,gmin='8.80',gmax='30.65',bg='0'):
+        """
+        renders an animal heatmap (plot_animal_heatmap) as PNG
+        (the Agg backend is selected by start())
+        """
+        from thermal_fig_heatmaps import plot_animal_heatmap
+        name = self._animal(animal)
+        gmin = None if gmin in ['','None'] else _number('gmin',gmin)
+        gmax = None if gmax in ['','None'] else _number('gmax',gmax)
+        out = io.BytesIO()
+        with _plot_lock:
+            plot_animal_heatmap(name,gmin=gmin,gmax=gmax,is_bg=bg=='1',data=self.animals[name],out=out)
+        return out.getvalue()
+
+    def query(self,path,params):
+        """
+        returns a (cached) response for a request
+
+        parameters:
+            path: endpoint path
+            params: dictionary of request parameters
+        returns:
+            content type, body (bytes)
+        """
+        key = (path,tuple(sorted(params.items())))
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        routes = {'/animals':self.animal_list,'/roi_stats':self.roi_stats,'/gor':self.gor,'/heatmap':self.heatmap}
+        if path not in routes:
+            raise RequestError("unknown endpoint: {}".format(path),404)
+        #only missing/unknown parameters are client errors, exceptions of endpoints are not
+        try:
+            inspect.signature(routes[path]).bind(**params)
+        except TypeError as e:
+            raise RequestError(str(e))
+        with thermal_utlis.use_dataset(self.ds_dir):
+            res = routes[path](**params)
+        if isinstance(res,bytes):
+            res = ('image/png',res)
+        else:
+            res = ('application/json',_json(res))
+        with self.lock:
+            self.cache[key] = res
+            while len(self.cache)>self.cache_size:
+                self.cache.popitem(last=False)
+        return res
+
+    async def handle(self,reader,writer):
+        """
+        handles a HTTP connection (one GET request)
+        """
+        line = b''
+        try:
+            line = await reader.readline()
+            while True:
+                h = await reader.readline()
+                if h in [b'\r\n',b'\n',b'']:
+                    break
+            parts = line.decode('latin-1').split()
+            if len(parts)<2 or parts[0]!='GET':
+                raise RequestError("only GET requests are supported",405)
+            url = urlsplit(parts[1])
+            params = {k:v[-1] for k,v in parse_qs(url.query).items()}
+            loop = asyncio.get_running_loop()
+            ctype,body = await loop.run_in_executor(self.executor,self.query,url.path,params)
+            status = 200
+        except RequestError as e:
+            ctype,body = 'application/json',_json({'error':str(e)})
+            status = e.status
+        except Exception:
+            log.exception("request failed: %r",line)
+            ctype,body = 'application/json',_json({'error':'internal server error'})
+            status = 500
+        header = 'HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n'.format(STATUS[status],ctype,len(body))
+        writer.write(header.encode()+body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    def start(self,host='127.0.0.1',port=8765,loop=None):
+        """
+        starts the server in an event loop (None: a new loop, see
+        server.get_loop()), selects the non-interactive Agg backend of
+        matplotlib for heatmaps
+
+        returns:
+            asyncio server (use server.sockets[0].getsockname() for the port)
+        """
+        import matplotlib
+        matplotlib.use('Agg')
+        loop = asyncio.new_event_loop() if loop is None else loop
+        return loop.run_until_complete(asyncio.start_server(self.handle,host,port))
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def serve(host='127.0.0.1',port=8765):
+    """
+    loads the dataset and serves requests until interrupted
+    """
+    service = ThermalService()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = service.start(host,port,loop=loop)
+    print ("serving on http://{}:{}".format(host,port))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    service.close()
+    loop.close()
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from thermal_testing import synthetic_fixture
+        self.tmp = synthetic_fixture(self,indices=[1,2,3])
+        self.service = ThermalService(indices=[1,2,3],anomalous=False)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.server = self.service.start('127.0.0.1',0,loop=self.loop)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    def tearDown(self):
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        self.service.close()
+
+    async def _get(self,path):
+        reader,writer = await asyncio.open_connection('127.0.0.1',self.port)
+        writer.write('GET {} HTTP/1.1\r\nHost: localhost\r\n\r\n'.format(path).encode())
+        data = await reader.read()
+        writer.close()
+        header,body = data.split(b'\r\n\r\n',1)
+        return int(header.split()[1]),body
+
+    def get(self,*paths):
+        return self.loop.run_until_complete(asyncio.gather(*[self._get(p) for p in paths]))
+
+    def test_endpoints(self):
+        res = self.get('/animals','/roi_stats?animal=H.2&roi=4','/gor?atype=D&r=Neck&c=Legs'
+                       ,'/gor?atype=D&r=Neck&c=Legs&animal=2','/heatmap?animal=D.3','/nothing','/roi_stats?animal=X.1')
+        self.assertEqual([v[0] for v in res],[200,200,200,200,200,404,404])
+        self.assertEqual(len(json.loads(res[0][1].decode())['animals']),6)
+        st = json.loads(res[1][1].decode())['rois'][0]
+        self.assertAlmostEqual(st['mean'],np.mean(self.service.rois['H.2'][3]))
+        gor = json.loads(res[2][1].decode())
+        self.assertTrue(gor['delta']<0 and gor['significant'])
+        self.assertTrue(res[4][1].startswith(b'\x89PNG'))
+
+    def test_errors(self):
+        def broken(animal,roi=None):
+            raise TypeError('a bug')
+        self.service.roi_stats = broken
+        with self.assertLogs(log.name,'ERROR'):
+            res = self.get('/roi_stats?animal=H.2','/gor?atype=D&r=Neck&c=Legs&p=x','/gor?atype=D&r=Neck'
+                           ,'/animals?x=1','/heatmap?animal=D.3&gmin=a')
+        self.assertEqual([v[0] for v in res],[500,400,400,400,400])
+        self.assertEqual(json.loads(res[0][1].decode())['error'],'internal server error')
+
+    def test_nan(self):
+        self.service.rois['H.2'][3] = np.zeros(0)
+        status,body = self.get('/roi_stats?animal=H.2&roi=4')[0]
+        self.assertEqual(status,200)
+        st = json.loads(body.decode(),parse_constant=lambda c: self.fail(c))['rois'][0]
+        self.assertEqual(st['n_pixels'],0)
+        self.assertIsNone(st['mean'])
+
+    def test_cache(self):
+        a = self.get(*(['/gor?atype=H&r=0&c=1']*4))
+        self.assertEqual(len(set(v[1] for v in a)),1)
+        self.assertEqual(len(self.service.cache),1)
+
+
+if __name__ == '__main__':
+    serve(port=int(sys.argv[1]) if len(sys.argv)>1 else 8765)
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Decoded dataset shared with worker processes
+
+SharedDataset decodes archives once and writes frames, label maps and ROI
+vectors (concatenated, with offsets) to a single result file
+(thermal_results format) in a temporary directory. The file is allocated
+from frame shapes and ROI sizes of the dataset index and filled one animal
+at a time, so only a single decoded animal is held in memory. Worker processes
+memory-map it: a pickled handle carries only the file name, so frames are
+neither re-read from npz archives nor copied between processes, and pages
+are shared through the OS page cache. The process which created the
+handle owns the file and removes it on close() (or when the handle is
+garbage collected); attached handles never remove it.
+
+usage:
+    with SharedDataset(names) as ds:
+        res = map_animals(func,ds,workers=4)   # func(ds,name) in workers
+"""
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from thermal_utlis import get_animal,get_name,extract_rois,get_animal_rois,SCHEMA,ATYPES,INDICES
+from thermal_index import frame_shapes,pixel_counts,get_bboxes
+from thermal_results import Result,result_file
+
+SHARED_NAME = 'dataset'
+
+#handles attached in this process (file name -> Result), see _attach
+_attached = {}
+_attached_lock = threading.Lock()
+
+
+class SharedDatasetFile(Result):
+    """
+    decoded frames of a SharedDataset, metadata: names, schema
+    """
+    __slots__ = ()
+    kind = 'shared_dataset'
+
+
+def _attach(fname):
+    """
+    returns the memory-mapped dataset file (opened once per process)
+    """
+    with _attached_lock:
+        if fname not in _attached:
+            _attached[fname] = SharedDatasetFile.load(SHARED_NAME,run_dir=os.path.dirname(fname),mmap=True)
+        return _attached[fname]
+
+
+def _remove(tmp,fname):
+    with _attached_lock:
+        _attached.pop(fname,None)
+    shutil.rmtree(tmp,ignore_errors=True)
+
+
+class SharedDataset(object):
+    """
+    read-only decoded frames and ROIs of animals, shared by processes
+
+    parameters:
+        names: animal names
+        tmp_dir: directory for the shared file (None: system default,
+            use /dev/shm to keep it in memory)
+    """
+    def __init__(self,names,tmp_dir=None):
+        self.names = list(names)
+        if self.names:
+            shapes = frame_shapes(self.names).astype(np.int64)
+            roi_sizes = pixel_counts(self.names)[:,SCHEMA.roi_ids].astype(np.int64)
+        else:
+            shapes,roi_sizes = np.zeros((0,2),dtype=np.int64),np.zeros((0,SCHEMA.n_rois),dtype=np.int64)
+        offsets = np.concatenate([[0],np.cumsum(np.prod(shapes,axis=1))]).astype(np.int64)
+        roi_offsets = np.concatenate([[0],np.cumsum(roi_sizes)]).astype(np.int64)
+        self.tmp = tempfile.mkdtemp(prefix='thermal_shared_',dir=tmp_dir)
+        self.fname = result_file(SHARED_NAME,self.tmp)
+        self._finalizer = weakref.finalize(self,_remove,self.tmp,self.fname)
+        try:
+            self._write(shapes,offsets,roi_offsets)
+        except BaseException:
+            self.close()
+            raise
+        self._pos = {n:i for i,n in enumerate(self.names)}
+
+    def _write(self,shapes,offsets,roi_offsets):
+        """
+        allocates the shared file and decodes animals into it one by one
+        (dtypes are taken from the first animal)
+        """
+        f = None
+        for i,name in enumerate(self.names):
+            data,anno = get_animal(name)
+            if f is None:
+                specs = {'data':((offsets[-1],),data.dtype),'anno':((offsets[-1],),anno.dtype)
+                         ,'rois':((roi_offsets[-1],),data.dtype),'shapes':(shapes.shape,np.int64)
+                         ,'offsets':(offsets.shape,np.int64),'roi_offsets':(roi_offsets.shape,np.int64)}
+                f = SharedDatasetFile.allocate(specs,SHARED_NAME,run_dir=self.tmp,names=self.names,schema=SCHEMA.name)
+                f['shapes'][:],f['offsets'][:],f['roi_offsets'][:] = shapes,offsets,roi_offsets
+            if anno.shape!=tuple(shapes[i]):
+                raise ValueError("{}: frame shape {} differs from the index".format(name,anno.shape))
+            f['data'][offsets[i]:offsets[i+1]] = data.ravel()
+            f['anno'][offsets[i]:offsets[i+1]] = anno.ravel()
+            o = roi_offsets[i*SCHEMA.n_rois:(i+1)*SCHEMA.n_rois+1]
+            for k,v in enumerate(extract_rois(data,anno,get_bboxes(name))):
+                if len(v)!=o[k+1]-o[k]:
+                    raise ValueError("{}: size of ROI {} differs from the index".format(name,SCHEMA.roi_ids[k]))
+                f['rois'][o[k]:o[k+1]] = v
+        if f is None:
+            SharedDatasetFile({'data':np.zeros(0),'anno':np.zeros(0,dtype=np.uint8),'rois':np.zeros(0)
+                               ,'shapes':shapes,'offsets':offsets,'roi_offsets':roi_offsets}
+                              ,names=self.names,schema=SCHEMA.name).save(SHARED_NAME,run_dir=self.tmp)
+        else:
+            f.flush()
+
+    @classmethod
+    def _from_file(cls,fname):
+        """
+        returns an attached (non-owning) handle
+        """
+        self = cls.__new__(cls)
+        self.fname = fname
+        self.tmp = None
+        self._finalizer = None
+        self.names = list(self._file().meta['names'])
+        self._pos = {n:i for i,n in enumerate(self.names)}
+        return self
+
+    def __reduce__(self):
+        return (SharedDataset._from_file,(self.fname,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    @property
+    def owner(self):
+        return self._finalizer is not None
+
+    def _file(self):
+        if self.owner and not self._finalizer.alive:
+            raise ValueError("the shared dataset is closed")
+        return _attach(self.fname)
+
+    def close(self):
+        """
+        removes the shared file (owner only, processes which have
+        already attached keep their mappings)
+        """
+        if self.owner:
+            self._finalizer()
+
+    def frame(self,name):
+        """
+        returns read-only views of data and annotation of an animal
+        """
+        f,i = self._file(),self._pos[name]
+        h,w = f['shapes'][i]
+        s = slice(f['offsets'][i],f['offsets'][i+1])
+        return _readonly(f['data'][s].reshape(h,w)),_readonly(f['anno'][s].reshape(h,w))
+
+    def rois(self,name):
+        """
+        returns read-only views of ROI vectors of an animal
+        (in the order of SCHEMA.roi_ids)
+        """
+        f,i = self._file(),self._pos[name]
+        o = f['roi_offsets'][i*SCHEMA.n_rois:(i+1)*SCHEMA.n_rois+1]
+        return [_readonly(f['rois'][o[k]:o[k+1]]) for k in range(SCHEMA.n_rois)]
+
+
+def _readonly(v):
+    v = v.view(np.ndarray)
+    v.flags.writeable = False
+    return v
+
+
+def _call(args):
+    func,ds,name = args
+    return func(ds,name)
+
+
+def map_animals(func,ds,names=None,workers=None):
+    """
+    returns [func(ds,name) for name in names] computed by worker
+    processes attached to the shared dataset ds
+
+    parameters:
+        func: top-level function (ds,name)
+        ds: SharedDataset
+        names: animal names (None: all names of ds)
+        workers: number of worker processes (None: number of CPUs)
+    """
+    names = ds.names if names is None else list(names)
+    with ProcessPoolExecutor(max_workers=workers) as ex:
+        return list(ex.map(_call,[(func,ds,n) for n in names]))
+
+
+def _stats_shared(ds,name):
+    return [np.mean(v) for v in ds.rois(name)]
+
+
+def _stats_naive(name):
+    return [np.mean(v) for v in get_animal_rois(name)]
+
+
+def _stats_pickled(rois):
+    return [np.mean(v) for v in rois]
+
+
+def benchmark(names=None,workers=4,repeat=3):
+    """
+    compares per-animal ROI statistics in worker processes when workers
+    read archives (naive), receive pickled ROI arrays or attach to
+    a SharedDataset
+
+    returns:
+        dictionary of the best times [s] (the shared dataset includes
+        its setup as 'shared_setup')
+    """
+    from thermal_index import get_index
+    names = [get_name(a,i) for a in ATYPES for i in INDICES] if names is None else names
+    #bounding boxes used by the naive path
+    get_index(names)
+    res = {}
+    t = time.time()
+    ds = SharedDataset(names)
+    res['shared_setup'] = time.time()-t
+    with ds, ProcessPoolExecutor(max_workers=workers) as ex:
+        list(ex.map(_stats_naive,names[:workers]))
+        for key,run in [('naive',lambda: list(ex.map(_stats_naive,names)))
+                        ,('pickled',lambda: list(ex.map(_stats_pickled,[[np.array(v) for v in ds.rois(n)] for n in names])))
+                        ,('shared',lambda: list(ex.map(_call,[(_stats_shared,ds,n) for n in names])))]:
+            times = []
+            for _ in range(repeat):
+                t = time.time()
+                out = run()
+                times.append(time.time()-t)
+            res[key] = min(times)
+            assert np.allclose(out,[_stats_pickled(ds.rois(n)) for n in names])
+    print ("setup: {:0.3f}s, naive: {:0.3f}s, pickled: {:0.3f}s, shared: {:0.3f}s".format(res['shared_setup'],res['naive']
+                                                                                         ,res['pickled'],res['shared']))
+    return res
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from thermal_testing import synthetic_fixture
+        self.tmp = synthetic_fixture(self,indices=[1,2],shape=(30,40))
+        self.names = ['H.1','H.2','D.1','D.2']
+
+    def test_shared(self):
+        with SharedDataset(self.names,tmp_dir=self.tmp) as ds:
+            data,anno = ds.frame('D.2')
+            d,a = get_animal('D.2')
+            self.assertTrue(np.array_equal(data,d) and np.array_equal(anno,a))
+            self.assertFalse(data.flags.writeable)
+            for v,w in zip(ds.rois('H.1'),get_animal_rois('H.1')):
+                self.assertSequenceEqual(v.tolist(),w)
+            ds2 = pickle.loads(pickle.dumps(ds))
+            self.assertFalse(ds2.owner)
+            self.assertLess(len(pickle.dumps(ds)),500)
+            self.assertTrue(np.array_equal(ds2.frame('H.2')[0],get_animal('H.2')[0]))
+            res = map_animals(_stats_shared,ds,workers=2)
+            self.assertTrue(np.allclose(res,[_stats_naive(n) for n in self.names]))
+            fname = ds.fname
+            self.assertTrue(os.path.exists(fname))
+            ds2.close()
+            self.assertTrue(os.path.exists(fname))
+        self.assertFalse(os.path.exists(fname))
+        with self.assertRaises(ValueError):
+            ds.rois('H.1')
+
+    def test_memory(self):
+        import tracemalloc
+        from thermal_testing import synthetic_dataset
+        with synthetic_dataset(os.path.join(self.tmp,'large',''),indices=list(range(1,9)),shape=(60,80)):
+            names = [get_name(a,i) for a in ATYPES for i in range(1,9)]
+            SharedDataset(names,tmp_dir=self.tmp).close()
+            size = sum(d.nbytes+a.nbytes for d,a in map(get_animal,names))
+            tracemalloc.start()
+            try:
+                ds = SharedDataset(names,tmp_dir=self.tmp)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            with ds:
+                for n in names:
+                    self.assertTrue(np.array_equal(ds.frame(n)[0],get_animal(n)[0]))
+                    for v,w in zip(ds.rois(n),get_animal_rois(n)):
+                        self.assertSequenceEqual(v.tolist(),list(w))
+        #animals are decoded one by one, not the whole dataset
+        self.assertLess(peak,size/2)
+        with SharedDataset([],tmp_dir=self.tmp) as ds:
+            self.assertSequenceEqual(ds.names,[])
+
+
+if __name__ == '__main__':
+    benchmark()
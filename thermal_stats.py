@@ -0,0 +1,683 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics, 
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by  
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Computations for the figures: ROI/GOR extraction, pattern matrices
+and statistics (no plotting libraries are imported here)
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+import unittest
+import numpy as np
+from thermal_utlis import get_animal,get_name,get_animal_rois,extract_rois,mww_pvalue,GOR_CLASSES,SCHEMA,INDICES,ATYPES
+from thermal_ranks import presort,mww_sorted
+from thermal_index import pixel_counts,get_bboxes
+from thermal_results import PatternMatrices,gors_meta,result_file
+
+#import time budget of the compute modules (see compute_modules, in seconds)
+IMPORT_TIME_BUDGET = 1.0
+#modules which should not be loaded by the compute layer
+HEAVY_MODULES = ['matplotlib','seaborn','sklearn','scipy.stats','numba','pyarrow']
+#backends of rarely used functions, imported by thermal_stats on first use
+LAZY_MODULES = ['thermal_effects','thermal_areas','thermal_tiles']
+#bytes per GOR pixel kept by prepare_pattern_matrices: data, its presort
+#(values, order) and presorts of animal vectors (animal vectors are views)
+PATTERN_BYTES_PER_PIXEL = 40
+#bytes per pixel of the largest GOR held temporarily: the permutation and
+#the buffer of the stable sort (presort), prefixes of samples and the rank
+#kernel of a MWW test (the NumPy kernel, all values distinct)
+TRANSIENT_BYTES_PER_PIXEL = 96
+#bytes per pixel of a frame loaded to copy its ROIs (data, annotation, ROIs)
+FRAME_BYTES_PER_PIXEL = 24
+#number of elements copied at once to a spilled vector
+SPILL_CHUNK = 1<<16
+
+
+def get_species_rois(atype='H',a_indices=INDICES,aggregate=None):
+    """
+    returns ROIs of every animal of a given species 
+    (group data cache shared by many GOR definitions)
+    
+    parameters:
+        atype = animal type [H,D]
+        a_indices - animal indices
+        aggregate - None (pixels) or (method, scale): ROIs reduced to
+            tiles/superpixels (see thermal_tiles.aggregate_rois)
+    
+    return:
+        a dictionary indexed by animals with lists of ROI vectors
+        (in the order of SCHEMA.roi_ids)
+    """
+    if aggregate is None:
+        return {a:[np.asarray(v) for v in get_animal_rois(get_name(atype,a))] for a in a_indices}
+    from thermal_tiles import aggregate_rois
+    method,scale = aggregate
+    res = {}
+    for a in a_indices:
+        name = get_name(atype,a)
+        data,anno = get_animal(name)
+        res[a] = aggregate_rois(data,anno,method=method,scale=scale,bboxes=get_bboxes(name))
+    return res
+
+
+def get_roi_group_a(atype='H',roi_group=[8,9],a_indices=INDICES,rois=None):
+    """
+    returns ROI groups for every animal of a given species as a concatenated vector
+    
+    parameters:
+        atype = animal type [H,D]
+        roi_group -  list of rois to include
+        a_indices - animal indices
+        rois - None or the result of get_species_rois() for a_indices,
+            to avoid reloading animals
+    
+    return:
+        a dictinary indexed by animals with individual roi vectors
+        a concatenated roi vector
+    """
+    animals = {}
+    for a in a_indices:
+        animals[a]=[]
+        
+    for a in a_indices:
+        arois = get_animal_rois(get_name(atype,a)) if rois is None else rois[a]
+        for r in roi_group: 
+            animals[a].append(arois[SCHEMA.lut[r]])
+    for a in a_indices:
+        animals[a]=np.concatenate(animals[a])
+    
+    data = np.concatenate([animals[a] for a in animals])
+    
+    return animals,data
+
+
+def estimate_pattern_memory(atype='H',gors=GOR_CLASSES,a_indices=INDICES,spilled=False,rois=None):
+    """
+    returns the memory (bytes) needed by prepare_pattern_matrices for
+    GOR vectors, estimated from pixel counts in the dataset index (or
+    from sizes of given ROI vectors)
+
+    parameters:
+        spilled: False: all GOR vectors in memory, True: GOR vectors in
+            memory-mapped files
+        rois: None or the result of get_species_rois(atype) (no frames
+            are loaded then)
+    returns:
+        bytes of GOR vectors (if not spilled) and temporary buffers for
+        the largest GOR and a frame (without the dataset index, which is
+        loaded once)
+    """
+    if rois is None:
+        counts = pixel_counts([get_name(atype,a) for a in a_indices])
+        frame = int(np.max(np.sum(counts,axis=1)))
+    else:
+        counts = np.zeros((len(a_indices),SCHEMA.n_labels),dtype=np.int64)
+        counts[:,SCHEMA.roi_ids] = [[len(v) for v in rois[a]] for a in a_indices]
+        frame = 0
+    n = [int(np.sum(counts[:,rg['roi_group']])) for rg in gors]
+    transient = max(n+[0])*TRANSIENT_BYTES_PER_PIXEL+frame*FRAME_BYTES_PER_PIXEL
+    return transient if spilled else sum(n)*PATTERN_BYTES_PER_PIXEL+transient
+
+
+def peak_rss():
+    """
+    returns the peak resident set size of the process in bytes
+    (None if the resource module is not available)
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform=='darwin' else rss*1024
+
+
+def _empty(n,dtype,spill_dir):
+    """
+    returns an uninitialised vector, a writable memory-mapped file in
+    spill_dir if it is given
+    """
+    if spill_dir is None or n==0:
+        return np.empty(n,dtype=dtype)
+    f,fname = tempfile.mkstemp(dir=spill_dir,suffix='.dat')
+    os.close(f)
+    return np.memmap(fname,dtype=dtype,mode='w+',shape=(n,))
+
+
+def _spill(v,spill_dir):
+    """
+    moves an array to a memory-mapped file in spill_dir
+    """
+    if spill_dir is None:
+        return v
+    m = _empty(len(v),v.dtype,spill_dir)
+    m[:] = v
+    return m
+
+
+def _presort(v,spill_dir):
+    """
+    presort() of a vector, with spill_dir the sorted copy is written to
+    a memory-mapped file in chunks (only the permutation is in memory)
+    """
+    if spill_dir is None:
+        return presort(v)
+    order = np.argsort(v,kind='stable')
+    s = _empty(len(v),v.dtype,spill_dir)
+    for i in range(0,len(v),SPILL_CHUNK):
+        s[i:i+SPILL_CHUNK] = v[order[i:i+SPILL_CHUNK]]
+    return s,_spill(order,spill_dir)
+
+
+def _animal_rois(atype,a,rois):
+    """
+    returns ROI vectors of an animal (arrays, in the order of
+    SCHEMA.roi_ids) from rois or from the dataset
+    """
+    if rois is not None:
+        return rois[a]
+    name = get_name(atype,a)
+    data,anno = get_animal(name)
+    return extract_rois(data,anno,get_bboxes(name))
+
+
+def _gor_vectors(atype,rg,a_indices,rois,spill_dir):
+    """
+    returns GOR vectors of a species with presorts, ROIs are copied into
+    the concatenated vector (a memory-mapped file in spill_dir if it is
+    given) one animal at a time and animal vectors are its views
+    """
+    pos = SCHEMA.positions(rg['roi_group'])
+    if rois is None:
+        sizes = pixel_counts([get_name(atype,a) for a in a_indices])[:,rg['roi_group']].sum(axis=1)
+    else:
+        sizes = [sum(len(rois[a][k]) for k in pos) for a in a_indices]
+    offsets = np.concatenate([[0],np.cumsum(sizes)]).astype(np.int64)
+    data = _empty(int(offsets[-1]),np.float64,spill_dir)
+    for i,a in enumerate(a_indices):
+        o = offsets[i]
+        for v in [_animal_rois(atype,a,rois)[k] for k in pos]:
+            data[o:o+len(v)] = v
+            o += len(v)
+        assert o==offsets[i+1],"ROIs of {} do not match the index".format(get_name(atype,a))
+    animals = {a:data[offsets[i]:offsets[i+1]] for i,a in enumerate(a_indices)}
+    return {'animals':animals,'data':data,'sorted':_presort(data,spill_dir)
+            ,'animals_sorted':{a:_presort(animals[a],spill_dir) for a in a_indices}}
+
+
+def prepare_pattern_matrices(atype='H',gors=GOR_CLASSES,rois=None,suffix='',n_boot=1000,memory_budget=None
+                             ,spill_dir=None,verbose=False,a_indices=INDICES,aggregate=None):
+    """
+    prepares a thermal pattern matrix
+    p-values of the MWW test are stored, significance for a required
+    p is computed when the matrix is loaded (see load_pattern_matrices)
+    effect sizes (AUC, Cliff's delta, bootstrap intervals, see
+    thermal_effects.effect_sizes) are stored with the deltas, for
+    aggregated ROIs they are computed from the same GOR vectors as
+    p-values (thermal_effects.vector_effects)
+    
+    parameters:
+        atype: animal type [H,D]
+        gors: list of GORs (as GOR_CLASSES)
+        rois: None or the result of get_species_rois(atype)
+        suffix: file name suffix (e.g. a name of the GOR set)
+        n_boot: number of bootstrap replicates for confidence intervals
+        memory_budget: None or max. memory (bytes) for GOR vectors, if
+            the estimate (estimate_pattern_memory) exceeds it, vectors
+            are written to memory-mapped temporary files one animal at
+            a time and presorted there (see estimate_pattern_memory with
+            spilled=True for the memory needed then)
+        spill_dir: directory for temporary files (None: system default)
+        verbose: True/False: print the estimate and the peak RSS
+        a_indices: animal indices (a group of animals, e.g. a breed,
+            saved with its own suffix)
+        aggregate: None or (method, scale) rois were aggregated with
+            (see get_species_rois), saved in the metadata
+
+    returns:
+        dictionary with the memory estimate (of the chosen way), spilled
+        (True/False) and the peak RSS of the process (bytes)
+    """    
+    from thermal_effects import effect_sizes,vector_effects
+    estimate = estimate_pattern_memory(atype,gors,a_indices,rois=rois)
+    spilled = memory_budget is not None and estimate>memory_budget
+    if spilled:
+        estimate = estimate_pattern_memory(atype,gors,a_indices,spilled=True,rois=rois)
+    tmp = tempfile.mkdtemp(prefix='pattern_',dir=spill_dir) if spilled else None
+    try:
+        rgs = [_gor_vectors(atype,rg,a_indices,rois,tmp) for rg in gors]
+        deltas,p_global,p_local = _pattern_pvalues(rgs,a_indices)
+        if aggregate is None:
+            #pixels: histograms of the index
+            effects = effect_sizes(atype,a_indices,gors,n_boot=n_boot)
+        else:
+            effects = vector_effects([[rg['animals_sorted'][a][0] for a in a_indices] for rg in rgs],n_boot=n_boot)
+        del rgs
+    finally:
+        if tmp is not None:
+            shutil.rmtree(tmp)
+    effects.update({'deltas':deltas,'p_global':p_global,'p_local':p_local})
+    PatternMatrices(effects,atype=atype,a_indices=[int(a) for a in a_indices],gors=gors_meta(gors)
+                    ,n_boot=n_boot,seed=0,aggregate=None if aggregate is None else list(aggregate)
+                    ).save('pattern_matrices_{}{}'.format(atype,suffix))
+    res = {'estimate':estimate,'spilled':spilled,'peak_rss':peak_rss()}
+    if verbose:
+        print ("pattern matrices {}{}: estimate {:0.1f} MB, spilled: {}, peak RSS {:0.1f} MB".format(
+            atype,suffix,estimate/2.0**20,spilled,(res['peak_rss'] or 0)/2.0**20))
+    return res
+
+
+def pattern_pvalues(atype='H',gors=GOR_CLASSES,rois=None,a_indices=INDICES,spill_dir=None):
+    """
+    returns deltas, global and local p-values of the pattern matrices
+    (see prepare_pattern_matrices), GOR vectors are kept in memory-mapped
+    files in spill_dir if it is given
+    """
+    rgs = [_gor_vectors(atype,rg,a_indices,rois,spill_dir) for rg in gors]
+    return _pattern_pvalues(rgs,a_indices)
+
+
+def _pattern_pvalues(rgs,a_indices):
+    N = len(rgs)
+    deltas = np.zeros((N,N))    
+    p_global = np.ones((N,N))
+    p_local = np.ones((N,N,len(a_indices)))
+    for r in range(N):
+        for c in range(N):
+            deltas[r,c]=np.mean(rgs[r]['data'])-np.mean(rgs[c]['data'])
+            alternative = 'greater' if deltas[r,c]>0 else 'less'  
+            p_global[r,c] = mww_pvalue(rgs[r]['data'],rgs[c]['data'],alternative=alternative
+                                       ,hot_sorted=rgs[r]['sorted'],cold_sorted=rgs[c]['sorted'])
+            for i,a in enumerate(a_indices):
+                p_local[r,c,i] = mww_pvalue(rgs[r]['animals'][a],rgs[c]['animals'][a],alternative=alternative
+                                              ,hot_sorted=rgs[r]['animals_sorted'][a],cold_sorted=rgs[c]['animals_sorted'][a])
+    return deltas,p_global,p_local
+
+
+def prepare_pattern_matrices_sweep(atype='H',gor_sets={'':GOR_CLASSES},memory_budget=None,aggregate=None):
+    """
+    prepares thermal pattern matrices for many GOR definitions,
+    animals are loaded only once
+    
+    parameters:
+        atype: animal type [H,D]
+        gor_sets: dictionary {name: list of GORs}, matrices are saved
+            with the suffix '_name' (no suffix for an empty name)
+        memory_budget: None or max. memory (bytes) for GOR vectors of
+            a single matrix (see prepare_pattern_matrices)
+        aggregate: None or (method, scale) of ROI aggregation
+            (see get_species_rois)
+    """
+    rois = get_species_rois(atype,aggregate=aggregate)
+    for name,gors in gor_sets.items():
+        prepare_pattern_matrices(atype,gors=gors,rois=rois,suffix='_{}'.format(name) if name else ''
+                                 ,memory_budget=memory_budget,aggregate=aggregate)
+
+
+def load_pattern_matrices(atype='H',p=0.001,suffix=''):
+    """
+    loads a thermal pattern matrix and thresholds its p-values
+    
+    parameters:
+        atype: animal type [H,D]
+        p: required p value for the MWW test
+        suffix: file name suffix
+        
+    returns:
+        PatternMatrices with deltas, p-values, effect sizes (if stored) and
+        significance matrices s_global/s_local (if local p-values are available)
+    """
+    res = PatternMatrices.load('pattern_matrices_{}{}'.format(atype,suffix))
+    for k in ['global','local']:
+        if 'p_'+k in res:
+            res['s_'+k] = (res['p_'+k]<p).astype(np.int32)
+    return res
+
+
+#categories of compare_pattern_matrices (0 is the diagonal)
+COMPARISON_CATEGORIES = ['same, significant','same','1st warmer, significant','1st warmer'
+                         ,'1st colder, significant','1st colder']
+
+def _group_key(group):
+    return (group,'') if isinstance(group,str) else tuple(group)
+
+
+_comparisons = {}
+
+def compare_pattern_matrices(groups=ATYPES,p=0.001):
+    """
+    compares global pattern matrices of K groups (species, breeds...)
+    in every pair of groups (k,l) 
+    
+    relation of GORs r,c (the sign of deltas) is the same in both groups,
+    r is relatively warmer in k (e.g. r>c in k and r<c in l) or relatively 
+    colder, significant if the MWW test is significant in both groups, 
+    category codes: 1 + 2*[same,warmer,colder] + [significant,insignificant]
+    (see COMPARISON_CATEGORIES), results are cached per group set
+    
+    parameters:
+        groups: list of atypes or (atype, suffix) of pattern matrices
+        p: required p value for the MWW test
+    
+    returns:
+        dictionary with 'categories' (K x K x N x N), 'local' (K x K x N x N,
+        min. number of animals with locally significant differences in
+        both groups, None if there are no local matrices), 'gors' (GOR
+        metadata of the matrices) and 'n_animals' (K, numbers of animals)
+    """
+    keys = tuple(_group_key(g) for g in groups)
+    stamp = tuple(os.stat(result_file('pattern_matrices_{}{}'.format(*k))).st_mtime_ns for k in keys)
+    if (keys,p) in _comparisons and _comparisons[(keys,p)][0]==stamp:
+        return _comparisons[(keys,p)][1]
+    pms = [load_pattern_matrices(atype,p=p,suffix=suffix) for atype,suffix in keys]
+    for k,pm in zip(keys,pms):
+        if [g['roi_group'] for g in pm.meta['gors']]!=[g['roi_group'] for g in pms[0].meta['gors']]:
+            raise ValueError('pattern matrices {}{} and {}{} have different GORs'.format(*keys[0],*k))
+    sign = np.sign(np.stack([pm['deltas'] for pm in pms]))
+    sig = np.stack([pm['s_global'] for pm in pms]).astype(bool)
+    both = sig[:,np.newaxis]&sig[np.newaxis,:]
+    rel = np.sign(sign[:,np.newaxis]-sign[np.newaxis,:]).astype(np.int32)
+    categories = 1+2*np.where(rel==0,0,np.where(rel>0,1,2))+(~both)
+    N = categories.shape[-1]
+    categories[...,np.arange(N),np.arange(N)] = 0
+    res = {'groups':list(groups),'categories':categories.astype(np.int32),'local':None
+           ,'gors':pms[0].meta['gors'],'n_animals':np.array([len(pm.meta['a_indices']) for pm in pms])}
+    if all('s_local' in pm for pm in pms):
+        loc = np.stack([np.sum(pm['s_local'],axis=2) for pm in pms])
+        res['local'] = np.minimum(loc[:,np.newaxis],loc[np.newaxis,:])
+    _comparisons[(keys,p)] = (stamp,res)
+    return res
+
+
+#prepare outlier cases
+def prepare_pattern_matrices_spec(atype='D',a_index=17):
+    """
+    prepares a thermal pattern matrix for a specific animal
+    (used for outlier cases of D.17,D.18)
+    p-values are stored, see load_pattern_matrices
+    
+    parameters:
+        atype: animal type [H,D]
+        a_index: animal index
+    
+    """
+    N = len(GOR_CLASSES)
+    rgs = []
+    for rg in GOR_CLASSES:
+        animals,data = get_roi_group_a(atype=atype,roi_group=rg['roi_group'],a_indices=[a_index])
+        rgs.append({'animals':animals,'data':data,'sorted':presort(data)})
+    
+    deltas = np.zeros((N,N))    
+    p_global = np.ones((N,N))
+    for r in range(N):
+        for c in range(N):
+            deltas[r,c]=np.mean(rgs[r]['data'])-np.mean(rgs[c]['data'])
+            alternative = 'greater' if deltas[r,c]>0 else 'less'  
+            p_global[r,c] = mww_pvalue(rgs[r]['data'],rgs[c]['data'],alternative=alternative
+                                       ,hot_sorted=rgs[r]['sorted'],cold_sorted=rgs[c]['sorted'])
+    PatternMatrices({'deltas':deltas,'p_global':p_global},atype=atype,a_indices=[int(a_index)]
+                    ,gors=gors_meta(GOR_CLASSES)).save('pattern_matrices_{}_spec_{}'.format(atype,a_index))
+
+
+def stats_species_gors(roi_group=[8,9],group_name='rump',p=0.001,short=None):
+    """
+    wilcoxon test of statistical significance for temp. difference
+    between H/D GORs
+    
+    parameters:
+        roi_group -  list of rois to include
+        group_name - name of the group (savefile name)
+        p - required p value
+        short: short name (optional)
+    return:
+        test result (True/False)
+ 
+    """
+    
+    _,H = get_roi_group_a(atype='H',roi_group=roi_group)
+    _,D = get_roi_group_a(atype='D',roi_group=roi_group)
+
+    mm = np.min([len(H),len(D)])
+    np.random.shuffle(H)
+    np.random.shuffle(D)
+    s,s_p = mww_sorted(np.sort(H[:mm]),np.sort(D[:mm]),alternative='greater')
+    print ("{}: {}/{:0.4f}, {}".format(group_name,s,s_p,s_p<p))
+    return (s_p<p)
+
+
+def get_roi_differences(rid):
+    """
+    returns (and prints) differences between animals in ROI
+    parameters:
+        rid: ROI id
+    
+    returns:
+        dictionary of differences i.e. 
+        {diff: roi difference,H:<horse roi stats>,D:<donkey roi stats>} 
+    """
+    temps = {}
+    rets = {}
+    for atype in ATYPES:
+        temps[atype]=[]
+        for i in INDICES:
+            name = get_name(atype,i)
+            rois = get_animal_rois(name)
+            temps[atype].append(rois[SCHEMA.lut[rid]])
+        temps[atype] = np.concatenate(temps[atype])
+        rmin,rmean,rmedian,rmax = np.min(temps[atype]),np.mean(temps[atype]),np.median(temps[atype]),np.max(temps[atype])
+        rets[atype] = [rmin,rmean,rmedian,rmax]
+    dd = np.abs(rets['H'][1]-rets['D'][1])
+    print ("{}: {:0.2f}, {}".format(rid,dd,rets))
+    rets['diff'] = dd    
+    return rets
+
+
+def count_rois_differences():
+    """
+    counts average differences between no. pixels in ROIs
+    
+    returns:
+        dictionary with numbers of pixels in ROIs of species (h, d) and
+        the median, mean and std of relative differences (%), pixel
+        counts come from the dataset index (see thermal_areas)
+    """
+    from thermal_areas import species_area_differences
+    res = species_area_differences()
+    print (res['median'])
+    print ("average difference: {:0.2f}({:0.2f})".format(res['mean'],res['std']))
+    return res
+
+
+def print_global_temperatures():
+    """
+    prints global temperature stats for animals
+    """
+    temps = {}
+    for atype in ATYPES:
+        temps[atype]=[]
+        for i in INDICES:
+            arr, anno = get_animal(get_name(atype,i))
+            temps[atype].append(arr[anno!=0])
+        temps[atype] = np.concatenate(temps[atype])
+        print (atype,'min: {:0.2f},mean:{:0.2f}({:0.2f}), median:{:0.2f},  max: {:0.2f}'.format(np.min(temps[atype])
+                                                                                              ,np.mean(temps[atype])
+                                                                                              ,np.std(temps[atype])
+                                                                                              ,np.median(temps[atype])
+                                                                                              ,np.max(temps[atype])))
+
+
+def get_roi_features(stat=np.mean,normalise=False):
+    """
+    returns ROI features of all animals (used for t-SNE)
+    paramters:
+        stat: feature extraction statistics
+        normalise: normalise features by removing the global average
+    
+    returns:
+        X: features (animals x ROIs)
+        y: labels (0 for horses, 1 for donkeys)
+    """
+    data = []
+    y = []
+    for atype in ATYPES:
+        for a in INDICES:
+            rois = get_animal_rois(get_name(atype=atype,index=a))
+            if rois != None:
+                y.append(0 if atype =='H' else 1)
+                if normalise:
+                    gv = np.mean(np.concatenate(rois))
+                    rois = [v-gv for v in rois]
+                temp = [stat(v) for v in rois]
+                data.append(temp) 
+    return np.array(data),np.array(y)
+
+
+def compute_modules():
+    """
+    returns names of the compute modules: all thermal_* modules except
+    figure scripts (thermal_fig_*)
+    """
+    files = os.listdir(os.path.dirname(os.path.abspath(__file__)))
+    return sorted(f[:-3] for f in files if f.startswith('thermal_') and f.endswith('.py') and not f.startswith('thermal_fig_'))
+
+
+def measure_import_time(modules=None,watched=HEAVY_MODULES):
+    """
+    measures the import time of modules (compute_modules() if None) in
+    a fresh interpreter
+    
+    returns:
+        import time (seconds)
+        list of watched modules loaded by the import
+    """
+    modules = compute_modules() if modules is None else modules
+    code = ("import sys,time\n"
+            "t=time.perf_counter()\n"
+            "import {}\n"
+            "t=time.perf_counter()-t\n"
+            "print(t)\n"
+            "print(','.join(m for m in {} if m in sys.modules))").format(','.join(modules),list(watched))
+    out = subprocess.check_output([sys.executable,'-c',code],cwd=os.path.dirname(os.path.abspath(__file__))).decode().split('\n')
+    return float(out[0]),[v for v in out[1].split(',') if v]
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from thermal_testing import synthetic_fixture
+        self.tmp = synthetic_fixture(self,atypes=['H'],shape=(30,40))
+        self.cwd = os.getcwd()
+        os.chdir(self.tmp)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+
+    def test_memory_budget(self):
+        gors = GOR_CLASSES[:4]
+        res = prepare_pattern_matrices('H',gors=gors,n_boot=10)
+        self.assertFalse(res['spilled'])
+        n = [len(get_roi_group_a('H',rg['roi_group'])[1]) for rg in gors]
+        self.assertEqual(res['estimate'],sum(n)*PATTERN_BYTES_PER_PIXEL+max(n)*TRANSIENT_BYTES_PER_PIXEL+30*40*FRAME_BYTES_PER_PIXEL)
+        pm = load_pattern_matrices('H')
+        spill_dir = os.path.join(self.tmp,'spill')
+        os.makedirs(spill_dir)
+        budget = estimate_pattern_memory('H',gors,spilled=True)
+        self.assertLess(budget,res['estimate'])
+        res = prepare_pattern_matrices('H',gors=gors,n_boot=10,memory_budget=budget,spill_dir=spill_dir)
+        self.assertTrue(res['spilled'] and res['peak_rss']>0 and res['estimate']==budget)
+        self.assertSequenceEqual(os.listdir(spill_dir),[])
+        pm_spilled = load_pattern_matrices('H')
+        for k in ['deltas','p_global','p_local']:
+            self.assertTrue(np.array_equal(pm[k],pm_spilled[k]))
+        #allocations (spilled vectors are not counted) stay within the budget,
+        #vectors in memory do not
+        peaks = []
+        for spill in [tempfile.mkdtemp(dir=spill_dir),None]:
+            tracemalloc.start()
+            try:
+                pattern_pvalues('H',gors,spill_dir=spill)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+            finally:
+                tracemalloc.stop()
+        self.assertTrue(peaks[0]<budget<peaks[1]<estimate_pattern_memory('H',gors),peaks)
+
+    def test_aggregate(self):
+        from scipy.stats import mannwhitneyu
+        gors = GOR_CLASSES[:3]
+        rois = get_species_rois('H',aggregate=('tiles',4))
+        res = prepare_pattern_matrices('H',gors=gors,rois=rois,suffix='_t',n_boot=20,aggregate=('tiles',4))
+        n = [sum(len(rois[a][r-1]) for a in INDICES for r in rg['roi_group']) for rg in gors]
+        self.assertEqual(res['estimate'],sum(n)*PATTERN_BYTES_PER_PIXEL+max(n)*TRANSIENT_BYTES_PER_PIXEL)
+        self.assertLess(res['estimate'],estimate_pattern_memory('H',gors)/8)
+        pm = load_pattern_matrices('H',suffix='_t')
+        self.assertEqual(pm.meta['aggregate'],['tiles',4])
+        #effect sizes of the aggregated vectors, as p-values
+        x,y = [np.concatenate([rois[a][r-1] for a in INDICES for r in rg['roi_group']]) for rg in gors[1:]]
+        u = mannwhitneyu(x,y,alternative='greater').statistic
+        self.assertAlmostEqual(pm['auc_global'][1,2],u/(len(x)*len(y)))
+        self.assertEqual(pm['auc_ci'].shape,(2,3,3))
+
+    def test_compare(self):
+        gors = GOR_CLASSES[:5]
+        prepare_pattern_matrices('H',gors=gors,n_boot=0)
+        prepare_pattern_matrices('H',gors=gors,n_boot=0,a_indices=INDICES[:8],suffix='_a')
+        prepare_pattern_matrices('H',gors=gors,n_boot=0,a_indices=INDICES[8:],suffix='_b')
+        groups = ['H',('H','_a'),('H','_b')]
+        comp = compare_pattern_matrices(groups,p=0.05)
+        self.assertIs(comp,compare_pattern_matrices(groups,p=0.05))
+        self.assertEqual(comp['categories'].shape,(3,3,5,5))
+        pms = [load_pattern_matrices(a,p=0.05,suffix=s) for a,s in [('H',''),('H','_a'),('H','_b')]]
+        for k in range(3):
+            for l in range(3):
+                dk,dl = np.sign(pms[k]['deltas']),np.sign(pms[l]['deltas'])
+                both = pms[k]['s_global']+pms[l]['s_global']==2
+                for r in range(5):
+                    for c in range(5):
+                        if r==c:
+                            expected = 0
+                        else:
+                            expected = (1 if dk[r,c]==dl[r,c] else 3 if dk[r,c]>dl[r,c] else 5)+(0 if both[r,c] else 1)
+                        self.assertEqual(comp['categories'][k,l,r,c],expected)
+        self.assertTrue(np.all(comp['local'][1,2]<=8))
+        self.assertSequenceEqual([g['short'] for g in comp['gors']],[g['short'] for g in gors])
+        self.assertSequenceEqual(list(comp['n_animals']),[len(INDICES),8,len(INDICES)-8])
+        prepare_pattern_matrices('H',gors=GOR_CLASSES[1:6],n_boot=0,suffix='_c')
+        with self.assertRaises(ValueError):
+            compare_pattern_matrices(['H',('H','_c')])
+
+    def test_import_time(self):
+        t,heavy = measure_import_time()
+        self.assertSequenceEqual(heavy,[])
+        self.assertLess(t,IMPORT_TIME_BUDGET)
+        self.assertIn('thermal_tiles',compute_modules())
+        _,loaded = measure_import_time(['thermal_stats'],watched=HEAVY_MODULES+LAZY_MODULES)
+        self.assertSequenceEqual(loaded,[])
+
+
+if __name__ == '__main__':
+    unittest.main()
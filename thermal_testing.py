@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Test helpers: a synthetic dataset
+
+The synthetic dataset has the layout of DS_DIR and is used by tests when
+the real dataset is not available. synthetic_dataset() selects it with
+thermal_utlis.use_dataset() for the current context only, DS_DIR is not
+modified, so code running concurrently (other threads) keeps reading
+its own dataset.
+
+usage (in a unittest.TestCase):
+    def setUp(self):
+        self.tmp = synthetic_fixture(self,indices=[1,2])
+"""
+import contextlib
+import os
+import shutil
+import tempfile
+import numpy as np
+import thermal_utlis
+from thermal_utlis import get_name,SCHEMA,ATYPES,INDICES
+
+
+def make_synthetic_dataset(ds_dir,atypes=ATYPES,indices=INDICES,shape=(60,80),seed=0):
+    """
+    writes a small synthetic dataset with the layout of DS_DIR
+    
+    parameters:
+        ds_dir: target directory
+        atypes: animal types
+        indices: animal indices
+        shape: shape of the frames
+        seed: random seed
+    """
+    os.makedirs(os.path.join(ds_dir,'data'),exist_ok=True)
+    rs = np.random.RandomState(seed)
+    #ROIs of SCHEMA on a grid with 3 rows
+    nc = -(-SCHEMA.n_rois//3)
+    rows = np.linspace(5,shape[0]-5,4).astype(int)
+    cols = np.linspace(5,shape[1]-5,nc+1).astype(int)
+    for atype in atypes:
+        for i in indices:
+            anno = np.zeros(shape,dtype=np.uint8 if SCHEMA.n_labels<=256 else np.uint16)
+            for k,c in enumerate(SCHEMA.roi_ids):
+                anno[rows[k//nc]:rows[k//nc+1],cols[k%nc]:cols[k%nc+1]] = c
+            offset = rs.rand()+(1.0 if atype=='H' else 0.0)
+            data = 10+rs.rand(*shape)*2
+            for k,c in enumerate(SCHEMA.roi_ids):
+                where = anno==c
+                data[where] = 15+0.5*(k+1)+offset+rs.randn(np.sum(where))
+            data = np.round(data,2)
+            np.savez_compressed(os.path.join(ds_dir,'data','da_{}.npz'.format(get_name(atype,i))),data=data,gt=anno)
+
+
+@contextlib.contextmanager
+def synthetic_dataset(ds_dir,**kwargs):
+    """
+    writes a synthetic dataset to ds_dir and uses it as the dataset of
+    the current context (kwargs: make_synthetic_dataset)
+
+    usage:
+        with synthetic_dataset(tmp+'/',indices=[1,2]) as ds_dir:
+            ...
+    """
+    from thermal_index import _index,index_file
+    make_synthetic_dataset(ds_dir,**kwargs)
+    with thermal_utlis.use_dataset(ds_dir):
+        try:
+            yield ds_dir
+        finally:
+            #the cached index of the dataset is dropped with it
+            if _index['file']==index_file():
+                _index['file'] = None
+
+
+def synthetic_fixture(test,**kwargs):
+    """
+    writes a synthetic dataset to a new temporary directory and uses it
+    for a unittest.TestCase, the dataset is left and removed by the test
+    cleanup (kwargs: make_synthetic_dataset)
+
+    returns:
+        the dataset directory (also usable for temporary files)
+    """
+    tmp = tempfile.mkdtemp(prefix='thermal_ds_')
+    test.addCleanup(shutil.rmtree,tmp)
+    ds = synthetic_dataset(tmp+'/',**kwargs)
+    ds_dir = ds.__enter__()
+    test.addCleanup(ds.__exit__,None,None,None)
+    return ds_dir
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Spatial aggregation of ROIs before GOR statistics
+
+Neighbouring pixels are strongly correlated, so ROIs can be reduced to
+mean temperatures of
+    'tiles': scale x scale blocks of the frame (a single bincount pass,
+        blocks mostly outside the ROI are dropped)
+    'slic': SLIC-style superpixels (k-means on position and temperature
+        inside the ROI, seeded with the tiles)
+Use get_species_rois(atype,aggregate=(method,scale)) from thermal_stats
+to run pattern matrices on aggregated ROIs, benchmark_scales() compares
+statistics and timings for several scales.
+"""
+import time
+import unittest
+import numpy as np
+import thermal_utlis
+from thermal_utlis import label_bboxes,extract_rois,GOR_CLASSES,SCHEMA
+
+
+def tile_rois(data,anno,scale,labels=None,min_fraction=0.5,bboxes=None):
+    """
+    returns ROIs reduced to block-averaged tiles
+
+    parameters:
+        data: 2D array of thermal data
+        anno: 2D array with class map
+        scale: tile size in pixels
+        labels: ROI ids (None: SCHEMA.roi_ids)
+        min_fraction: min. fraction of ROI pixels in a tile (tiles of
+            a ROI are all kept if none reaches it)
+        bboxes: None or the result of label_bboxes(anno), the frame is
+            cropped to the tiles of the animal silhouette
+
+    returns:
+        list of vectors of tile means (tiles in the row-major order)
+    """
+    labels = SCHEMA.roi_ids if labels is None else labels
+    n_labels = SCHEMA.n_labels
+    if bboxes is not None:
+        r0,r1,c0,c1 = bboxes[0]
+        r0,c0 = r0//scale*scale,c0//scale*scale
+        data,anno = data[r0:r1,c0:c1],anno[r0:r1,c0:c1]
+    h,w = anno.shape
+    nr,nc = -(-h//scale),-(-w//scale)
+    key = (anno.astype(np.int64)*nr+(np.arange(h)//scale)[:,np.newaxis])*nc+(np.arange(w)//scale)[np.newaxis,:]
+    counts = np.bincount(key.ravel(),minlength=n_labels*nr*nc).reshape(n_labels,-1)
+    sums = np.bincount(key.ravel(),weights=data.ravel(),minlength=n_labels*nr*nc).reshape(n_labels,-1)
+    min_pixels = max(1,int(np.ceil(min_fraction*scale*scale)))
+    res = []
+    for c in labels:
+        keep = counts[c]>=min_pixels
+        if not np.any(keep):
+            keep = counts[c]>0
+        res.append(sums[c][keep]/counts[c][keep])
+    return res
+
+
+def _slic(y,x,t,scale,compactness,n_iter,chunk):
+    """
+    SLIC-style clustering of pixels of a single ROI, returns cluster means
+    """
+    cell = (y//scale).astype(np.int64)*(int(x.max())//scale+1)+x//scale
+    _,assign = np.unique(cell,return_inverse=True)
+    k = assign.max()+1
+    w = (compactness/scale)**2
+    for _ in range(n_iter):
+        n = np.bincount(assign,minlength=k)
+        keep = n>0
+        cy,cx,ct = [np.bincount(assign,weights=v,minlength=k)[keep]/n[keep] for v in (y,x,t)]
+        assign = _assign(y,x,t,cy,cx,ct,scale,w,chunk)
+        k = len(ct)
+    n = np.bincount(assign,minlength=k)
+    return np.bincount(assign,weights=t,minlength=k)[n>0]/n[n>0]
+
+
+def _assign(y,x,t,cy,cx,ct,scale,w,chunk):
+    """
+    assigns pixels to the nearest cluster centre within 2*scale pixels
+    (or to the spatially nearest one if there are none)
+    """
+    assign = np.empty(len(t),dtype=np.int64)
+    for i in range(0,len(t),chunk):
+        dy = y[i:i+chunk,np.newaxis]-cy
+        dx = x[i:i+chunk,np.newaxis]-cx
+        s = dy**2+dx**2
+        d = (t[i:i+chunk,np.newaxis]-ct)**2+w*s
+        d[np.logical_or(np.abs(dy)>2*scale,np.abs(dx)>2*scale)] = np.inf
+        assign[i:i+chunk] = np.argmin(d,axis=1)
+        lost = np.isinf(d[np.arange(len(d)),assign[i:i+chunk]])
+        if np.any(lost):
+            assign[i:i+chunk][lost] = np.argmin(s[lost],axis=1)
+    return assign
+
+
+def slic_rois(data,anno,scale,labels=None,compactness=1.0,n_iter=5,bboxes=None,chunk=4096):
+    """
+    returns ROIs reduced to mean temperatures of SLIC-style superpixels
+
+    parameters:
+        data: 2D array of thermal data
+        anno: 2D array with class map
+        scale: superpixel size (grid spacing of seeds) in pixels
+        labels: ROI ids (None: SCHEMA.roi_ids)
+        compactness: temperature difference (deg. C) equivalent to
+            a distance of scale pixels
+        n_iter: number of k-means iterations
+        bboxes: None or the result of label_bboxes(anno)
+        chunk: number of pixels assigned at once
+
+    returns:
+        list of vectors of superpixel means
+    """
+    labels = SCHEMA.roi_ids if labels is None else labels
+    bboxes = label_bboxes(anno) if bboxes is None else bboxes
+    res = []
+    for c in labels:
+        r0,r1,c0,c1 = bboxes[c]
+        y,x = np.nonzero(anno[r0:r1,c0:c1]==c)
+        t = data[r0:r1,c0:c1][y,x].astype(np.float64)
+        if len(t)==0:
+            res.append(t)
+            continue
+        res.append(_slic(y.astype(np.float64),x.astype(np.float64),t,scale,compactness,n_iter,chunk))
+    return res
+
+
+def aggregate_rois(data,anno,method='tiles',scale=4,bboxes=None):
+    """
+    returns aggregated ROI vectors of a frame (scale 1 gives pixels)
+
+    parameters:
+        data: 2D array of thermal data
+        anno: 2D array with class map
+        method: 'tiles' or 'slic'
+        scale: size of tiles/superpixels in pixels
+        bboxes: None or the result of label_bboxes(anno)
+    """
+    assert method in ['tiles','slic'],method
+    if scale<=1:
+        return extract_rois(data,anno,bboxes)
+    if method=='tiles':
+        return tile_rois(data,anno,scale,bboxes=bboxes)
+    return slic_rois(data,anno,scale,bboxes=bboxes)
+
+
+def benchmark_scales(atype='H',scales=[1,2,4,8,16],method='tiles',gors=GOR_CLASSES,p=0.001):
+    """
+    prints how data volume, pattern matrix statistics and timings change
+    with the aggregation scale
+
+    returns:
+        list of dictionaries (one per scale): scale, n_values, time_rois,
+        time_matrices, significant (fraction of GOR pairs with p<p), deltas
+    """
+    from thermal_stats import get_species_rois,prepare_pattern_matrices,load_pattern_matrices
+    res = []
+    print ("scale, values, aggregation [s], matrices [s], significant, max |delta difference|")
+    for scale in scales:
+        t = time.time()
+        rois = get_species_rois(atype,aggregate=(method,scale))
+        t_rois = time.time()-t
+        t = time.time()
+        suffix = '_{}{}'.format(method,scale)
+        prepare_pattern_matrices(atype,gors=gors,rois=rois,suffix=suffix,n_boot=0,aggregate=(method,scale))
+        t_pm = time.time()-t
+        pm = load_pattern_matrices(atype,p=p,suffix=suffix)
+        N = len(gors)
+        r = {'scale':scale,'n_values':sum(len(v) for a in rois for v in rois[a]),'time_rois':t_rois
+             ,'time_matrices':t_pm,'significant':(np.sum(pm['s_global'])-np.trace(pm['s_global']))/float(N*(N-1))
+             ,'deltas':np.array(pm['deltas'])}
+        res.append(r)
+        print ("{}, {}, {:0.2f}, {:0.2f}, {:0.3f}, {:0.3f}".format(scale,r['n_values'],t_rois,t_pm,r['significant']
+                                                                 ,np.max(np.abs(r['deltas']-res[0]['deltas']))))
+    return res
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from thermal_testing import synthetic_fixture
+        self.tmp = synthetic_fixture(self,atypes=['H'],indices=[1])
+        self.data,self.anno = thermal_utlis.get_animal('H.1')
+
+    def test_tiles(self):
+        pixels = extract_rois(self.data,self.anno)
+        tiles = tile_rois(self.data,self.anno,1)
+        self.assertTrue(all(np.allclose(a,b) for a,b in zip(pixels,tiles)))
+        tiles = tile_rois(self.data,self.anno,4,min_fraction=0)
+        for c in [0,7]:
+            where = np.argwhere(self.anno==c+1)
+            blocks = {}
+            for (r,cc),v in zip(where,self.data[self.anno==c+1]):
+                blocks.setdefault((r//4,cc//4),[]).append(v)
+            self.assertTrue(np.allclose(tiles[c],[np.mean(blocks[k]) for k in sorted(blocks)]))
+        bboxes = label_bboxes(self.anno)
+        for scale in [3,4]:
+            full = tile_rois(self.data,self.anno,scale)
+            cropped = aggregate_rois(self.data,self.anno,'tiles',scale,bboxes=bboxes)
+            self.assertTrue(all(np.array_equal(a,b) for a,b in zip(full,cropped)))
+
+    def test_slic(self):
+        pixels = extract_rois(self.data,self.anno)
+        sp = slic_rois(self.data,self.anno,4)
+        for v,s in zip(pixels,sp):
+            self.assertTrue(len(v)/32<len(s)<len(v)/8)
+            self.assertTrue(np.min(v)<=np.min(s) and np.max(s)<=np.max(v))
+            self.assertAlmostEqual(np.mean(s),np.mean(v),delta=0.2)
+
+    def test_assign(self):
+        #the 2nd pixel has no centre within 2*scale: the spatially nearest one
+        #is used (not the first centre)
+        y,x,t = np.array([1.,50.,98.]),np.array([1.,60.,99.]),np.array([30.,20.,30.])
+        cy,cx,ct = np.array([0.,100.]),np.array([0.,100.]),np.array([30.,30.])
+        for chunk in [1,4096]:
+            self.assertSequenceEqual(list(_assign(y,x,t,cy,cx,ct,4,1.0,chunk)),[0,1,1])
+
+
+if __name__ == '__main__':
+    benchmark_scales('H')
+    benchmark_scales('H',scales=[1,4,8],method='slic')
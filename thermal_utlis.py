@@ -26,13 +26,19 @@ preprint: http://arxiv.org/abs/2010.09302
 
 data loading and basic utility functions
 """
+import contextlib
+import contextvars
+import os
 import unittest
 import numpy as np
-from scipy.stats import mannwhitneyu
+from thermal_ranks import mww_sorted,sorted_prefix
+from thermal_schema import get_schema
 
 
 #a patch to your DS location
 DS_DIR = 'hdthermal_dataset/'
+#dataset directory selected for the current context (None: DS_DIR), see use_dataset
+_ds_dir = contextvars.ContextVar('thermal_ds_dir',default=None)
  
 #H for horses, D for donkeys
 ATYPES = ['H','D']
@@ -41,23 +47,41 @@ INDICES = [1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16]
 #anomalies (donkeys)
 ANOMALOUS_DONKEY_INDICES=[17,18]
 
+#ROI/GOR schema (THERMAL_SCHEMA or the 15-ROI protocol, see thermal_schema)
+SCHEMA = get_schema()
 #GORS
-GOR_CLASSES = [{'roi_group':[1,2,3],'group_name':'Neck','short':'Neck'}
-                     ,{'roi_group':[1,2,3,4,14,15],'group_name':'Frontquarter','short':'Front.'}
-                     ,{'roi_group':[5,11],'group_name':'Trunk','short':'Trunk'}
-                     ,{'roi_group':[6,7,8,9,10],'group_name':'Hindquarter','short':'Hind.'}
-                     ,{'roi_group':[8,9],'group_name':'Rump','short':'Rump'}
-                     ,{'roi_group':[3,4,5,6],'group_name':'Dorsal aspect','short':'Dors.'}
-                     ,{'roi_group':[9,10,11,12,13],'group_name':'Ventral aspect','short':'Vent.'}
-                     ,{'roi_group':[11],'group_name':'Abdomen','short':'Abdom.'}
-                     ,{'roi_group':[10,12],'group_name':'Groins','short':'Groins'}
-                     ,{'roi_group':[9,13],'group_name':'Legs','short':'Legs'}
-                     ]
+GOR_CLASSES = SCHEMA.gors
 
 #global show(True) / savefig (False) switch
 GLOBAL_SHOW = True
 
 
+def get_ds_dir():
+    """
+    returns the dataset directory: DS_DIR or the one selected by
+    use_dataset() in the current context
+    """
+    ds_dir = _ds_dir.get()
+    return DS_DIR if ds_dir is None else ds_dir
+
+
+@contextlib.contextmanager
+def use_dataset(ds_dir):
+    """
+    selects a dataset directory for the current context (thread or
+    asyncio task), DS_DIR and other threads are not affected
+
+    usage:
+        with use_dataset('other_dataset/'):
+            data,anno = get_animal('H.1')
+    """
+    token = _ds_dir.set(ds_dir)
+    try:
+        yield ds_dir
+    finally:
+        _ds_dir.reset(token)
+
+
 def get_animal(name):
     """
     returns data and annotation for the animal
@@ -68,7 +92,7 @@ def get_animal(name):
         data: 2D array of thermal data
         anno: 2D array with class map 
     """
-    arr = np.load("{}data/da_{}.npz".format(DS_DIR,name))
+    arr = np.load("{}data/da_{}.npz".format(get_ds_dir(),name))
     return arr['data'],arr['gt']
 
 
@@ -86,40 +110,126 @@ def get_name(atype='H',index=1):
     return '{}.{}'.format(atype,index)
 
 
+def label_bboxes(anno,n_labels=None):
+    """
+    returns bounding boxes of all labels of an annotation (a single pass)
+    
+    parameters:
+        anno: 2D array with class map
+        n_labels: number of labels (None: SCHEMA.n_labels)
+    
+    returns:
+        array (n_labels x 4) of boxes [r0,r1,c0,c1] (anno[r0:r1,c0:c1]),
+        row 0 is the box of the animal silhouette (all labels>0),
+        missing labels get [0,0,0,0]
+    """
+    n_labels = SCHEMA.n_labels if n_labels is None else n_labels
+    a = anno.astype(np.intp)
+    h,w = a.shape
+    rows = np.zeros((n_labels,h),dtype=bool)
+    cols = np.zeros((n_labels,w),dtype=bool)
+    rows[a,np.arange(h)[:,np.newaxis]] = True
+    cols[a,np.arange(w)[np.newaxis,:]] = True
+    rows[0] = np.any(rows[1:],axis=0)
+    cols[0] = np.any(cols[1:],axis=0)
+    res = np.stack([np.argmax(rows,axis=1),h-np.argmax(rows[:,::-1],axis=1)
+                    ,np.argmax(cols,axis=1),w-np.argmax(cols[:,::-1],axis=1)],axis=1)
+    res[~np.any(rows,axis=1)] = 0
+    return res.astype(np.int32)
+
+
+def label_geometry(anno,n_labels=None):
+    """
+    returns areas and perimeters of all labels of an annotation
+    (bincounts over the label map, temperatures are not used)
+    
+    parameters:
+        anno: 2D array with class map
+        n_labels: number of labels (None: SCHEMA.n_labels)
+    
+    returns:
+        area: array (n_labels) of numbers of pixels
+        perimeter: array (n_labels) of numbers of pixel edges between
+            the label and other labels or the frame border
+    """
+    n_labels = SCHEMA.n_labels if n_labels is None else n_labels
+    a = anno.astype(np.intp)
+    count = lambda v: np.bincount(v.ravel(),minlength=n_labels)
+    area = count(a)
+    perimeter = count(a[0])+count(a[-1])+count(a[:,0])+count(a[:,-1])
+    for x,y in [(a[:,1:],a[:,:-1]),(a[1:],a[:-1])]:
+        edge = x!=y
+        perimeter += count(x[edge])+count(y[edge])
+    return area,perimeter
+
+
+def extract_rois(data,anno,bboxes=None,labels=None):
+    """
+    returns ROI vectors of a frame, each ROI is masked only inside 
+    its bounding box
+    
+    parameters:
+        data: 2D array of thermal data
+        anno: 2D array with class map
+        bboxes: None or the result of label_bboxes(anno)
+        labels: ROI ids (None: SCHEMA.roi_ids)
+    
+    returns:
+        list of ROI vectors (pixels in the row-major order)
+    """
+    labels = SCHEMA.roi_ids if labels is None else labels
+    bboxes = label_bboxes(anno) if bboxes is None else bboxes
+    res = []
+    for c in labels:
+        r0,r1,c0,c1 = bboxes[c]
+        res.append(data[r0:r1,c0:c1][anno[r0:r1,c0:c1]==c])
+    return res
+
+
 def get_animal_rois(name):
     """
     returns list of ROIs for a given animal
+    (bounding boxes are taken from the dataset index if it exists)
     
     parameters: 
         name - animal name
     
     returns: 
-        list of 15 ROIs
+        list of ROIs (in the order of SCHEMA.roi_ids)
     
     """
+    from thermal_index import indexed_bboxes
     arr,anno = get_animal(name)
-    res = []
-    for c in range(1,16):
-        res.append(arr[anno==c].tolist())
-    return res
+    return [v.tolist() for v in extract_rois(arr,anno,indexed_bboxes(name))]
 
-def mww_test(hot,cold,p=0.001,alternative='greater'):
+def mww_pvalue(hot,cold,alternative='greater',hot_sorted=None,cold_sorted=None):
+    """
+    p-value of the wilcoxon test (samples truncated to the same length)
+    parameters:
+        hot - 1st sequence
+        cold - 2nd sequence
+        alternative - 'greater','less' or 'two-sided'
+        hot_sorted, cold_sorted - optional results of thermal_ranks.presort()
+            for hot/cold, reused between calls to avoid sorting
+    """
+    mm = np.min([len(hot),len(cold)])
+    h = sorted_prefix(hot,mm,hot_sorted)
+    c = sorted_prefix(cold,mm,cold_sorted)
+    _,s_p = mww_sorted(h,c,alternative=alternative)
+    return s_p
+
+def mww_test(hot,cold,p=0.001,alternative='greater',hot_sorted=None,cold_sorted=None):
     """
     wilcoxon test of statistical significance
     parameters:
         hot - 1st sequence
         cold - 2nd sequence
         p- required p
+        hot_sorted, cold_sorted - optional results of thermal_ranks.presort()
+            for hot/cold, reused between calls to avoid sorting
     """
-    h = hot.copy()
-    c = cold.copy()
-    
-    
-    mm = np.min([len(h),len(c)])
-    np.random.shuffle(h.copy())
-    np.random.shuffle(c.copy())
-    _,s_p = mannwhitneyu(h[:mm],c[:mm],alternative=alternative)
-    return s_p<p
+    return mww_pvalue(hot,cold,alternative=alternative,hot_sorted=hot_sorted,cold_sorted=cold_sorted)<p
+
 
 class Test(unittest.TestCase):
     def test_load(self):
@@ -128,9 +238,9 @@ class Test(unittest.TestCase):
                     aname = get_name(atype,i)
                     data,anno = get_animal(aname)
                     self.assertSequenceEqual(list(data.shape),list(anno.shape))
-                    self.assertSequenceEqual(np.unique(anno).tolist(),np.arange(16).tolist())
+                    self.assertSequenceEqual(np.unique(anno).tolist(),[0]+SCHEMA.roi_ids.tolist())
                     rois = get_animal_rois(aname)
-                    self.assertEqual(len(rois),15)
+                    self.assertEqual(len(rois),SCHEMA.n_rois)
                     for roi in rois:
                         self.assertTrue(10<=np.mean(roi)<=35)
     def test_mww(self):
@@ -139,6 +249,8 @@ class Test(unittest.TestCase):
         self.assertTrue(mww_test(o,z,p=0.001))    
         self.assertFalse(mww_test(o,o,p=0.001))
         self.assertFalse(mww_test(z,o,p=0.001))                        
+        self.assertTrue(np.isnan(mww_pvalue(np.array([]),np.array([1.,2.]))))
+        self.assertFalse(mww_test(np.array([]),o,p=0.001))
                     
                     
 if __name__ == '__main__':
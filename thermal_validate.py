@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+************************************************************************
+Copyright 2020 Institute of Theoretical and Applied Informatics,
+Polish Academy of Sciences (ITAI PAS) https://www.iitis.pl
+author: M. Romaszewszki, mromaszewski@iitis.pl
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+************************************************************************
+
+Code for experiments in the paper by
+M. Domino, M. Romaszewski,  T. Jasinski,  M. Masko
+`Comparison of surface thermal patterns of horses and donkeys in IRT images'
+preprint: http://arxiv.org/abs/2010.09302
+
+Dataset validation
+
+Archives are checked in parallel (worker processes): SHA-256 digest against
+the manifest (DS_DIR/manifest.json), presence of 'data' and 'gt', shape
+match, label map completeness (background and ROIs of thermal_utlis.SCHEMA),
+NaN/inf values and the temperature range. The report
+(DS_DIR/validation.json) records digests and file stamps (size,
+modification time): unchanged files are not re-validated and get_digest()
+serves the recorded digests to downstream caches.
+
+usage:
+    python thermal_validate.py [--workers N] [--force] [--write-manifest]
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import thermal_utlis
+from thermal_utlis import get_name,ATYPES,INDICES,ANOMALOUS_DONKEY_INDICES,SCHEMA
+
+MANIFEST_FILE = 'manifest.json'
+REPORT_FILE = 'validation.json'
+#valid temperatures (the range of the thermal_index histogram grid)
+TEMP_RANGE = (0.0,50.0)
+#digests served by get_digest(): (dataset directory, name) -> (stamp, digest)
+_digests = {}
+
+
+def all_names():
+    """
+    returns names of all animals in the dataset
+    """
+    return [get_name(atype,i) for atype in ATYPES
+            for i in INDICES+(ANOMALOUS_DONKEY_INDICES if atype=='D' else [])]
+
+
+def animal_file(name,ds_dir=None):
+    ds_dir = thermal_utlis.get_ds_dir() if ds_dir is None else ds_dir
+    return "{}data/da_{}.npz".format(ds_dir,name)
+
+
+def file_stamp(fname):
+    """
+    returns a stamp of a file (size, modification time)
+    """
+    st = os.stat(fname)
+    return '{}:{}'.format(st.st_size,st.st_mtime_ns)
+
+
+def file_digest(fname,chunk=1<<20):
+    """
+    returns the SHA-256 digest of a file
+    """
+    h = hashlib.sha256()
+    with open(fname,'rb') as f:
+        for block in iter(lambda: f.read(chunk),b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def check_animal(fname):
+    """
+    validates one animal archive (runs in a worker process)
+
+    returns:
+        dictionary with the digest, stamp, frame properties and a list
+        of errors (empty for a valid archive)
+    """
+    res = {'stamp':file_stamp(fname),'digest':file_digest(fname),'errors':[]}
+    errors = res['errors']
+    try:
+        arr = np.load(fname,allow_pickle=False)
+        missing = [k for k in ['data','gt'] if k not in arr.files]
+        if missing:
+            errors.append("missing arrays: {}".format(missing))
+            return res
+        data,anno = arr['data'],arr['gt']
+    except Exception as e:
+        errors.append("unreadable archive: {}".format(e))
+        return res
+    res['shape'] = list(data.shape)
+    if data.ndim!=2:
+        errors.append("data is not 2D: {}".format(data.shape))
+    if data.shape!=anno.shape:
+        errors.append("data/gt shape mismatch: {} vs {}".format(data.shape,anno.shape))
+        return res
+    labels = np.unique(anno)
+    res['labels'] = labels.tolist()
+    unknown = [int(c) for c in labels if c!=0 and not SCHEMA.is_roi(c)]
+    missing = sorted(set([0]+SCHEMA.roi_ids.tolist())-set(int(c) for c in labels))
+    if unknown:
+        errors.append("unknown labels: {}".format(unknown))
+    if missing:
+        errors.append("missing labels: {}".format(missing))
+    finite = np.isfinite(data)
+    res['n_nonfinite'] = int(data.size-np.count_nonzero(finite))
+    if res['n_nonfinite']>0:
+        errors.append("{} NaN/inf values".format(res['n_nonfinite']))
+    if np.any(finite):
+        res['min'],res['max'] = float(np.min(data[finite])),float(np.max(data[finite]))
+        if res['min']<TEMP_RANGE[0] or res['max']>TEMP_RANGE[1]:
+            errors.append("temperatures outside {}: {:0.2f}..{:0.2f}".format(TEMP_RANGE,res['min'],res['max']))
+    return res
+
+
+def _read_json(fname):
+    if not os.path.exists(fname):
+        return None
+    with open(fname) as f:
+        return json.load(f)
+
+
+def _write_json(obj,fname):
+    """
+    atomically writes a JSON file (a unique temporary file is renamed, so
+    concurrent writers do not clobber each other)
+    """
+    f,tmp = tempfile.mkstemp(dir=os.path.dirname(fname) or '.',prefix='.'+os.path.basename(fname),suffix='.tmp')
+    try:
+        with os.fdopen(f,'w') as fo:
+            json.dump(obj,fo,indent=1,sort_keys=True)
+        os.replace(tmp,fname)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def load_manifest():
+    """
+    returns the manifest {name: digest} or None if there is none
+    """
+    return _read_json(os.path.join(thermal_utlis.get_ds_dir(),MANIFEST_FILE))
+
+
+def validate_dataset(names=None,workers=None,force=False,write_manifest=False,save=True):
+    """
+    validates the dataset archives
+
+    parameters:
+        names: animals to validate (all_names() if None)
+        workers: number of worker processes (None: number of CPUs)
+        force: True/False: re-validate files unchanged since the last report
+        write_manifest: True/False: record current digests as the manifest
+        save: True/False: write the report to DS_DIR/REPORT_FILE
+
+    returns:
+        report: dictionary with 'valid' (True/False) and 'files'
+        {name: result of check_animal() with 'manifest' status}
+    """
+    names = all_names() if names is None else list(names)
+    report_file = os.path.join(thermal_utlis.get_ds_dir(),REPORT_FILE)
+    previous = (_read_json(report_file) or {}).get('files',{})
+    files = {}
+    todo = []
+    for name in names:
+        fname = animal_file(name)
+        if not os.path.exists(fname):
+            files[name] = {'errors':["missing file: {}".format(fname)]}
+        elif not force and name in previous and previous[name].get('stamp')==file_stamp(fname):
+            files[name] = previous[name]
+        else:
+            todo.append(name)
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            for name,res in zip(todo,ex.map(check_animal,[animal_file(n) for n in todo])):
+                files[name] = res
+    manifest = load_manifest()
+    if write_manifest:
+        manifest = dict(manifest or {})
+        manifest.update({n:r['digest'] for n,r in files.items() if 'digest' in r})
+        _write_json(manifest,os.path.join(thermal_utlis.get_ds_dir(),MANIFEST_FILE))
+    for name,res in files.items():
+        res['errors'] = [e for e in res['errors'] if not e.startswith('digest')]
+        if manifest is None or 'digest' not in res:
+            res['manifest'] = 'none'
+        elif name not in manifest:
+            res['manifest'] = 'missing'
+        elif manifest[name]==res['digest']:
+            res['manifest'] = 'ok'
+        else:
+            res['manifest'] = 'mismatch'
+            res['errors'].append("digest mismatch with the manifest")
+    report = {'valid':all(len(r['errors'])==0 for r in files.values()),'files':files}
+    if save:
+        merged = dict(previous)
+        merged.update(files)
+        _write_json({'valid':all(len(r['errors'])==0 for r in merged.values()),'files':merged},report_file)
+    return report
+
+
+def get_digest(name):
+    """
+    returns the SHA-256 digest of an animal archive, taken from the
+    validation report if the file has not changed since
+    """
+    fname = animal_file(name)
+    stamp = file_stamp(fname)
+    key = (thermal_utlis.get_ds_dir(),name)
+    if key in _digests and _digests[key][0]==stamp:
+        return _digests[key][1]
+    res = ((_read_json(os.path.join(thermal_utlis.get_ds_dir(),REPORT_FILE)) or {}).get('files',{})).get(name,{})
+    digest = res['digest'] if res.get('stamp')==stamp and 'digest' in res else file_digest(fname)
+    _digests[key] = (stamp,digest)
+    return digest
+
+
+def print_report(report):
+    for name,res in sorted(report['files'].items()):
+        if res['errors']:
+            print ("{}: {}".format(name,'; '.join(res['errors'])))
+    n_bad = sum(1 for r in report['files'].values() if r['errors'])
+    print ("{} files, {} invalid".format(len(report['files']),n_bad))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='validates the dataset archives')
+    parser.add_argument('--workers',type=int,default=None,help='number of worker processes')
+    parser.add_argument('--force',action='store_true',help='re-validate unchanged files')
+    parser.add_argument('--write-manifest',action='store_true',help='record current digests as the manifest')
+    args = parser.parse_args(argv)
+    report = validate_dataset(workers=args.workers,force=args.force,write_manifest=args.write_manifest)
+    print_report(report)
+    return 0 if report['valid'] else 1
+
+
+class Test(unittest.TestCase):
+    def setUp(self):
+        from thermal_testing import synthetic_fixture
+        self.tmp = synthetic_fixture(self,indices=[1,2])
+        self.names = ['H.1','H.2','D.1','D.2']
+
+    def test_validate(self):
+        report = validate_dataset(self.names,workers=2,write_manifest=True)
+        self.assertTrue(report['valid'])
+        self.assertEqual(report['files']['H.1']['manifest'],'ok')
+        self.assertEqual(report['files']['D.2']['digest'],file_digest(animal_file('D.2')))
+        fname = animal_file('D.1')
+        arr = dict(np.load(fname))
+        arr['data'][0,0] = np.nan
+        arr['data'][1,1] = 80
+        arr['gt'][arr['gt']==7] = 0
+        np.savez_compressed(fname,**arr)
+        report = validate_dataset(self.names+['H.3'],workers=2)
+        self.assertFalse(report['valid'])
+        errors = report['files']['D.1']['errors']
+        self.assertEqual(len(errors),4,errors)
+        self.assertEqual(report['files']['D.1']['manifest'],'mismatch')
+        self.assertEqual(len(report['files']['H.3']['errors']),1)
+        self.assertEqual(get_digest('D.1'),file_digest(fname))
+
+    def test_skip_unchanged(self):
+        validate_dataset(self.names,workers=1)
+        report_file = os.path.join(self.tmp,REPORT_FILE)
+        with open(report_file) as f:
+            report = json.load(f)
+        report['files']['H.1']['digest'] = 'cached'
+        _write_json(report,report_file)
+        self.assertEqual(validate_dataset(self.names,workers=1)['files']['H.1']['digest'],'cached')
+        self.assertNotEqual(validate_dataset(self.names,workers=1,force=True)['files']['H.1']['digest'],'cached')
+
+    def test_write_json(self):
+        from concurrent.futures import ThreadPoolExecutor
+        fname = os.path.join(self.tmp,'out.json')
+        with ThreadPoolExecutor(4) as ex:
+            list(ex.map(lambda i: _write_json({'i':i,'v':list(range(10000))},fname),range(16)))
+        self.assertIn(_read_json(fname)['i'],range(16))
+        self.assertSequenceEqual(sorted(f for f in os.listdir(self.tmp) if f.endswith('.tmp')),[])
+
+
+if __name__ == '__main__':
+    sys.exit(main())